@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+AIMD ограничитель числа запросов в полете
+
+Окно растет на ~1 запрос за каждое окно успешных ответов, пока TTFT ниже
+цели (additive increase), и умножается на decrease при росте TTFT,
+ответах 429/503, очереди на сервере (num_requests_waiting) или почти
+заполненном KV cache (multiplicative decrease). Так клиент держит сервер
+загруженным, не доводя его до preemption и лавинообразного роста очереди
+(особенно заметного с --cpu-offload-gb).
+
+Каждое изменение окна записывается в JSONL (log_path) для подбора параметров.
+"""
+
+import asyncio
+import json
+import time
+from dataclasses import asdict, dataclass
+from typing import Callable, Optional
+
+from server_metrics import MetricsSnapshot, afetch_metrics
+
+# Коды, которыми сервер (или прокси перед ним) сообщает о перегрузке
+OVERLOAD_STATUSES = (429, 503)
+
+
+@dataclass
+class LimiterDecision:
+    """Одно изменение окна"""
+    time: float
+    action: str  # increase | decrease
+    reason: str
+    limit: float
+    in_flight: int
+
+
+class AdaptiveConcurrency:
+    """
+    Замена asyncio.Semaphore с изменяемым размером окна
+
+    Использование:
+        async with limiter:
+            ... запрос ...
+            limiter.on_success(ttft)   # или limiter.on_error(status)
+    """
+
+    def __init__(
+        self,
+        initial: int = 8,
+        min_limit: int = 1,
+        max_limit: int = 256,
+        ttft_target: float = 2.0,
+        increase: float = 1.0,
+        decrease: float = 0.7,
+        max_waiting: int = 8,
+        max_kv_usage: float = 0.95,
+        cooldown: Optional[float] = None,
+        log_path: Optional[str] = None,
+        on_decision: Optional[Callable[[LimiterDecision], None]] = None,
+    ):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.ttft_target = ttft_target
+        self.increase = increase
+        self.decrease = decrease
+        self.max_waiting = max_waiting
+        self.max_kv_usage = max_kv_usage
+        # Ответы на запросы, отправленные до уменьшения окна, еще придут
+        # медленными - не уменьшать окно чаще раза в cooldown секунд
+        self.cooldown = ttft_target if cooldown is None else cooldown
+        self.log_path = log_path
+        self.on_decision = on_decision
+        self.in_flight = 0
+        self.decisions = 0
+        self._last_decrease = 0.0
+        self._condition: Optional[asyncio.Condition] = None
+
+    # --- слоты ---
+
+    def _get_condition(self) -> asyncio.Condition:
+        # Condition привязан к event loop - создаем при первом использовании
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    async def acquire(self) -> None:
+        condition = self._get_condition()
+        async with condition:
+            await condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def release(self) -> None:
+        condition = self._get_condition()
+        async with condition:
+            self.in_flight -= 1
+            condition.notify_all()
+
+    async def __aenter__(self) -> "AdaptiveConcurrency":
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.release()
+
+    # --- обратная связь ---
+
+    def _record(self, action: str, reason: str) -> None:
+        decision = LimiterDecision(
+            time=time.time(),
+            action=action,
+            reason=reason,
+            limit=round(self.limit, 2),
+            in_flight=self.in_flight,
+        )
+        self.decisions += 1
+        if self.log_path:
+            with open(self.log_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(asdict(decision), ensure_ascii=False) + "\n")
+        if self.on_decision:
+            self.on_decision(decision)
+
+    def _notify(self) -> None:
+        # Окно выросло - разбудить ожидающих (без блокировки, из sync кода)
+        if self._condition is not None:
+            async def wake():
+                async with self._condition:
+                    self._condition.notify_all()
+            asyncio.get_running_loop().create_task(wake())
+
+    def _grow(self, reason: str) -> None:
+        # Окно растет, только если реально используется целиком
+        if self.in_flight < int(self.limit) - 1 or self.limit >= self.max_limit:
+            return
+        before = int(self.limit)
+        self.limit = min(self.max_limit, self.limit + self.increase / self.limit)
+        if int(self.limit) > before:
+            self._record("increase", reason)
+            self._notify()
+
+    def _shrink(self, reason: str) -> None:
+        now = time.monotonic()
+        if now - self._last_decrease < self.cooldown:
+            return
+        self._last_decrease = now
+        self.limit = max(float(self.min_limit), self.limit * self.decrease)
+        self._record("decrease", reason)
+
+    def on_success(self, ttft: Optional[float] = None) -> None:
+        """Успешный ответ; ttft - время до первого токена (None если не измерено)"""
+        if ttft is not None and ttft > self.ttft_target:
+            self._shrink(f"ttft {ttft:.2f}s > {self.ttft_target:.2f}s")
+        else:
+            self._grow("ok" if ttft is None else f"ttft {ttft:.2f}s")
+
+    def on_error(self, status: Optional[int] = None) -> None:
+        """Ошибка запроса; status - HTTP код (None - ошибка соединения/таймаут)"""
+        if status in OVERLOAD_STATUSES:
+            self._shrink(f"HTTP {status}")
+        elif status is None:
+            self._shrink("connection error/timeout")
+
+    def on_metrics(self, snapshot: MetricsSnapshot) -> None:
+        """Сигналы перегрузки из /metrics сервера"""
+        waiting = snapshot.waiting
+        kv_usage = snapshot.kv_cache_usage
+        if waiting is not None and waiting > self.max_waiting:
+            self._shrink(f"num_requests_waiting {waiting:.0f} > {self.max_waiting}")
+        elif kv_usage is not None and kv_usage > self.max_kv_usage:
+            self._shrink(f"kv_cache_usage {kv_usage:.0%} > {self.max_kv_usage:.0%}")
+
+    async def poll_metrics(self, session, api_url: str, interval: float = 1.0) -> None:
+        """Фоновая задача: снимать /metrics каждые interval секунд"""
+        while True:
+            try:
+                self.on_metrics(await afetch_metrics(session, api_url))
+            except Exception:
+                # /metrics недоступен (прокси, старый сервер) - работаем по TTFT и кодам
+                pass
+            await asyncio.sleep(interval)
+
+
+def print_decision(decision: LimiterDecision) -> None:
+    """on_decision для CLI"""
+    arrow = "⬆️ " if decision.action == "increase" else "⬇️ "
+    print(f"   {arrow} окно {decision.limit:.1f} (в полете {decision.in_flight}): {decision.reason}")
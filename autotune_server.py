@@ -0,0 +1,635 @@
+#!/usr/bin/env python3
+"""
+Автоподбор параметров планировщика vLLM под SLO задержек
+
+Для каждой конфигурации (max_num_seqs, max_num_batched_tokens, chunked
+prefill, gpu_memory_utilization) сервер перезапускается, проигрывается
+записанная нагрузка (benchmark_serving.py --save-workload) и считается
+goodput - запросов в секунду, уложившихся в SLO по TTFT и TPOT (среднему
+inter-token latency запроса). Выбирается конфигурация с максимальным
+goodput, у которой доля запросов в SLO не ниже --slo-attainment; она
+записывается в models.yaml профилем tuned-<модель>.
+
+Поиск:
+- coordinate: по одному параметру за раз от стартовой точки, пока
+  goodput растет (несколько перезапусков на параметр вместо всей сетки)
+- grid: полный перебор
+
+--mock заменяет vLLM на mock_server.py с грубой моделью производительности
+(simulate_mock_config) - так поиск и оркестрация проверяются без GPU.
+
+Запуск:
+    python benchmark_serving.py --mode open --rate 6 --save-workload workload.jsonl
+    python autotune_server.py --model qwen3-vl-2b --workload workload.jsonl \\
+        --slo-ttft 0.5 --slo-tpot 0.05
+    python autotune_server.py --mock --workload workload.jsonl --no-write
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Пространство поиска по умолчанию (значения vLLM: snake_case ключи движка)
+DEFAULT_SPACE: Dict[str, List[Any]] = {
+    "max_num_seqs": [16, 32, 64, 128, 256],
+    "max_num_batched_tokens": [2048, 4096, 8192, 16384],
+    "enable_chunked_prefill": [True, False],
+    "gpu_memory_utilization": [0.85, 0.90, 0.95],
+}
+
+DEFAULT_LOG_DIR = Path("autotune-logs")
+
+
+@dataclass
+class SLO:
+    """Цели задержек одного запроса, секунды"""
+    ttft: float = 1.0
+    tpot: float = 0.1
+    # Доля запросов, которые должны уложиться в SLO
+    attainment: float = 0.9
+
+
+@dataclass
+class Measurement:
+    """Результат проигрывания нагрузки на одной конфигурации"""
+    goodput: float
+    attainment: float
+    request_throughput: float
+    output_throughput: float
+    ttft_p90: Optional[float]
+    tpot_p90: Optional[float]
+    completed: int
+    failed: int
+    duration_s: float
+
+
+@dataclass
+class Trial:
+    config: Dict[str, Any]
+    measurement: Optional[Measurement] = None
+    error: Optional[str] = None
+
+    def feasible(self, slo: SLO) -> bool:
+        return self.measurement is not None and self.measurement.attainment >= slo.attainment
+
+
+def config_key(config: Dict[str, Any]) -> str:
+    return json.dumps(config, sort_keys=True)
+
+
+def valid_config(config: Dict[str, Any], max_model_len: Optional[int]) -> bool:
+    """
+    Без chunked prefill весь промпт считается за один шаг, поэтому vLLM
+    требует max_num_batched_tokens >= max_model_len
+    """
+    if config.get("enable_chunked_prefill") is False and max_model_len:
+        return config.get("max_num_batched_tokens", max_model_len) >= max_model_len
+    return True
+
+
+def parse_space(items: List[str]) -> Dict[str, List[Any]]:
+    """["max_num_seqs=32,64", "enable_chunked_prefill=true"] -> пространство поиска"""
+    space = dict(DEFAULT_SPACE)
+    for item in items:
+        key, sep, values = item.partition("=")
+        key = key.strip().replace("-", "_")
+        if not sep or not values:
+            raise ValueError(f"Неверный параметр {item!r}: ожидается KEY=V1,V2,...")
+        parsed = []
+        for value in values.split(","):
+            value = value.strip()
+            if value.lower() in ("true", "false"):
+                parsed.append(value.lower() == "true")
+            else:
+                try:
+                    parsed.append(int(value))
+                except ValueError:
+                    parsed.append(float(value))
+        space[key] = parsed
+    return space
+
+
+# --- измерение ---
+
+def measure(results, duration: float, slo: SLO) -> Measurement:
+    """Goodput и доля запросов в SLO по RequestResult из benchmark_serving"""
+    from streaming import percentile
+
+    ok = [r for r in results if r.success]
+    good = [
+        r for r in ok
+        if r.ttft is not None and r.ttft <= slo.ttft and (r.tpot is None or r.tpot <= slo.tpot)
+    ]
+    ttfts = [r.ttft for r in ok if r.ttft is not None]
+    tpots = [r.tpot for r in ok if r.tpot is not None]
+    return Measurement(
+        goodput=len(good) / duration if duration > 0 else 0.0,
+        # Ошибки считаются нарушением SLO
+        attainment=len(good) / len(results) if results else 0.0,
+        request_throughput=len(ok) / duration if duration > 0 else 0.0,
+        output_throughput=sum(r.output_tokens for r in ok) / duration if duration > 0 else 0.0,
+        ttft_p90=percentile(ttfts, 90) if ttfts else None,
+        tpot_p90=percentile(tpots, 90) if tpots else None,
+        completed=len(ok),
+        failed=len(results) - len(ok),
+        duration_s=duration,
+    )
+
+
+async def replay(
+    api_url: str,
+    payloads: List[Dict[str, Any]],
+    offsets: Optional[List[float]],
+    concurrency: int,
+    warmup: int,
+    timeout: float,
+):
+    """(результаты, длительность): по расписанию offsets или closed loop"""
+    import aiohttp
+
+    from benchmark_serving import run_closed_loop, run_replay
+
+    url = f"{api_url}/v1/chat/completions"
+    connector = aiohttp.TCPConnector(limit=0 if offsets else concurrency)
+    async with aiohttp.ClientSession(
+        connector=connector, timeout=aiohttp.ClientTimeout(total=timeout)
+    ) as session:
+        if warmup:
+            await run_closed_loop(session, url, payloads[:warmup], warmup)
+        start = time.perf_counter()
+        if offsets:
+            results = await run_replay(session, url, payloads, offsets)
+        else:
+            results = await run_closed_loop(session, url, payloads, concurrency)
+        return results, time.perf_counter() - start
+
+
+# --- серверы ---
+
+class Backend:
+    """Запуск сервера с конфигурацией и его остановка"""
+
+    api_url: str
+
+    def start(self, config: Dict[str, Any]) -> None:
+        raise NotImplementedError
+
+    def stop(self) -> None:
+        raise NotImplementedError
+
+
+class ProcessBackend(Backend):
+    """Сервер-подпроцесс: ждем /v1/models, останавливаем всю группу процессов"""
+
+    def __init__(self, port: int, startup_timeout: float, log_dir: Path = DEFAULT_LOG_DIR):
+        self.port = port
+        self.api_url = f"http://localhost:{port}"
+        self.startup_timeout = startup_timeout
+        self.log_dir = Path(log_dir)
+        self.process: Optional[subprocess.Popen] = None
+        self._runs = 0
+
+    def command(self, config: Dict[str, Any]) -> List[str]:
+        raise NotImplementedError
+
+    def start(self, config: Dict[str, Any]) -> None:
+        from startup_profiler import wait_ready
+
+        self.log_dir.mkdir(parents=True, exist_ok=True)
+        self._runs += 1
+        log_path = self.log_dir / f"trial-{self._runs:03d}.log"
+        with open(log_path, "w", encoding="utf-8") as log:
+            self.process = subprocess.Popen(
+                self.command(config), stdout=log, stderr=subprocess.STDOUT,
+                cwd=PROJECT_DIR, start_new_session=True,
+            )
+        if not wait_ready(self.api_url, self.process, self.startup_timeout):
+            code = self.process.poll()
+            self.stop()
+            reason = f"код {code}" if code is not None else f"нет ответа за {self.startup_timeout:.0f}s"
+            raise RuntimeError(f"сервер не запустился ({reason}), лог: {log_path}")
+
+    def stop(self) -> None:
+        if self.process is None or self.process.poll() is not None:
+            self.process = None
+            return
+        # vLLM порождает worker процессы - сигнал всей группе
+        os.killpg(self.process.pid, signal.SIGINT)
+        try:
+            self.process.wait(timeout=60)
+        except subprocess.TimeoutExpired:
+            os.killpg(self.process.pid, signal.SIGKILL)
+            self.process.wait()
+        self.process = None
+
+
+class VllmBackend(ProcessBackend):
+    """vllm_server.py с моделью/профилем из реестра и конфигурацией поверх"""
+
+    def __init__(self, model: str, port: int, startup_timeout: float = 1800,
+                 profile: Optional[str] = None, extra: Optional[List[str]] = None,
+                 log_dir: Path = DEFAULT_LOG_DIR):
+        super().__init__(port, startup_timeout, log_dir)
+        self.model = model
+        self.profile = profile
+        self.extra = list(extra or [])
+
+    def command(self, config: Dict[str, Any]) -> List[str]:
+        from model_registry import to_cli_args
+
+        cmd = [sys.executable, os.path.join(PROJECT_DIR, "vllm_server.py"),
+               "--model", self.model, "--port", str(self.port)]
+        if self.profile:
+            cmd += ["--profile", self.profile]
+        # Неизвестные vllm_server.py флаги уходят в vLLM после аргументов
+        # реестра - при повторе у vLLM побеждает последнее значение
+        return cmd + self.extra + to_cli_args(config)
+
+
+def simulate_mock_config(config: Dict[str, Any], base_decode_tps: float = 60.0,
+                         base_prefill_ms: float = 0.2) -> List[str]:
+    """
+    Флаги mock_server.py, грубо имитирующие влияние параметров:
+
+    - больше max_num_seqs - больше одновременных запросов, но каждый шаг
+      decode медленнее (больший batch)
+    - gpu_memory_utilization ограничивает KV cache, а с ним и число
+      одновременных последовательностей
+    - крупные max_num_batched_tokens ускоряют prefill; chunked prefill
+      немного замедляет prefill, зато без него длинные prefill тормозят decode
+    """
+    seqs = int(config.get("max_num_seqs", 256))
+    kv_slots = int(400 * (config.get("gpu_memory_utilization", 0.9) - 0.75) / 0.2)
+    running = max(1, min(seqs, kv_slots))
+    batched = config.get("max_num_batched_tokens", 8192)
+    chunked = config.get("enable_chunked_prefill", True)
+
+    decode_tps = base_decode_tps / (1 + running / 96)
+    prefill_ms = base_prefill_ms * (1 + 2048 / batched) / 2
+    if chunked:
+        prefill_ms *= 1.15
+    else:
+        decode_tps *= 0.85
+    return [
+        "--max-num-seqs", str(running),
+        "--decode-tps", f"{decode_tps:.2f}",
+        "--prefill-ms-per-token", f"{prefill_ms:.4f}",
+    ]
+
+
+class MockBackend(ProcessBackend):
+    """mock_server.py с параметрами из simulate_mock_config()"""
+
+    def __init__(self, port: int, startup_timeout: float = 30, log_dir: Path = DEFAULT_LOG_DIR):
+        super().__init__(port, startup_timeout, log_dir)
+
+    def command(self, config: Dict[str, Any]) -> List[str]:
+        return [sys.executable, os.path.join(PROJECT_DIR, "mock_server.py"),
+                "--port", str(self.port)] + simulate_mock_config(config)
+
+
+def make_evaluator(
+    backend: Backend,
+    payloads: List[Dict[str, Any]],
+    offsets: Optional[List[float]],
+    slo: SLO,
+    concurrency: int = 16,
+    warmup: int = 4,
+    timeout: float = 600,
+) -> Callable[[Dict[str, Any]], Measurement]:
+    """Перезапуск сервера с конфигурацией и проигрывание нагрузки"""
+    def evaluate(config: Dict[str, Any]) -> Measurement:
+        backend.start(config)
+        try:
+            results, duration = asyncio.run(
+                replay(backend.api_url, payloads, offsets, concurrency, warmup, timeout)
+            )
+        finally:
+            backend.stop()
+        return measure(results, duration, slo)
+    return evaluate
+
+
+# --- поиск ---
+
+class Tuner:
+    """
+    Поиск по пространству конфигураций с кэшем измерений
+
+    Args:
+        evaluate: config -> Measurement (исключение - конфигурация не работает)
+        slo: Цели задержек
+        max_model_len: Для отсева конфигураций без chunked prefill
+        on_trial: Callback после каждого измерения
+    """
+
+    def __init__(
+        self,
+        evaluate: Callable[[Dict[str, Any]], Measurement],
+        slo: SLO,
+        max_model_len: Optional[int] = None,
+        on_trial: Optional[Callable[[Trial], None]] = None,
+    ):
+        self.evaluate = evaluate
+        self.slo = slo
+        self.max_model_len = max_model_len
+        self.on_trial = on_trial
+        self.trials: Dict[str, Trial] = {}
+
+    def trial(self, config: Dict[str, Any]) -> Trial:
+        key = config_key(config)
+        if key not in self.trials:
+            trial = Trial(dict(config))
+            try:
+                trial.measurement = self.evaluate(config)
+            except Exception as e:
+                trial.error = str(e)
+            self.trials[key] = trial
+            if self.on_trial:
+                self.on_trial(trial)
+        return self.trials[key]
+
+    def score(self, trial: Trial) -> tuple:
+        """Сначала конфигурации в SLO, среди них - по goodput"""
+        if trial.measurement is None:
+            return (False, -1.0, -1.0)
+        m = trial.measurement
+        return (trial.feasible(self.slo), m.goodput, m.attainment)
+
+    def best(self) -> Optional[Trial]:
+        measured = [t for t in self.trials.values() if t.measurement is not None]
+        return max(measured, key=self.score) if measured else None
+
+    def grid(self, space: Dict[str, List[Any]]) -> Iterator[Dict[str, Any]]:
+        keys = list(space)
+        for values in itertools.product(*(space[k] for k in keys)):
+            config = dict(zip(keys, values))
+            if valid_config(config, self.max_model_len):
+                yield config
+
+    def grid_search(self, space: Dict[str, List[Any]]) -> Optional[Trial]:
+        for config in self.grid(space):
+            self.trial(config)
+        return self.best()
+
+    def coordinate_search(
+        self,
+        space: Dict[str, List[Any]],
+        start: Optional[Dict[str, Any]] = None,
+        max_rounds: int = 3,
+    ) -> Optional[Trial]:
+        """
+        Покоординатный подъем: перебираем значения одного параметра при
+        фиксированных остальных, берем лучшее; повторяем, пока есть улучшение
+        """
+        # Значение вне пространства поиска (из реестра) не берем: такой trial
+        # мог бы победить и попасть в профиль с непроверяемым значением
+        start = start or {}
+        current = {
+            k: start[k] if start.get(k) in values else values[len(values) // 2]
+            for k, values in space.items()
+        }
+        if not valid_config(current, self.max_model_len):
+            current = next(self.grid(space))
+        best = self.trial(current)
+        for _ in range(max_rounds):
+            improved = False
+            for key, values in space.items():
+                for value in values:
+                    candidate = {**best.config, key: value}
+                    if not valid_config(candidate, self.max_model_len):
+                        continue
+                    trial = self.trial(candidate)
+                    if self.score(trial) > self.score(best):
+                        best, improved = trial, True
+            if not improved:
+                break
+        return best
+
+
+# --- вывод ---
+
+def format_trial(trial: Trial, slo: SLO) -> str:
+    config = " ".join(f"{k}={v}" for k, v in trial.config.items())
+    if trial.measurement is None:
+        return f"   ❌ {config}: {trial.error}"
+    m = trial.measurement
+    mark = "✅" if trial.feasible(slo) else "⚠️ "
+    ms = lambda v: f"{v * 1000:.0f}" if v is not None else "n/a"
+    return (f"   {mark} {config}: goodput {m.goodput:.2f} req/s, в SLO {m.attainment:.0%}, "
+            f"TTFT p90 {ms(m.ttft_p90)} ms, TPOT p90 {ms(m.tpot_p90)} ms, "
+            f"{m.output_throughput:.0f} tok/s" + (f", ошибок {m.failed}" if m.failed else ""))
+
+
+def profile_description(trial: Trial, slo: SLO, model: str) -> str:
+    m = trial.measurement
+    return (f"Автоподбор для {model}: goodput {m.goodput:.2f} req/s при SLO TTFT "
+            f"{slo.ttft * 1000:.0f} ms / TPOT {slo.tpot * 1000:.0f} ms "
+            f"({m.attainment:.0%} запросов), {time.strftime('%Y-%m-%d')}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Автоподбор параметров планировщика vLLM под SLO")
+
+    parser.add_argument(
+        "--model",
+        default="qwen-7b",
+        help="Модель из models.yaml (по умолчанию: qwen-7b)"
+    )
+
+    parser.add_argument(
+        "--profile",
+        help="Профиль, поверх которого идет подбор"
+    )
+
+    parser.add_argument(
+        "--mock",
+        action="store_true",
+        help="Вместо vLLM - mock_server.py с имитацией влияния параметров (без GPU)"
+    )
+
+    parser.add_argument(
+        "--workload",
+        required=True,
+        help="Нагрузка JSONL (benchmark_serving.py --save-workload): с offset - проигрывается "
+             "по расписанию, без - closed loop с --concurrency"
+    )
+
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=16,
+        help="Параллельность для нагрузки без расписания (по умолчанию: 16)"
+    )
+
+    parser.add_argument(
+        "--warmup",
+        type=int,
+        default=4,
+        help="Запросов прогрева после каждого запуска (по умолчанию: 4)"
+    )
+
+    parser.add_argument(
+        "--slo-ttft",
+        type=float,
+        default=SLO.ttft,
+        help=f"SLO на TTFT, секунды (по умолчанию: {SLO.ttft})"
+    )
+
+    parser.add_argument(
+        "--slo-tpot",
+        type=float,
+        default=SLO.tpot,
+        help=f"SLO на TPOT (средний ITL запроса), секунды (по умолчанию: {SLO.tpot})"
+    )
+
+    parser.add_argument(
+        "--slo-attainment",
+        type=float,
+        default=SLO.attainment,
+        help=f"Доля запросов, которые должны уложиться в SLO (по умолчанию: {SLO.attainment})"
+    )
+
+    parser.add_argument(
+        "--search",
+        choices=["coordinate", "grid"],
+        default="coordinate",
+        help="coordinate - по одному параметру за раз, grid - полный перебор (по умолчанию: coordinate)"
+    )
+
+    parser.add_argument(
+        "--param",
+        action="append",
+        default=[],
+        metavar="KEY=V1,V2",
+        help="Значения параметра вместо стандартных, например max_num_seqs=32,64,128"
+    )
+
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=8100,
+        help="Порт для запусков при подборе (по умолчанию: 8100)"
+    )
+
+    parser.add_argument(
+        "--startup-timeout",
+        type=float,
+        default=1800,
+        help="Ожидание запуска сервера, секунды (по умолчанию: 1800)"
+    )
+
+    parser.add_argument(
+        "--log",
+        default=str(DEFAULT_LOG_DIR / "trials.jsonl"),
+        help=f"Журнал измерений JSONL (по умолчанию: {DEFAULT_LOG_DIR / 'trials.jsonl'})"
+    )
+
+    parser.add_argument(
+        "--profile-name",
+        help="Имя профиля для записи (по умолчанию: tuned-<модель>)"
+    )
+
+    parser.add_argument(
+        "--no-write",
+        action="store_true",
+        help="Не записывать профиль в models.yaml"
+    )
+
+    args, extra = parser.parse_known_args()
+
+    from benchmark_serving import load_workload
+    from model_registry import DEFAULT_REGISTRY, engine_args, load_registry, to_cli_args, write_profile
+
+    slo = SLO(args.slo_ttft, args.slo_tpot, args.slo_attainment)
+    try:
+        space = parse_space(args.param)
+        payloads, offsets = load_workload(args.workload)
+        registry = load_registry()
+        entry = registry.model(args.model)
+        engine = engine_args(registry, entry, registry.profile(args.profile))
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+
+    if args.mock:
+        backend: Backend = MockBackend(args.port)
+        max_model_len = 8192
+    else:
+        backend = VllmBackend(args.model, args.port, args.startup_timeout, args.profile, extra)
+        max_model_len = engine.get("max_model_len")
+
+    Path(args.log).parent.mkdir(parents=True, exist_ok=True)
+    log = open(args.log, "a", encoding="utf-8")
+
+    def on_trial(trial: Trial) -> None:
+        print(format_trial(trial, slo), flush=True)
+        log.write(json.dumps({"time": time.time(), "model": args.model, "mock": args.mock,
+                              **asdict(trial)}, ensure_ascii=False) + "\n")
+        log.flush()
+
+    tuner = Tuner(
+        make_evaluator(backend, payloads, offsets, slo, args.concurrency, args.warmup),
+        slo, max_model_len, on_trial,
+    )
+
+    print("=" * 70)
+    print(f"🎯 Автоподбор: {args.model}" + (" (mock)" if args.mock else ""))
+    print("=" * 70)
+    print(f"SLO:        TTFT <= {slo.ttft * 1000:.0f} ms, TPOT <= {slo.tpot * 1000:.0f} ms "
+          f"для {slo.attainment:.0%} запросов")
+    print(f"Нагрузка:   {len(payloads)} запросов, "
+          + ("по расписанию" if offsets else f"closed loop x{args.concurrency}"))
+    print(f"Поиск:      {args.search}, " + ", ".join(f"{k}={v}" for k, v in space.items()))
+    print()
+
+    start = {k: engine[k] for k in space if engine.get(k) in space[k]}
+    try:
+        if args.search == "grid":
+            best = tuner.grid_search(space)
+        else:
+            best = tuner.coordinate_search(space, start)
+    except KeyboardInterrupt:
+        print("\n⏹️  Прервано, выбор из выполненных измерений")
+        best = tuner.best()
+    finally:
+        backend.stop()
+        log.close()
+
+    print()
+    if best is None or best.measurement is None:
+        print("❌ Ни одна конфигурация не запустилась")
+        return 1
+    if not best.feasible(slo):
+        print("⚠️  Ни одна конфигурация не уложилась в SLO; ближайшая:")
+        print(format_trial(best, slo))
+        return 1
+
+    print(f"🏆 Лучшая из {len(tuner.trials)}:")
+    print(format_trial(best, slo))
+
+    name = args.profile_name or f"tuned-{entry.name.replace('/', '-')}"
+    # Профиль заменяет --profile при запуске, поэтому включает и его настройки
+    base = registry.profile(args.profile)
+    tuned = {**(base.engine if base else {}), **best.config}
+    if args.no_write:
+        print(f"\n💡 Запуск: python vllm_server.py --model {args.model} {' '.join(to_cli_args(tuned))}")
+        return 0
+    write_profile(DEFAULT_REGISTRY, name, profile_description(best, slo, args.model), tuned)
+    print(f"\n💾 Профиль {name} записан в models.yaml")
+    print(f"   python vllm_server.py --model {args.model} --profile {name}")
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
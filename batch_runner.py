@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""
+Batch обработка изображений: директория, glob или JSONL манифест задач
+с ограниченным числом запросов в полете и возобновляемым JSONL выводом
+"""
+
+import asyncio
+import glob
+import hashlib
+import json
+import os
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional, Set
+
+from image_preprocess import MIME_TYPES
+from query_qwen3vl import AsyncQwen3VLClient
+
+
+@dataclass
+class BatchSummary:
+    """Итоги прогона"""
+    done: int = 0
+    failed: int = 0
+    skipped: int = 0
+    elapsed: float = 0.0
+
+    def format_report(self) -> str:
+        rate = self.done / self.elapsed if self.elapsed > 0 else 0.0
+        return (
+            f"✅ Готово: {self.done}, ❌ ошибок: {self.failed}, "
+            f"⏭️  пропущено (уже в выводе): {self.skipped}, "
+            f"⏱️  {self.elapsed:.1f} s ({rate:.2f} задач/s)"
+        )
+
+
+def job_id(images: list, question: str, params: Optional[Dict[str, Any]] = None) -> str:
+    """
+    Стабильный id задачи без явного id в манифесте
+
+    В ключ входят и params (system, history, параметры генерации): задачи,
+    отличающиеся только ими, иначе при возобновлении считались бы одной.
+    Для задач без params и только с system id прежний.
+    """
+    params = dict(params or {})
+    system = params.pop("system", None)
+    parts: list = [images, question] + ([system] if system else [])
+    if params:
+        parts.append(params)
+    key = json.dumps(parts, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+
+
+def _is_image(path: Path) -> bool:
+    return path.is_file() and path.suffix.lower() in MIME_TYPES
+
+
+def load_jobs(source: str, question: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Читать задачи лениво
+
+    - директория: каждое изображение (рекурсивно) - отдельная задача с question
+    - glob (`imgs/**/*.jpg`): то же самое для совпавших файлов
+    - *.jsonl: строки {"id"?, "images": [...], "question"?, "system"?,
+      "history"?, "params"?: {...}}; question из строки переопределяет общий,
+      system и history (few-shot сообщения) уходят в params задачи
+
+    Для изображений id - путь к файлу, для манифеста без id - хэш содержимого задачи.
+    """
+    path = Path(source)
+
+    if path.suffix == ".jsonl" and path.is_file():
+        with open(path, encoding="utf-8") as f:
+            for line_no, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entry = json.loads(line)
+                except ValueError as e:
+                    raise ValueError(f"{source}:{line_no}: некорректный JSON: {e}")
+                images = entry.get("images") or []
+                if isinstance(images, str):
+                    images = [images]
+                q = entry.get("question", question)
+                if not q:
+                    raise ValueError(f"{source}:{line_no}: нет question и не задан общий --question")
+                params = dict(entry.get("params") or {})
+                for key in ("system", "history"):
+                    if key in entry:
+                        params[key] = entry[key]
+                if "id" in entry:
+                    entry_id = str(entry["id"])
+                else:
+                    entry_id = job_id(images, q, params)
+                yield {
+                    "id": entry_id,
+                    "images": images,
+                    "question": q,
+                    "params": params,
+                }
+        return
+
+    if path.is_dir():
+        files = (p for p in sorted(path.rglob("*")) if _is_image(p))
+    else:
+        files = (Path(p) for p in sorted(glob.iglob(source, recursive=True)) if _is_image(Path(p)))
+
+    if not question:
+        raise ValueError("Для директории или glob нужен общий --question")
+    for image in files:
+        yield {
+            "id": str(image),
+            "images": [str(image)],
+            "question": question,
+            "params": {},
+        }
+
+
+def completed_ids(output_path: str) -> Set[str]:
+    """
+    id успешно завершенных задач из существующего вывода
+
+    Задачи с ошибкой повторяются, недописанная последняя строка (падение
+    посреди записи) игнорируется.
+    """
+    done: Set[str] = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get("error") is None and "id" in record:
+                done.add(record["id"])
+    return done
+
+
+async def run_batch(
+    client: AsyncQwen3VLClient,
+    jobs: Iterator[Dict[str, Any]],
+    output_path: str,
+    progress_every: int = 100,
+    stream: bool = False,
+) -> BatchSummary:
+    """
+    Выполнить задачи, дописывая результаты в output_path по мере готовности
+
+    Уже завершенные (по completed_ids) задачи пропускаются, так что
+    повторный запуск после падения продолжает с места остановки.
+    stream=True читает ответы потоком (TTFT для AdaptiveConcurrency).
+    """
+    summary = BatchSummary()
+    finished = completed_ids(output_path)
+    ids: Dict[int, Dict[str, Any]] = {}
+    start = time.perf_counter()
+
+    def pending_jobs():
+        index = 0
+        for job in jobs:
+            if job["id"] in finished:
+                summary.skipped += 1
+                continue
+            ids[index] = job
+            index += 1
+            yield {"question": job["question"], "image_paths": job["images"], **job["params"]}
+
+    # Неполная последняя строка после падения: начинаем с новой строки
+    if os.path.exists(output_path) and os.path.getsize(output_path):
+        with open(output_path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            needs_newline = f.read(1) != b"\n"
+    else:
+        needs_newline = False
+
+    with open(output_path, "a", encoding="utf-8") as out:
+        if needs_newline:
+            out.write("\n")
+        async for result in client.ask_many(pending_jobs(), stream=stream):
+            job = ids.pop(result.index)
+            record = {
+                "id": job["id"],
+                "images": job["images"],
+                "question": job["question"],
+                "answer": result.content,
+                "error": str(result.error) if result.error else None,
+                "latency": round(result.latency, 3),
+            }
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+
+            if result.ok:
+                summary.done += 1
+            else:
+                summary.failed += 1
+            total = summary.done + summary.failed
+            if progress_every and total % progress_every == 0:
+                elapsed = time.perf_counter() - start
+                window = ""
+                if client.concurrency is not None:
+                    window = f", окно: {client.concurrency.limit:.1f}"
+                print(f"   📊 {total} задач, {total / elapsed:.2f}/s, ошибок: {summary.failed}{window}")
+
+    summary.elapsed = time.perf_counter() - start
+    return summary
+
+
+def run_batch_sync(client: AsyncQwen3VLClient, jobs, output_path: str, **kwargs) -> BatchSummary:
+    """Запуск run_batch() из синхронного кода (CLI)"""
+    async def _main():
+        try:
+            return await run_batch(client, jobs, output_path, **kwargs)
+        finally:
+            await client.close()
+    return asyncio.run(_main())
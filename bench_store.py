@@ -0,0 +1,485 @@
+#!/usr/bin/env python3
+"""
+История прогонов benchmark_serving.py в SQLite и отчет о регрессиях
+
+Каждый прогон сохраняется с тегами: ключ модели из models.yaml, профиль и
+аргументы запуска (их пишет vllm_server.py при старте), версии vLLM и
+torch, GPU. Метрики отдельных запросов тоже сохраняются - по ним считаются
+доверительные интервалы (bootstrap по прогонам целиком).
+
+Отчет сравнивает две группы прогонов (базу и новую) по throughput, TTFT,
+TPOT и E2E. Регрессия - ухудшение больше --threshold процентов, при котором
+95% доверительный интервал изменения не включает ноль; при регрессии код
+возврата 1. Для CI нужно от двух прогонов с каждой стороны, с одним
+прогоном изменение только показывается.
+
+Запуск:
+    python benchmark_serving.py --store --tag label=after-upgrade
+    python bench_store.py list
+    python bench_store.py report                                  # последний прогон против предыдущего
+    python bench_store.py report --baseline vllm=0.10.2 --candidate vllm=0.11.0
+    python bench_store.py report --baseline model=qwen-7b --candidate model=qwen3-vl-2b
+    python bench_store.py report --baseline 12,13 --candidate 15,16 --threshold 5
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import sqlite3
+import sys
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from server_info import is_colocated, read_launch_info, server_info
+from streaming import percentile
+
+DEFAULT_DB_PATH = Path.home() / ".cache" / "vllm-setup" / "benchmarks.sqlite"
+
+# Теги прогона (колонки runs), по ним выбираются группы в отчете
+TAGS = ("model", "model_id", "profile", "launcher_args", "vllm", "torch", "gpu", "label")
+
+# Параметры нагрузки: прогоны сравнимы, только если они совпадают
+WORKLOAD_KEYS = (
+    "mode", "concurrency", "rate", "num_requests", "workload", "prompt_len",
+    "output_len", "allow_eos", "images", "images_per_request", "max_pixels", "seed",
+)
+
+DEFAULT_THRESHOLD = 10.0
+BOOTSTRAP_ITERATIONS = 1000
+
+
+@dataclass
+class Metric:
+    """Метрика отчета: по прогонам (summary) или по запросам (колонка requests)"""
+    name: str
+    higher_is_better: bool
+    # Значение из summary прогона или (колонка requests, перцентиль)
+    summary_key: Optional[str] = None
+    request_column: Optional[str] = None
+    request_percentile: float = 50.0
+
+
+METRICS = [
+    Metric("output_tps", True, summary_key="output_throughput"),
+    Metric("request_rps", True, summary_key="request_throughput"),
+    Metric("ttft_p50", False, request_column="ttft_ms", request_percentile=50),
+    Metric("ttft_p99", False, request_column="ttft_ms", request_percentile=99),
+    Metric("tpot_p50", False, request_column="tpot_ms", request_percentile=50),
+    Metric("tpot_p99", False, request_column="tpot_ms", request_percentile=99),
+    Metric("e2e_p50", False, request_column="e2e_ms", request_percentile=50),
+    Metric("e2e_p99", False, request_column="e2e_ms", request_percentile=99),
+]
+
+
+@dataclass
+class RunRecord:
+    id: int
+    created: str
+    tags: Dict[str, Optional[str]]
+    workload_key: str
+    config: Dict[str, Any]
+    summary: Dict[str, Any]
+
+    def describe(self) -> str:
+        parts = [f"#{self.id}", self.created[:16].replace("T", " ")]
+        parts += [f"{k}={self.tags[k]}" for k in ("model", "profile", "vllm", "label") if self.tags.get(k)]
+        return " ".join(parts)
+
+
+@dataclass
+class RunGroup:
+    """Прогоны одной стороны сравнения и их запросы"""
+    runs: List[RunRecord]
+    # Колонка -> значения запросов, отдельный список на каждый прогон
+    requests: Dict[str, List[List[float]]] = field(default_factory=dict)
+
+    def clusters(self, metric: Metric) -> List[List[float]]:
+        """
+        Выборка для bootstrap по прогонам: для метрики по прогонам - одно
+        значение на прогон, для метрики по запросам - все запросы прогона
+        """
+        if metric.summary_key:
+            return [[r.summary[metric.summary_key]] for r in self.runs
+                    if r.summary.get(metric.summary_key) is not None]
+        return [values for values in self.requests.get(metric.request_column, []) if values]
+
+
+@dataclass
+class MetricDelta:
+    metric: Metric
+    baseline: Optional[float]
+    candidate: Optional[float]
+    delta_pct: Optional[float] = None
+    ci_low: Optional[float] = None
+    ci_high: Optional[float] = None
+    regression: bool = False
+
+
+def workload_key(config: Dict[str, Any]) -> str:
+    workload = {k: config.get(k) for k in WORKLOAD_KEYS}
+    return hashlib.sha1(json.dumps(workload, sort_keys=True).encode()).hexdigest()[:12]
+
+
+# --- статистика ---
+
+def _statistic(metric: Metric) -> Callable[[List[float]], float]:
+    if metric.summary_key:
+        return lambda values: sum(values) / len(values)
+    return lambda values: percentile(values, metric.request_percentile)
+
+
+def _pooled(clusters: List[List[float]]) -> List[float]:
+    return [value for cluster in clusters for value in cluster]
+
+
+def bootstrap_delta(
+    baseline: List[List[float]],
+    candidate: List[List[float]],
+    statistic: Callable[[List[float]], float],
+    iterations: int = BOOTSTRAP_ITERATIONS,
+    seed: int = 0,
+) -> Tuple[float, float, float]:
+    """
+    (изменение %, нижняя и верхняя граница 95% CI) статистики candidate
+    относительно baseline
+
+    Cluster bootstrap: с возвращением ресемплируются прогоны целиком, а не
+    отдельные запросы - запросы одного прогона коррелированы, и без учета
+    разброса между прогонами интервал получается слишком узким.
+    """
+    base, cand = statistic(_pooled(baseline)), statistic(_pooled(candidate))
+    delta = (cand - base) / base * 100 if base else 0.0
+    rng = random.Random(seed)
+    deltas = []
+    for _ in range(iterations):
+        b = statistic(_pooled(rng.choices(baseline, k=len(baseline))))
+        c = statistic(_pooled(rng.choices(candidate, k=len(candidate))))
+        if b:
+            deltas.append((c - b) / b * 100)
+    if not deltas:
+        return delta, delta, delta
+    return delta, percentile(deltas, 2.5), percentile(deltas, 97.5)
+
+
+def compare_groups(
+    baseline: RunGroup,
+    candidate: RunGroup,
+    threshold: float = DEFAULT_THRESHOLD,
+    metrics: Optional[List[Metric]] = None,
+) -> List[MetricDelta]:
+    """
+    Изменения метрик candidate относительно baseline
+
+    CI считается только при двух и более прогонах с каждой стороны; без
+    него изменение показывается, но регрессией не считается: разброс между
+    прогонами по одному прогону не оценить.
+    """
+    result = []
+    for metric in metrics or METRICS:
+        base_clusters, cand_clusters = baseline.clusters(metric), candidate.clusters(metric)
+        if not base_clusters or not cand_clusters:
+            result.append(MetricDelta(metric, None, None))
+            continue
+        statistic = _statistic(metric)
+        delta = MetricDelta(
+            metric, statistic(_pooled(base_clusters)), statistic(_pooled(cand_clusters))
+        )
+        if min(len(base_clusters), len(cand_clusters)) < 2:
+            delta.delta_pct = (
+                (delta.candidate - delta.baseline) / delta.baseline * 100 if delta.baseline else 0.0
+            )
+            result.append(delta)
+            continue
+        delta.delta_pct, delta.ci_low, delta.ci_high = bootstrap_delta(
+            base_clusters, cand_clusters, statistic
+        )
+        # Ухудшение в процентах (положительное - хуже)
+        worse = -delta.delta_pct if metric.higher_is_better else delta.delta_pct
+        if metric.higher_is_better:
+            significant = delta.ci_high < 0
+        else:
+            significant = delta.ci_low > 0
+        delta.regression = worse > threshold and significant
+        result.append(delta)
+    return result
+
+
+# --- хранилище ---
+
+class BenchStore:
+    """Прогоны и метрики их запросов в SQLite"""
+
+    def __init__(self, path: Path = DEFAULT_DB_PATH):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(self.path))
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS runs ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT, created TEXT NOT NULL,"
+            + "".join(f" {tag} TEXT," for tag in TAGS)
+            + " workload_key TEXT NOT NULL, config TEXT NOT NULL, summary TEXT NOT NULL)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS requests ("
+            " run_id INTEGER NOT NULL REFERENCES runs(id),"
+            " ttft_ms REAL, tpot_ms REAL, e2e_ms REAL, output_tokens INTEGER)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS requests_run ON requests(run_id)")
+        self._db.commit()
+
+    def save_run(
+        self,
+        tags: Dict[str, Optional[str]],
+        config: Dict[str, Any],
+        summary: Dict[str, Any],
+        request_rows: List[Tuple[Optional[float], Optional[float], float, int]],
+    ) -> int:
+        """Сохранить прогон; request_rows - (ttft_ms, tpot_ms, e2e_ms, output_tokens)"""
+        cursor = self._db.execute(
+            f"INSERT INTO runs (created, {', '.join(TAGS)}, workload_key, config, summary) "
+            f"VALUES ({', '.join('?' * (len(TAGS) + 4))})",
+            (
+                datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                *(tags.get(tag) for tag in TAGS),
+                workload_key(config),
+                json.dumps(config, ensure_ascii=False),
+                json.dumps(summary, ensure_ascii=False),
+            ),
+        )
+        run_id = cursor.lastrowid
+        self._db.executemany(
+            "INSERT INTO requests VALUES (?, ?, ?, ?, ?)",
+            [(run_id, *row) for row in request_rows],
+        )
+        self._db.commit()
+        return run_id
+
+    def _record(self, row) -> RunRecord:
+        run_id, created, *tag_values, key, config, summary = row
+        return RunRecord(
+            run_id, created, dict(zip(TAGS, tag_values)), key,
+            json.loads(config), json.loads(summary),
+        )
+
+    def runs(self, selector: Optional[str] = None, limit: Optional[int] = None) -> List[RunRecord]:
+        """
+        Прогоны по селектору (новые первыми): "12,13" - id,
+        "model=qwen-7b,vllm=0.11.0" - теги, None - все
+        """
+        where, params = [], []
+        if selector:
+            if all(part.strip().isdigit() for part in selector.split(",")):
+                ids = [int(part) for part in selector.split(",")]
+                where.append(f"id IN ({', '.join('?' * len(ids))})")
+                params += ids
+            else:
+                for part in selector.split(","):
+                    key, sep, value = part.partition("=")
+                    key = key.strip()
+                    if not sep or key not in TAGS + ("workload_key",):
+                        raise ValueError(
+                            f"Неверный селектор {part!r}: ожидается id или тег=значение "
+                            f"({', '.join(TAGS)})"
+                        )
+                    where.append(f"{key} = ?")
+                    params.append(value.strip())
+        query = "SELECT * FROM runs"
+        if where:
+            query += " WHERE " + " AND ".join(where)
+        query += " ORDER BY id DESC"
+        if limit:
+            query += f" LIMIT {int(limit)}"
+        return [self._record(row) for row in self._db.execute(query, params)]
+
+    def group(self, runs: List[RunRecord]) -> RunGroup:
+        """Группа с метриками всех запросов ее прогонов"""
+        columns = ("ttft_ms", "tpot_ms", "e2e_ms")
+        index = {r.id: i for i, r in enumerate(runs)}
+        group = RunGroup(runs, {column: [[] for _ in runs] for column in columns})
+        rows = self._db.execute(
+            f"SELECT run_id, {', '.join(columns)} FROM requests "
+            f"WHERE run_id IN ({', '.join('?' * len(runs))})",
+            list(index),
+        )
+        for run_id, *values in rows:
+            for column, value in zip(columns, values):
+                if value is not None:
+                    group.requests[column][index[run_id]].append(value)
+        return group
+
+    def close(self) -> None:
+        self._db.close()
+
+
+# --- теги прогона ---
+
+def collect_tags(api_url: str, overrides: Optional[Dict[str, str]] = None) -> Dict[str, Optional[str]]:
+    """
+    Теги прогона: сервер (/v1/models, /version), описание запуска от
+    vllm_server.py, для локального сервера - GPU и torch этой машины;
+    overrides (--tag) важнее всего
+    """
+    from capability_probe import driver_and_gpus, package_version
+
+    server = server_info(api_url)
+    tags: Dict[str, Optional[str]] = {tag: None for tag in TAGS}
+    tags["model_id"] = server["model_id"]
+    tags["model"] = server["model_id"]
+    tags["vllm"] = server["vllm"]
+
+    launch = read_launch_info(api_url)
+    # Описание от другого запуска на том же порту не подходит
+    if launch and server["model_id"] in (None, launch.get("model_id"), launch.get("weights")):
+        environment = launch.get("environment") or {}
+        tags["model"] = launch.get("model") or tags["model"]
+        tags["profile"] = launch.get("profile")
+        tags["launcher_args"] = launch.get("args")
+        tags["vllm"] = tags["vllm"] or environment.get("vllm")
+        tags["torch"] = environment.get("torch")
+        tags["gpu"] = ", ".join(environment.get("gpus") or []) or None
+    elif is_colocated(api_url):
+        tags["torch"] = package_version("torch")
+        tags["gpu"] = ", ".join(driver_and_gpus()["gpus"]) or None
+
+    tags.update(overrides or {})
+    return tags
+
+
+def parse_tags(items: List[str]) -> Dict[str, str]:
+    """["label=x", "model=qwen-7b"] -> dict (только известные теги)"""
+    tags = {}
+    for item in items:
+        key, sep, value = item.partition("=")
+        if not sep or key not in TAGS:
+            raise ValueError(f"Неверный тег {item!r}: ожидается KEY=VALUE, KEY из {', '.join(TAGS)}")
+        tags[key] = value
+    return tags
+
+
+# --- отчеты ---
+
+def format_runs(runs: List[RunRecord]) -> str:
+    if not runs:
+        return "📭 Прогонов нет"
+    lines = [f"{'id':>5}  {'дата (UTC)':<16}  {'модель':<16} {'профиль':<12} {'vllm':<10} "
+             f"{'нагрузка':<12} {'tok/s':>8} {'TTFT p50':>9}  label"]
+    for r in runs:
+        ttft = (r.summary.get("ttft_ms") or {}).get("p50")
+        lines.append(
+            f"{r.id:>5}  {r.created[:16].replace('T', ' '):<16}  {r.tags['model'] or '?':<16.16} "
+            f"{r.tags['profile'] or '-':<12} {r.tags['vllm'] or '?':<10} {r.workload_key:<12} "
+            f"{r.summary.get('output_throughput', 0):>8.1f} "
+            f"{(f'{ttft:.0f} ms' if ttft is not None else 'n/a'):>9}  {r.tags['label'] or ''}"
+        )
+    return "\n".join(lines)
+
+
+def format_report(baseline: RunGroup, candidate: RunGroup, deltas: List[MetricDelta], threshold: float) -> str:
+    def side(title: str, group: RunGroup) -> str:
+        runs = ", ".join(f"#{r.id}" for r in group.runs[:8]) + (" ..." if len(group.runs) > 8 else "")
+        first = group.runs[0]
+        tags = " ".join(f"{k}={first.tags[k]}" for k in ("model", "profile", "vllm", "gpu") if first.tags.get(k))
+        return f"{title} {len(group.runs)} прогон(ов) ({runs}) {tags}"
+
+    num = lambda v: f"{v:10.1f}" if v is not None else "       n/a"
+    lines = [side("📊 База:  ", baseline), side("📊 Новая: ", candidate)]
+    if {r.workload_key for r in baseline.runs} != {r.workload_key for r in candidate.runs}:
+        lines.append("⚠️  Параметры нагрузки различаются - сравнение может быть некорректным")
+    lines.append(f"   {'метрика':<12} {'база':>10} {'новая':>10} {'Δ%':>8}  {'95% CI':<18}")
+    for d in deltas:
+        if d.delta_pct is None:
+            lines.append(f"   {d.metric.name:<12} {num(d.baseline)} {num(d.candidate)} {'n/a':>8}")
+            continue
+        ci = f"[{d.ci_low:+.1f}, {d.ci_high:+.1f}]" if d.ci_low is not None else "n/a (<2 прогонов)"
+        mark = f"❌ регрессия > {threshold:g}%" if d.regression else ""
+        lines.append(
+            f"   {d.metric.name:<12} {num(d.baseline)} {num(d.candidate)} {d.delta_pct:+7.1f}%  {ci:<18} {mark}"
+        )
+    return "\n".join(lines)
+
+
+def previous_run(store: BenchStore, candidate: RunRecord) -> List[RunRecord]:
+    """Предыдущий прогон с той же моделью, нагрузкой и GPU"""
+    previous = [
+        r for r in store.runs(f"workload_key={candidate.workload_key}")
+        if r.id < candidate.id and r.tags["model"] == candidate.tags["model"]
+        and r.tags["gpu"] == candidate.tags["gpu"]
+    ]
+    if not previous:
+        raise ValueError(f"Нет предыдущего прогона для сравнения с {candidate.describe()}")
+    return previous[:1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="История бенчмарков и отчет о регрессиях")
+
+    parser.add_argument(
+        "--db",
+        default=str(DEFAULT_DB_PATH),
+        help=f"SQLite база прогонов (по умолчанию: {DEFAULT_DB_PATH})"
+    )
+
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    list_parser = commands.add_parser("list", help="Список прогонов")
+    list_parser.add_argument("selector", nargs="?", help="id через запятую или тег=значение,...")
+
+    list_parser.add_argument(
+        "--limit",
+        type=int,
+        default=30,
+        help="Сколько последних прогонов показать (по умолчанию: 30)"
+    )
+
+    report = commands.add_parser("report", help="Сравнить группы прогонов")
+
+    report.add_argument(
+        "--baseline",
+        help="База: id через запятую или тег=значение,... (по умолчанию: предыдущий прогон)"
+    )
+
+    report.add_argument(
+        "--candidate",
+        help="Новая группа (по умолчанию: последний прогон)"
+    )
+
+    report.add_argument(
+        "--threshold",
+        type=float,
+        default=DEFAULT_THRESHOLD,
+        help=f"Порог регрессии, проценты (по умолчанию: {DEFAULT_THRESHOLD:g})"
+    )
+
+    args = parser.parse_args()
+    store = BenchStore(Path(args.db))
+
+    try:
+        if args.command == "list":
+            print(format_runs(store.runs(args.selector, args.limit)))
+            return 0
+
+        candidate = store.runs(args.candidate) if args.candidate else store.runs(limit=1)
+        if not candidate:
+            raise ValueError("Нет прогонов для сравнения (benchmark_serving.py --store)")
+        if args.baseline:
+            candidate_ids = {r.id for r in candidate}
+            baseline = [r for r in store.runs(args.baseline) if r.id not in candidate_ids]
+        else:
+            baseline = previous_run(store, candidate[0])
+        if not baseline or not candidate:
+            raise ValueError("Пустая группа: проверьте селекторы (python bench_store.py list)")
+    except ValueError as e:
+        print(f"❌ {e}", file=sys.stderr)
+        return 2
+
+    base_group, cand_group = store.group(baseline), store.group(candidate)
+    deltas = compare_groups(base_group, cand_group, args.threshold)
+    print(format_report(base_group, cand_group, deltas, args.threshold))
+    return 1 if any(d.regression for d in deltas) else 0
+
+
+if __name__ == "__main__":
+    exit(main())
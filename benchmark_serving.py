@@ -0,0 +1,541 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный бенчмарк OpenAI-совместимого сервера (start_server.sh / vllm_server.py)
+
+Режимы нагрузки:
+- closed: фиксированное число одновременных запросов (--concurrency)
+- open:   поток запросов с пуассоновскими интервалами (--rate запросов/s)
+
+Метрики: p50/p90/p99 TTFT, inter-token latency, TPOT, end-to-end latency,
+requests/s и output tokens/s. Результаты сохраняются в JSON (--output) или
+в историю прогонов с тегами модели, версий и GPU (--store, см. bench_store.py).
+"""
+
+import argparse
+import asyncio
+import glob
+import json
+import random
+import time
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+import aiohttp
+
+from bench_store import DEFAULT_DB_PATH, WORKLOAD_KEYS, BenchStore, collect_tags, parse_tags
+from image_cache import ImageCache
+from image_preprocess import PreprocessOptions
+from streaming import astream_chat_completion, percentile
+
+# Словарь для синтетических промптов: обычные слова ~ 1 токен каждое
+WORDS = (
+    "the of and to in is for on that with as by at from this be are was it an "
+    "model data system time value number result image text server request token "
+    "memory cache layer batch speed load test query answer question example list"
+).split()
+
+
+@dataclass
+class LengthDistribution:
+    """
+    Распределение длин: fixed:N, uniform:LO:HI, normal:MEAN:STD, lognormal:MEDIAN:SIGMA
+    """
+    kind: str
+    a: float
+    b: float = 0.0
+
+    @classmethod
+    def parse(cls, spec: str) -> "LengthDistribution":
+        parts = spec.split(":")
+        if parts[0].isdigit() and len(parts) == 1:
+            return cls("fixed", float(parts[0]))
+        kind = parts[0]
+        expected = {"fixed": 1, "uniform": 2, "normal": 2, "lognormal": 2}
+        if kind not in expected or len(parts) - 1 != expected[kind]:
+            raise ValueError(
+                f"Некорректное распределение '{spec}': ожидается fixed:N, "
+                f"uniform:LO:HI, normal:MEAN:STD или lognormal:MEDIAN:SIGMA"
+            )
+        return cls(kind, *(float(p) for p in parts[1:]))
+
+    def sample(self, rng: random.Random) -> int:
+        if self.kind == "fixed":
+            value = self.a
+        elif self.kind == "uniform":
+            value = rng.uniform(self.a, self.b)
+        elif self.kind == "normal":
+            value = rng.gauss(self.a, self.b)
+        else:
+            value = rng.lognormvariate(0, self.b) * self.a
+        return max(1, int(round(value)))
+
+
+@dataclass
+class RequestResult:
+    """Метрики одного запроса"""
+    success: bool
+    ttft: Optional[float] = None
+    e2e: float = 0.0
+    itl: List[float] = field(default_factory=list)
+    prompt_tokens: Optional[int] = None
+    output_tokens: int = 0
+    error: Optional[str] = None
+
+    @property
+    def tpot(self) -> Optional[float]:
+        """Time per output token после первого"""
+        if self.ttft is None or self.output_tokens < 2:
+            return None
+        return (self.e2e - self.ttft) / (self.output_tokens - 1)
+
+
+def synthetic_prompt(num_words: int, rng: random.Random) -> str:
+    # Случайный текст, чтобы разные запросы не делили префикс в prefix cache
+    return " ".join(rng.choice(WORDS) for _ in range(num_words))
+
+
+def build_payloads(args, rng: random.Random, count: int) -> List[Dict[str, Any]]:
+    """
+    Подготовить все тела запросов заранее
+
+    Кодирование изображений не должно попадать в измеряемые задержки.
+    """
+    prompt_dist = LengthDistribution.parse(args.prompt_len)
+    output_dist = LengthDistribution.parse(args.output_len)
+
+    images: List[str] = []
+    encoded: Dict[str, str] = {}
+    cache = ImageCache(cache_dir=None)
+    options = PreprocessOptions(max_pixels=args.max_pixels) if args.max_pixels else None
+    if args.workload == "image":
+        images = sorted(glob.glob(args.images, recursive=True))
+        if not images:
+            raise ValueError(f"Нет изображений по шаблону: {args.images}")
+
+    payloads = []
+    for _ in range(count):
+        text = synthetic_prompt(prompt_dist.sample(rng), rng)
+        if args.workload == "image":
+            content: Any = [{"type": "text", "text": text}]
+            for image_path in rng.sample(images, min(args.images_per_request, len(images))):
+                if image_path not in encoded:
+                    b64, mime_type = cache.encode(image_path, options)
+                    encoded[image_path] = f"data:{mime_type};base64,{b64}"
+                content.append({"type": "image_url", "image_url": {"url": encoded[image_path]}})
+        else:
+            content = text
+
+        payloads.append({
+            "model": args.model,
+            "messages": [{"role": "user", "content": content}],
+            "max_tokens": output_dist.sample(rng),
+            "temperature": 0.0,
+            # Расширение vLLM: генерировать ровно max_tokens, не останавливаясь на EOS
+            "ignore_eos": not args.allow_eos,
+        })
+    return payloads
+
+
+async def send_request(
+    session: aiohttp.ClientSession,
+    url: str,
+    payload: Dict[str, Any],
+) -> RequestResult:
+    start = time.perf_counter()
+    try:
+        _, stats = await astream_chat_completion(session, url, payload)
+    except Exception as e:
+        return RequestResult(success=False, e2e=time.perf_counter() - start, error=str(e))
+    return RequestResult(
+        success=True,
+        ttft=stats.ttft,
+        e2e=stats.e2e,
+        itl=stats.itl,
+        prompt_tokens=stats.prompt_tokens,
+        output_tokens=stats.output_tokens,
+    )
+
+
+async def run_closed_loop(
+    session: aiohttp.ClientSession,
+    url: str,
+    payloads: List[Dict[str, Any]],
+    concurrency: int,
+) -> List[RequestResult]:
+    """concurrency воркеров, каждый отправляет следующий запрос сразу после ответа"""
+    queue: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue()
+    for payload in payloads:
+        queue.put_nowait(payload)
+    results: List[RequestResult] = []
+
+    async def worker():
+        while True:
+            try:
+                payload = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            results.append(await send_request(session, url, payload))
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return results
+
+
+def poisson_offsets(count: int, rate: float, rng: random.Random) -> List[float]:
+    """Моменты отправки (секунды от начала) для пуассоновского потока"""
+    offsets, t = [], 0.0
+    for _ in range(count):
+        offsets.append(t)
+        t += rng.expovariate(rate)
+    return offsets
+
+
+async def run_replay(
+    session: aiohttp.ClientSession,
+    url: str,
+    payloads: List[Dict[str, Any]],
+    offsets: List[float],
+) -> List[RequestResult]:
+    """Отправка по расписанию offsets независимо от того, успевает ли сервер"""
+    start = time.perf_counter()
+    tasks = []
+    for payload, offset in zip(payloads, offsets):
+        delay = start + offset - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.ensure_future(send_request(session, url, payload)))
+    return list(await asyncio.gather(*tasks))
+
+
+async def run_open_loop(
+    session: aiohttp.ClientSession,
+    url: str,
+    payloads: List[Dict[str, Any]],
+    rate: float,
+    rng: random.Random,
+) -> List[RequestResult]:
+    """Отправка по расписанию Пуассона независимо от того, успевает ли сервер"""
+    return await run_replay(session, url, payloads, poisson_offsets(len(payloads), rate, rng))
+
+
+def save_workload(path: str, payloads: List[Dict[str, Any]], offsets: Optional[List[float]] = None) -> None:
+    """Нагрузка в JSONL {"offset", "payload"} для повторного проигрывания (autotune_server.py)"""
+    with open(path, "w", encoding="utf-8") as f:
+        for i, payload in enumerate(payloads):
+            record = {"offset": offsets[i]} if offsets else {}
+            f.write(json.dumps({**record, "payload": payload}, ensure_ascii=False) + "\n")
+
+
+def load_workload(path: str) -> tuple[List[Dict[str, Any]], Optional[List[float]]]:
+    """
+    (payloads, offsets) из JSONL: строки {"offset", "payload"} или просто
+    тела запросов; offsets - None, если хотя бы у одной строки его нет
+    """
+    payloads, offsets = [], []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            payloads.append(record.get("payload", record))
+            offsets.append(record.get("offset"))
+    if not payloads:
+        raise ValueError(f"Пустая нагрузка: {path}")
+    if any(offset is None for offset in offsets):
+        return payloads, None
+    return payloads, offsets
+
+
+def _distribution(values: List[float]) -> Dict[str, Optional[float]]:
+    """mean/p50/p90/p99 в миллисекундах"""
+    if not values:
+        return {"mean": None, "p50": None, "p90": None, "p99": None}
+    return {
+        "mean": sum(values) / len(values) * 1000,
+        "p50": percentile(values, 50) * 1000,
+        "p90": percentile(values, 90) * 1000,
+        "p99": percentile(values, 99) * 1000,
+    }
+
+
+def summarize(results: List[RequestResult], duration: float) -> Dict[str, Any]:
+    """Агрегированные метрики прогона"""
+    ok = [r for r in results if r.success]
+    output_tokens = sum(r.output_tokens for r in ok)
+    return {
+        "completed": len(ok),
+        "failed": len(results) - len(ok),
+        "duration_s": duration,
+        "request_throughput": len(ok) / duration if duration > 0 else 0.0,
+        "output_throughput": output_tokens / duration if duration > 0 else 0.0,
+        "total_prompt_tokens": sum(r.prompt_tokens or 0 for r in ok),
+        "total_output_tokens": output_tokens,
+        "ttft_ms": _distribution([r.ttft for r in ok if r.ttft is not None]),
+        "itl_ms": _distribution([t for r in ok for t in r.itl]),
+        "tpot_ms": _distribution([r.tpot for r in ok if r.tpot is not None]),
+        "e2e_ms": _distribution([r.e2e for r in ok]),
+        "errors": sorted({r.error for r in results if r.error})[:10],
+    }
+
+
+def print_summary(summary: Dict[str, Any]) -> None:
+    fmt = lambda v: f"{v:10.1f}" if v is not None else "       n/a"
+    print("=" * 70)
+    print("📊 РЕЗУЛЬТАТЫ")
+    print("=" * 70)
+    print(f"Успешно / ошибок:     {summary['completed']} / {summary['failed']}")
+    print(f"Длительность:         {summary['duration_s']:.2f} s")
+    print(f"Requests/s:           {summary['request_throughput']:.2f}")
+    print(f"Output tokens/s:      {summary['output_throughput']:.1f}")
+    print(f"Prompt / output tok:  {summary['total_prompt_tokens']} / {summary['total_output_tokens']}")
+    print()
+    print(f"{'ms':<10}{'mean':>10}{'p50':>10}{'p90':>10}{'p99':>10}")
+    for name, key in (("TTFT", "ttft_ms"), ("ITL", "itl_ms"), ("TPOT", "tpot_ms"), ("E2E", "e2e_ms")):
+        d = summary[key]
+        print(f"{name:<10}{fmt(d['mean'])}{fmt(d['p50'])}{fmt(d['p90'])}{fmt(d['p99'])}")
+    for error in summary["errors"]:
+        print(f"❌ {error}")
+    print("=" * 70)
+
+
+async def run_benchmark(
+    args,
+    payloads: List[Dict[str, Any]],
+    rng: random.Random,
+    warmup: Optional[List[Dict[str, Any]]] = None,
+) -> Dict[str, Any]:
+    url = f"{args.api_url}/v1/chat/completions"
+    connector = aiohttp.TCPConnector(limit=args.concurrency if args.mode == "closed" else 0)
+    timeout = aiohttp.ClientTimeout(total=args.timeout)
+
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        # Прогрев: первые запросы платят за компиляцию/аллокации на сервере
+        if warmup:
+            await run_closed_loop(session, url, warmup, len(warmup))
+
+        start = time.perf_counter()
+        if args.mode == "closed":
+            results = await run_closed_loop(session, url, payloads, args.concurrency)
+        else:
+            results = await run_open_loop(session, url, payloads, args.rate, rng)
+        duration = time.perf_counter() - start
+
+    return {"summary": summarize(results, duration), "requests": results}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Нагрузочный бенчмарк vLLM OpenAI API (TTFT/ITL/throughput)"
+    )
+
+    parser.add_argument(
+        "--api-url",
+        default="http://localhost:8000",
+        help="URL vLLM API (по умолчанию: http://localhost:8000)"
+    )
+
+    parser.add_argument(
+        "--model",
+        default="vllm-model",
+        help="Имя модели в запросе (по умолчанию: vllm-model)"
+    )
+
+    parser.add_argument(
+        "--mode",
+        choices=["closed", "open"],
+        default="closed",
+        help="closed - фиксированная параллельность, open - пуассоновский поток (по умолчанию: closed)"
+    )
+
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=16,
+        help="Одновременных запросов в режиме closed (по умолчанию: 16)"
+    )
+
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=4.0,
+        help="Запросов в секунду в режиме open (по умолчанию: 4)"
+    )
+
+    parser.add_argument(
+        "--num-requests",
+        type=int,
+        default=200,
+        help="Число измеряемых запросов (по умолчанию: 200)"
+    )
+
+    parser.add_argument(
+        "--warmup",
+        type=int,
+        default=4,
+        help="Запросов прогрева, не входят в результаты (по умолчанию: 4)"
+    )
+
+    parser.add_argument(
+        "--workload",
+        choices=["text", "image"],
+        default="text",
+        help="Тип нагрузки (по умолчанию: text)"
+    )
+
+    parser.add_argument(
+        "--prompt-len",
+        default="fixed:256",
+        help="Длина промпта в словах: fixed:N, uniform:LO:HI, normal:MEAN:STD, "
+             "lognormal:MEDIAN:SIGMA (по умолчанию: fixed:256)"
+    )
+
+    parser.add_argument(
+        "--output-len",
+        default="fixed:128",
+        help="Длина ответа в токенах, те же распределения (по умолчанию: fixed:128)"
+    )
+
+    parser.add_argument(
+        "--allow-eos",
+        action="store_true",
+        help="Разрешить ранний EOS (по умолчанию ответ генерируется до max_tokens)"
+    )
+
+    parser.add_argument(
+        "--images",
+        default="imgs/*",
+        help="Glob с изображениями для --workload image (по умолчанию: imgs/*)"
+    )
+
+    parser.add_argument(
+        "--images-per-request",
+        type=int,
+        default=1,
+        help="Изображений в запросе (по умолчанию: 1)"
+    )
+
+    parser.add_argument(
+        "--max-pixels",
+        type=int,
+        default=None,
+        help="Уменьшать изображения до этого бюджета пикселей перед отправкой"
+    )
+
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="Seed генератора нагрузки (по умолчанию: 0)"
+    )
+
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=600,
+        help="Таймаут одного запроса, секунды (по умолчанию: 600)"
+    )
+
+    parser.add_argument(
+        "--output",
+        help="Сохранить результаты в JSON"
+    )
+
+    parser.add_argument(
+        "--store",
+        nargs="?",
+        const=str(DEFAULT_DB_PATH),
+        metavar="DB",
+        help=f"Сохранить прогон в историю (SQLite, по умолчанию: {DEFAULT_DB_PATH}); "
+             "отчет: python bench_store.py report"
+    )
+
+    parser.add_argument(
+        "--tag",
+        action="append",
+        default=[],
+        metavar="KEY=VALUE",
+        help="Тег прогона для --store, например label=after-upgrade или model=qwen-7b "
+             "(по умолчанию модель, профиль и версии берутся у сервера)"
+    )
+
+    parser.add_argument(
+        "--save-workload",
+        metavar="FILE",
+        help="Сохранить измеряемые запросы (и расписание open loop) в JSONL для autotune_server.py"
+    )
+
+    parser.add_argument(
+        "--save-requests",
+        action="store_true",
+        help="Включить в JSON метрики каждого запроса"
+    )
+
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    try:
+        overrides = parse_tags(args.tag)
+        # Прогрев на отдельных запросах, чтобы не греть prefix cache измеряемых
+        payloads = build_payloads(args, rng, args.warmup + args.num_requests)
+    except ValueError as e:
+        print(f"❌ Ошибка: {e}")
+        return 1
+
+    print("=" * 70)
+    print("🏁 vLLM Benchmark")
+    print("=" * 70)
+    print(f"API:       {args.api_url}")
+    if args.mode == "closed":
+        print(f"Нагрузка:  closed loop, concurrency={args.concurrency}")
+    else:
+        print(f"Нагрузка:  open loop, rate={args.rate} req/s (Poisson)")
+    print(f"Workload:  {args.workload}, prompt={args.prompt_len}, output={args.output_len}")
+    print(f"Запросов:  {args.num_requests} (+{args.warmup} прогрев)")
+    print()
+
+    if args.save_workload:
+        # Расписание open loop - первое использование rng в run_benchmark
+        offsets = None
+        if args.mode == "open":
+            schedule_rng = random.Random()
+            schedule_rng.setstate(rng.getstate())
+            offsets = poisson_offsets(args.num_requests, args.rate, schedule_rng)
+        save_workload(args.save_workload, payloads[args.warmup:], offsets)
+        print(f"💾 Нагрузка: {args.save_workload}")
+
+    run = asyncio.run(run_benchmark(
+        args, payloads[args.warmup:], rng, warmup=payloads[:args.warmup]
+    ))
+    print_summary(run["summary"])
+
+    if args.output:
+        config = {k: v for k, v in vars(args).items() if k not in ("output", "save_requests")}
+        data = {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "config": config,
+            "summary": run["summary"],
+        }
+        if args.save_requests:
+            data["requests"] = [asdict(r) for r in run["requests"]]
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2, ensure_ascii=False)
+        print(f"💾 Результаты: {args.output}")
+
+    if args.store:
+        config = {k: v for k, v in vars(args).items() if k in WORKLOAD_KEYS}
+        rows = [
+            (r.ttft * 1000 if r.ttft is not None else None,
+             r.tpot * 1000 if r.tpot is not None else None,
+             r.e2e * 1000, r.output_tokens)
+            for r in run["requests"] if r.success
+        ]
+        store = BenchStore(args.store)
+        run_id = store.save_run(collect_tags(args.api_url, overrides), config, run["summary"], rows)
+        store.close()
+        print(f"🗄️  Прогон #{run_id} сохранен: {args.store}")
+
+    return 0 if run["summary"]["completed"] else 1
+
+
+if __name__ == "__main__":
+    exit(main())
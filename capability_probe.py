@@ -0,0 +1,394 @@
+#!/usr/bin/env python3
+"""
+Кэшируемая проверка возможностей окружения (CUDA, pinned/unified memory, P2P, WSL2)
+
+check_uva_detailed.py и shell-скрипты проверяют все заново при каждом
+запуске. Здесь результат сохраняется в JSON вместе с ключом окружения:
+версия драйвера, GPU, версии torch/vllm/flashinfer, ядро. Ключ собирается
+без импорта torch (метаданные пакетов, /proc), поэтому повторный запуск
+берет готовый результат за миллисекунды; проверка повторяется, только
+когда ключ изменился (обновили драйвер, vLLM, ядро WSL...).
+
+Сами проверки - словарь функций (DEFAULT_PROBES), их можно подменить
+готовыми значениями. Лаунчер (vllm_server.py) по результату меняет флаги:
+например, убирает --cpu-offload-gb в WSL2 без unified memory.
+
+Запуск:
+    python capability_probe.py            # из кэша или с проверкой
+    python capability_probe.py --refresh  # проверить заново
+"""
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+import platform
+import re
+import shutil
+import subprocess
+import sys
+import time
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from importlib.metadata import PackageNotFoundError, version
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+DEFAULT_CACHE_PATH = Path.home() / ".cache" / "vllm-setup" / "capabilities.json"
+
+# Сколько окружений (ключей) хранить - например, несколько venv
+MAX_ENTRIES = 8
+
+KEY_PACKAGES = ("torch", "vllm", "flashinfer-python")
+
+
+@dataclass
+class Capabilities:
+    """Результат проверки для одного ключа окружения"""
+    key: Dict[str, Any]
+    results: Dict[str, Any] = field(default_factory=dict)
+    probed_at: str = ""
+    probe_seconds: float = 0.0
+    cached: bool = False
+
+    @property
+    def is_wsl(self) -> bool:
+        return bool(self.results.get("wsl"))
+
+    @property
+    def devices(self) -> List[Dict[str, Any]]:
+        return (self.results.get("cuda") or {}).get("devices", [])
+
+    @property
+    def cuda_available(self) -> bool:
+        return bool((self.results.get("cuda") or {}).get("available"))
+
+    @property
+    def min_capability(self) -> Optional[float]:
+        """Наименьший compute capability среди GPU (8.9 для 8,9)"""
+        caps = [major + minor / 10 for major, minor in (d["capability"] for d in self.devices)]
+        return min(caps) if caps else None
+
+    @property
+    def pinned_memory(self) -> bool:
+        return bool(self.results.get("pinned_memory"))
+
+    @property
+    def unified_memory(self) -> bool:
+        return bool(self.results.get("unified_memory"))
+
+    @property
+    def peer_access(self) -> Optional[bool]:
+        """P2P между всеми парами GPU (None для одной GPU)"""
+        return self.results.get("peer_access")
+
+    def format_report(self) -> str:
+        source = "кэш" if self.cached else f"проверено за {self.probe_seconds:.1f}s"
+        lines = [f"🔍 Окружение ({source}, {self.probed_at}):"]
+        for name, value in self.key.items():
+            lines.append(f"   {name:<18} {value}")
+        mark = lambda ok: "✅" if ok else "❌"
+        lines.append(f"   {'WSL2':<18} {'да' if self.is_wsl else 'нет'}")
+        lines.append(f"   {'CUDA':<18} {mark(self.cuda_available)}")
+        for i, device in enumerate(self.devices):
+            major, minor = device["capability"]
+            lines.append(f"   GPU {i:<14} {device['name']} (CC {major}.{minor}, {device['memory_gb']:.1f} GB)")
+        lines.append(f"   {'Pinned memory':<18} {mark(self.pinned_memory)}")
+        lines.append(f"   {'Unified memory':<18} {mark(self.unified_memory)}")
+        if self.peer_access is not None:
+            lines.append(f"   {'P2P':<18} {mark(self.peer_access)}")
+        lines.append(f"   {'FlashInfer':<18} {mark(self.results.get('flashinfer'))}")
+        return "\n".join(lines)
+
+
+# --- ключ окружения (дешево, без torch) ---
+
+def package_version(name: str) -> Optional[str]:
+    try:
+        return version(name)
+    except PackageNotFoundError:
+        return None
+
+
+def _nvidia_smi(query: str) -> List[str]:
+    if not shutil.which("nvidia-smi"):
+        return []
+    try:
+        output = subprocess.run(
+            ["nvidia-smi", f"--query-gpu={query}", "--format=csv,noheader"],
+            capture_output=True, text=True, timeout=10, check=True,
+        ).stdout
+    except subprocess.SubprocessError:
+        return []
+    return [line.strip() for line in output.splitlines() if line.strip()]
+
+
+def driver_and_gpus() -> Dict[str, Any]:
+    """
+    Версия драйвера и модели GPU: на Linux из /proc без запуска процессов,
+    в WSL2 (там нет /proc/driver/nvidia) - через nvidia-smi
+    """
+    try:
+        with open("/proc/driver/nvidia/version", encoding="utf-8") as f:
+            match = re.search(r"Kernel Module(?: for \S+)?\s+([\d.]+)", f.read())
+        gpus = []
+        for info in sorted(glob.glob("/proc/driver/nvidia/gpus/*/information")):
+            with open(info, encoding="utf-8") as f:
+                model = re.search(r"Model:\s*(.+)", f.read())
+            gpus.append(model.group(1).strip() if model else "?")
+        if match:
+            return {"driver": match.group(1), "gpus": gpus}
+    except OSError:
+        pass
+    rows = [row.split(", ", 1) for row in _nvidia_smi("driver_version,name")]
+    return {
+        "driver": rows[0][0] if rows else None,
+        "gpus": [row[1] for row in rows if len(row) > 1],
+    }
+
+
+def fingerprint_key() -> Dict[str, Any]:
+    """Все, от чего зависят результаты проверок"""
+    key = driver_and_gpus()
+    key["kernel"] = platform.release()
+    key["python"] = platform.python_version()
+    for name in KEY_PACKAGES:
+        key[name] = package_version(name)
+    return key
+
+
+def key_hash(key: Dict[str, Any]) -> str:
+    return hashlib.sha1(json.dumps(key, sort_keys=True).encode()).hexdigest()[:16]
+
+
+# --- проверки (дорого: импорт torch, инициализация CUDA) ---
+
+def probe_wsl() -> bool:
+    try:
+        with open("/proc/version", encoding="utf-8") as f:
+            text = f.read().lower()
+    except OSError:
+        return False
+    return "microsoft" in text or "wsl" in text
+
+
+def probe_cuda() -> Dict[str, Any]:
+    import torch
+
+    if not torch.cuda.is_available():
+        return {"available": False, "devices": []}
+    devices = []
+    for i in range(torch.cuda.device_count()):
+        props = torch.cuda.get_device_properties(i)
+        devices.append({
+            "name": props.name,
+            "capability": [props.major, props.minor],
+            "memory_gb": round(props.total_memory / 1024**3, 2),
+        })
+    return {"available": True, "version": torch.version.cuda, "devices": devices}
+
+
+def probe_pinned_memory() -> bool:
+    import torch
+
+    x = torch.empty(1024, 1024).pin_memory()
+    ok = x.is_pinned()
+    if torch.cuda.is_available():
+        x.cuda(non_blocking=True)
+        torch.cuda.synchronize()
+    return ok
+
+
+def probe_unified_memory() -> bool:
+    """
+    cudaMallocManaged с полноценной подкачкой: нет в WSL2, есть на Linux
+    начиная с Pascal (CC 6.0) - без него не работает CPU offload vLLM V1
+    """
+    if probe_wsl():
+        return False
+    import torch
+
+    if not torch.cuda.is_available():
+        return False
+    return all(torch.cuda.get_device_capability(i)[0] >= 6 for i in range(torch.cuda.device_count()))
+
+
+def probe_peer_access() -> Optional[bool]:
+    import torch
+
+    count = torch.cuda.device_count() if torch.cuda.is_available() else 0
+    if count < 2:
+        return None
+    return all(
+        torch.cuda.can_device_access_peer(i, j)
+        for i in range(count) for j in range(count) if i != j
+    )
+
+
+def probe_flashinfer() -> bool:
+    import importlib.util
+    return importlib.util.find_spec("flashinfer") is not None
+
+
+DEFAULT_PROBES: Dict[str, Callable[[], Any]] = {
+    "wsl": probe_wsl,
+    "cuda": probe_cuda,
+    "pinned_memory": probe_pinned_memory,
+    "unified_memory": probe_unified_memory,
+    "peer_access": probe_peer_access,
+    "flashinfer": probe_flashinfer,
+}
+
+
+def run_probes(probes: Optional[Dict[str, Callable[[], Any]]] = None) -> Dict[str, Any]:
+    """Выполнить проверки; упавшая проверка дает None (возможность отсутствует)"""
+    results = {}
+    for name, probe in (probes or DEFAULT_PROBES).items():
+        try:
+            results[name] = probe()
+        except Exception:
+            results[name] = None
+    return results
+
+
+def run_probes_subprocess(timeout: float = 300) -> Dict[str, Any]:
+    """
+    Проверки в отдельном процессе: CUDA не инициализируется в процессе
+    лаунчера, иначе vLLM пришлось бы переключать воркеры на spawn
+    """
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--probe-only"],
+        capture_output=True, text=True, timeout=timeout, check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+# --- кэш ---
+
+def _load_entries(path: Path) -> Dict[str, Any]:
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def load_or_probe(
+    path: Path = DEFAULT_CACHE_PATH,
+    key: Optional[Dict[str, Any]] = None,
+    probe: Optional[Callable[[], Dict[str, Any]]] = None,
+    refresh: bool = False,
+) -> Capabilities:
+    """
+    Результат для текущего окружения: из кэша или после проверки
+
+    Args:
+        path: JSON файл кэша
+        key: Ключ окружения (по умолчанию fingerprint_key())
+        probe: Функция проверок (по умолчанию run_probes_subprocess)
+        refresh: Проверить заново, даже если ключ есть в кэше
+    """
+    key = fingerprint_key() if key is None else key
+    digest = key_hash(key)
+    entries = _load_entries(path)
+
+    if not refresh and digest in entries:
+        entry = entries[digest]
+        return Capabilities(
+            key=entry["key"],
+            results=entry["results"],
+            probed_at=entry.get("probed_at", ""),
+            probe_seconds=entry.get("probe_seconds", 0.0),
+            cached=True,
+        )
+
+    started = time.perf_counter()
+    results = (probe or run_probes_subprocess)()
+    caps = Capabilities(
+        key=key,
+        results=results,
+        probed_at=datetime.now().isoformat(timespec="seconds"),
+        probe_seconds=round(time.perf_counter() - started, 3),
+    )
+
+    entries[digest] = asdict(caps)
+    entries[digest].pop("cached")
+    # Самые старые окружения вытесняются
+    newest = sorted(entries.items(), key=lambda item: item[1].get("probed_at", ""))[-MAX_ENTRIES:]
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(dict(newest), f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+    return caps
+
+
+# --- флаги запуска ---
+
+def adjust_engine_args(engine: Dict[str, Any], caps: Capabilities) -> List[str]:
+    """
+    Поправить аргументы vLLM под возможности окружения (engine меняется на месте)
+
+    Returns:
+        Описания изменений для вывода
+    """
+    notes = []
+    if engine.get("cpu_offload_gb") and not caps.unified_memory:
+        engine.pop("cpu_offload_gb")
+        reason = "WSL2" if caps.is_wsl else "нет unified memory"
+        notes.append(f"--cpu-offload-gb убран: {reason} (используйте AWQ или меньший контекст)")
+
+    capability = caps.min_capability
+    if capability is not None and capability < 8.0 and "dtype" not in engine:
+        engine["dtype"] = "half"
+        notes.append(f"--dtype half: bfloat16 требует CC >= 8.0 (у GPU {capability})")
+
+    tp = int(engine.get("tensor_parallel_size") or 1)
+    if caps.cuda_available and tp > len(caps.devices):
+        notes.append(f"--tensor-parallel-size {tp} больше числа GPU ({len(caps.devices)})")
+    if tp > 1 and caps.peer_access is False and not engine.get("disable_custom_all_reduce"):
+        engine["disable_custom_all_reduce"] = True
+        notes.append("--disable-custom-all-reduce: нет P2P между GPU")
+    return notes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Возможности окружения (кэшируются по версиям драйвера/torch/vllm/ядра)")
+
+    parser.add_argument(
+        "--refresh",
+        action="store_true",
+        help="Проверить заново, игнорируя кэш"
+    )
+
+    parser.add_argument(
+        "--cache",
+        default=str(DEFAULT_CACHE_PATH),
+        help=f"Файл кэша (по умолчанию: {DEFAULT_CACHE_PATH})"
+    )
+
+    parser.add_argument(
+        "--json",
+        action="store_true",
+        help="Вывести результат как JSON"
+    )
+
+    # Внутренний режим для run_probes_subprocess()
+    parser.add_argument("--probe-only", action="store_true", help=argparse.SUPPRESS)
+
+    args = parser.parse_args()
+
+    if args.probe_only:
+        print(json.dumps(run_probes()))
+        return
+
+    caps = load_or_probe(Path(args.cache), refresh=args.refresh)
+    if args.json:
+        print(json.dumps(asdict(caps), ensure_ascii=False, indent=2))
+    else:
+        print(caps.format_report())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Проверка бюджета времени запуска CLI без тяжелых импортов
+
+Запускает сценарии (vllm_server.py --help, --dry-run, --list-models,
+check_vllm.py) в чистом интерпретаторе, меряет время (медиана из --repeat)
+и проверяет, что vllm/torch/transformers не импортировались. При превышении
+бюджета показывает самые дорогие импорты (python -X importtime).
+
+Код возврата 1 - бюджет превышен или загружен тяжелый модуль.
+
+Запуск:
+    python check_import_time.py
+    python check_import_time.py --budget 0.3 --repeat 9
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from typing import Dict, List, Tuple
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Модули, которые не должны грузиться до запуска сервера
+HEAVY_MODULES = ("vllm", "torch", "transformers")
+
+# Бюджет на сценарий, секунды (включая старт интерпретатора)
+DEFAULT_BUDGET = 0.5
+
+SCENARIOS: Dict[str, Tuple[str, List[str]]] = {
+    "vllm_server --help": ("vllm_server.py", ["--help"]),
+    "vllm_server --list-models": ("vllm_server.py", ["--list-models"]),
+    "vllm_server --dry-run": ("vllm_server.py", ["--model", "qwen3-vl-2b", "--profile", "latency", "--dry-run"]),
+    "check_vllm": ("check_vllm.py", []),
+}
+
+# Выполняется в дочернем процессе: запуск скрипта и список тяжелых модулей
+_PROBE = """
+import contextlib, io, json, runpy, sys, time
+start = time.perf_counter()
+script, args, heavy = sys.argv[1], json.loads(sys.argv[2]), json.loads(sys.argv[3])
+sys.argv = [script] + args
+with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+    try:
+        runpy.run_path(script, run_name="__main__")
+    except SystemExit:
+        pass
+loaded = sorted({name.split(".")[0] for name in sys.modules} & set(heavy))
+print(json.dumps({"script_s": time.perf_counter() - start, "heavy": loaded}))
+"""
+
+
+def run_probe(script: str, args: List[str]) -> Tuple[float, float, List[str]]:
+    """(время процесса целиком, время скрипта, загруженные тяжелые модули)"""
+    start = time.perf_counter()
+    output = subprocess.run(
+        [sys.executable, "-c", _PROBE, os.path.join(PROJECT_DIR, script),
+         json.dumps(args), json.dumps(HEAVY_MODULES)],
+        capture_output=True, text=True, cwd=PROJECT_DIR, check=True,
+    ).stdout
+    wall = time.perf_counter() - start
+    result = json.loads(output.strip().splitlines()[-1])
+    return wall, result["script_s"], result["heavy"]
+
+
+def slowest_imports(script: str, args: List[str], top: int = 10) -> List[Tuple[int, str]]:
+    """[(кумулятивное время в мкс, модуль)] из python -X importtime"""
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", os.path.join(PROJECT_DIR, script)] + args,
+        capture_output=True, text=True, cwd=PROJECT_DIR,
+    ).stderr
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        rows.append((int(cumulative), name.rstrip()[1:]))
+    # Верхний уровень дерева импортов - без отступа
+    top_level = [(us, name) for us, name in rows if not name.startswith(" ")]
+    return sorted(top_level or rows, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бюджет времени запуска CLI без импорта vllm/torch")
+
+    parser.add_argument(
+        "--budget",
+        type=float,
+        default=DEFAULT_BUDGET,
+        help=f"Максимум на сценарий, секунды (по умолчанию: {DEFAULT_BUDGET})"
+    )
+
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=5,
+        help="Запусков на сценарий, берется медиана (по умолчанию: 5)"
+    )
+
+    args = parser.parse_args()
+
+    failed = False
+    print(f"⏱️  Бюджет: {args.budget:.2f}s на сценарий (медиана из {args.repeat})")
+    for name, (script, script_args) in SCENARIOS.items():
+        runs = [run_probe(script, script_args) for _ in range(args.repeat)]
+        wall = statistics.median(r[0] for r in runs)
+        script_s = statistics.median(r[1] for r in runs)
+        heavy = sorted({m for r in runs for m in r[2]})
+
+        ok = wall <= args.budget and not heavy
+        status = "✅" if ok else "❌"
+        line = f"{status} {name:<28} {wall:6.3f}s (скрипт {script_s:.3f}s)"
+        if heavy:
+            line += f"  импортированы: {', '.join(heavy)}"
+        print(line)
+
+        if not ok:
+            failed = True
+            for us, module in slowest_imports(script, script_args):
+                print(f"      {us / 1000:8.1f} ms  {module}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,70 @@
 #!/usr/bin/env python3
-import vllm; 
-import torch;
+"""
+Проверка установки vLLM и CUDA
 
-print(f'vllm version: {vllm.__version__}')
-print(f'CUDA available: {torch.cuda.is_available()}')
-print(f'CUDA version: {torch.version.cuda}')
+Версии берутся из метаданных пакетов, GPU - из nvidia-smi: без импорта
+vllm/torch проверка занимает доли секунды. --torch дополнительно импортирует
+torch и проверяет, что он видит CUDA.
+"""
 
+import argparse
+import shutil
+import subprocess
+from importlib.metadata import PackageNotFoundError, version
+from typing import Optional
+
+
+def package_version(name: str) -> Optional[str]:
+    try:
+        return version(name)
+    except PackageNotFoundError:
+        return None
+
+
+def torch_cuda_build(torch_version: Optional[str]) -> Optional[str]:
+    """CUDA, под которую собран torch, по локальной версии: 2.8.0+cu128 -> 12.8"""
+    if not torch_version or "+cu" not in torch_version:
+        return None
+    digits = torch_version.split("+cu", 1)[1]
+    return f"{digits[:-1]}.{digits[-1]}" if len(digits) > 1 else digits
+
+
+def nvidia_smi_gpus() -> Optional[str]:
+    if not shutil.which("nvidia-smi"):
+        return None
+    try:
+        return subprocess.run(
+            ["nvidia-smi", "--query-gpu=name,memory.total,driver_version", "--format=csv,noheader"],
+            capture_output=True, text=True, timeout=10, check=True,
+        ).stdout.strip()
+    except subprocess.SubprocessError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Проверка установки vLLM и CUDA")
+
+    parser.add_argument(
+        "--torch",
+        action="store_true",
+        help="Импортировать torch и проверить torch.cuda.is_available() (несколько секунд)"
+    )
+
+    args = parser.parse_args()
+
+    vllm_version = package_version("vllm")
+    torch_version = package_version("torch")
+    print(f'vllm version: {vllm_version or "не установлен"}')
+    print(f'torch version: {torch_version or "не установлен"}')
+    print(f'CUDA version (torch build): {torch_cuda_build(torch_version) or "?"}')
+    gpus = nvidia_smi_gpus()
+    print(f'GPU (nvidia-smi): {gpus or "не найдена"}')
+
+    if args.torch:
+        import torch
+        print(f'CUDA available: {torch.cuda.is_available()}')
+        print(f'CUDA version: {torch.version.cuda}')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,361 @@
+#!/usr/bin/env python3
+"""
+Трассировка клиентских запросов по фазам
+
+Запрос (Qwen3VLClient.ask и др.) - это trace, его фазы - spans:
+
+- image:      одно изображение целиком (transport.image_url)
+- hash:       хэш содержимого для кэша изображений
+- read:       чтение файла
+- preprocess: уменьшение и перекодирование (image_preprocess)
+- encode:     base64
+- build:      сборка payload (включая изображения)
+- serialize:  json.dumps тела запроса
+- connect:    установка TCP соединения (только aiohttp)
+- upload:     отправка тела (только aiohttp)
+- send:       от отправки до заголовков ответа (connect + upload + обработка
+              запроса сервером до постановки в очередь; без потока заголовки
+              приходят после генерации, и send включает ее)
+- prefill:    от заголовков до первого токена (очередь + prefill на сервере)
+- decode:     от первого токена до конца потока
+- response:   чтение и разбор ответа без потока
+
+Spans копятся в памяти запроса и пишутся в JSONL одной строкой на span
+одним write в конце запроса. Без активного trace span() - это один
+ContextVar.get(), так что вызовы можно оставлять в коде всегда; sample_rate
+позволяет писать только часть запросов.
+
+Запуск:
+    python query_qwen3vl.py -q "..." -i photo.jpg --trace trace.jsonl
+    python client_tracing.py summary trace.jsonl
+    python client_tracing.py chrome trace.jsonl -o trace.json  # chrome://tracing, Perfetto
+"""
+
+import argparse
+import contextlib
+import contextvars
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+# Перевод time.perf_counter() во время эпохи (для ts в файле)
+_EPOCH_OFFSET = time.time() - time.perf_counter()
+
+# Порядок фаз в отчете
+PHASES = (
+    "image", "hash", "read", "preprocess", "encode", "build", "serialize",
+    "connect", "upload", "send", "prefill", "decode", "response",
+)
+
+
+@dataclass
+class Trace:
+    """Один запрос: spans с временами time.perf_counter()"""
+    name: str
+    attrs: Dict[str, Any] = field(default_factory=dict)
+    trace_id: str = field(default_factory=lambda: uuid.uuid4().hex[:16])
+    start: float = field(default_factory=time.perf_counter)
+    spans: List[Dict[str, Any]] = field(default_factory=list)
+
+    def add(self, name: str, start: float, end: float, **attrs: Any) -> None:
+        """Добавить span по готовым меткам времени"""
+        # list.append атомарен: spans добавляются и из потоков asyncio.to_thread
+        self.spans.append({
+            "trace_id": self.trace_id,
+            "name": name,
+            "ts": round((start + _EPOCH_OFFSET) * 1e6),
+            "dur": round((end - start) * 1e6),
+            "tid": threading.get_ident(),
+            **({"attrs": attrs} if attrs else {}),
+        })
+
+    @contextlib.contextmanager
+    def span(self, name: str, **attrs: Any) -> Iterator[Dict[str, Any]]:
+        """Измерить блок; в yield-нутый dict можно дописать атрибуты (без trace - None)"""
+        start = time.perf_counter()
+        try:
+            yield attrs
+        finally:
+            self.add(name, start, time.perf_counter(), **attrs)
+
+
+_current: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar(
+    "client_trace", default=None
+)
+
+# Общий no-op контекст: без trace span() ничего не аллоцирует
+_NOOP = contextlib.nullcontext()
+
+
+def current_trace() -> Optional[Trace]:
+    return _current.get()
+
+
+def span(name: str, **attrs: Any):
+    """Span в текущем trace (no-op, если запрос не трассируется)"""
+    trace = _current.get()
+    if trace is None:
+        return _NOOP
+    return trace.span(name, **attrs)
+
+
+def add_span(name: str, start: Optional[float], end: Optional[float], **attrs: Any) -> None:
+    """Span по меткам time.perf_counter() (пропускается, если меток нет)"""
+    trace = _current.get()
+    if trace is not None and start is not None and end is not None:
+        trace.add(name, start, end, **attrs)
+
+
+class Tracer:
+    """
+    Запись trace в JSONL
+
+    Args:
+        path: Файл для spans (дописывается)
+        sample_rate: Доля трассируемых запросов (0-1)
+    """
+
+    def __init__(self, path: str, sample_rate: float = 1.0):
+        self.path = path
+        self.sample_rate = sample_rate
+        self._lock = threading.Lock()
+        self._file = open(path, "a", encoding="utf-8")
+        self._pid = os.getpid()
+
+    @contextlib.contextmanager
+    def trace(self, name: str, **attrs: Any) -> Iterator[Optional[Trace]]:
+        """
+        Трассировать запрос: spans внутри блока (и в задачах/потоках,
+        унаследовавших контекст) попадают в этот trace
+        """
+        if _current.get() is not None or random.random() >= self.sample_rate:
+            # Вложенный запрос (например, ask() из ask_stream()) пишется во внешний trace
+            yield _current.get()
+            return
+        trace = Trace(name, attrs)
+        token = _current.set(trace)
+        try:
+            yield trace
+        except BaseException as e:
+            trace.attrs["error"] = type(e).__name__
+            raise
+        finally:
+            _current.reset(token)
+            trace.add(name, trace.start, time.perf_counter(), **trace.attrs)
+            trace.spans[-1]["root"] = True
+            self.write(trace)
+
+    def write(self, trace: Trace) -> None:
+        lines = "".join(
+            json.dumps({**s, "pid": self._pid}, ensure_ascii=False) + "\n"
+            for s in trace.spans
+        )
+        with self._lock:
+            self._file.write(lines)
+            self._file.flush()
+
+    def close(self) -> None:
+        self._file.close()
+
+
+def trace_request(tracer: Optional[Tracer], name: str, **attrs: Any):
+    """tracer.trace() или no-op, если трассировка выключена"""
+    if tracer is None:
+        return contextlib.nullcontext()
+    return tracer.trace(name, **attrs)
+
+
+def aiohttp_trace_config():
+    """
+    aiohttp.TraceConfig, добавляющий spans connect и upload в текущий trace
+
+    Callbacks выполняются в задаче запроса, поэтому видят ее ContextVar.
+    """
+    import aiohttp
+
+    async def on_request_start(session, ctx, params):
+        ctx.chunk_sent = None
+
+    async def on_connection_create_start(session, ctx, params):
+        ctx.connect_start = time.perf_counter()
+
+    async def on_connection_create_end(session, ctx, params):
+        add_span("connect", getattr(ctx, "connect_start", None), time.perf_counter())
+
+    async def on_request_headers_sent(session, ctx, params):
+        ctx.headers_sent = time.perf_counter()
+
+    async def on_request_chunk_sent(session, ctx, params):
+        ctx.chunk_sent = time.perf_counter()
+
+    async def on_request_end(session, ctx, params):
+        add_span("upload", getattr(ctx, "headers_sent", None), ctx.chunk_sent)
+
+    config = aiohttp.TraceConfig()
+    config.on_request_start.append(on_request_start)
+    config.on_connection_create_start.append(on_connection_create_start)
+    config.on_connection_create_end.append(on_connection_create_end)
+    config.on_request_headers_sent.append(on_request_headers_sent)
+    config.on_request_chunk_sent.append(on_request_chunk_sent)
+    config.on_request_end.append(on_request_end)
+    return config
+
+
+# --- анализ ---
+
+def read_spans(path: str) -> Iterator[Dict[str, Any]]:
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def group_traces(spans: Iterable[Dict[str, Any]]) -> Dict[str, List[Dict[str, Any]]]:
+    traces: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+    for s in spans:
+        traces[s["trace_id"]].append(s)
+    return traces
+
+
+@dataclass
+class PhaseSummary:
+    """Перцентили фазы по запросам (мс); фаза суммируется внутри запроса"""
+    name: str
+    count: int
+    p50: float
+    p95: float
+    p99: float
+    mean: float
+    share: float
+
+
+def summarize(spans: Iterable[Dict[str, Any]]) -> tuple[List[PhaseSummary], Optional[PhaseSummary]]:
+    """
+    (фазы, запрос целиком): длительности фаз суммируются внутри trace
+    (несколько изображений - несколько spans), перцентили - по trace.
+    share - доля фазы во времени всех запросов.
+    """
+    from streaming import percentile
+
+    per_phase: Dict[str, List[float]] = defaultdict(list)
+    totals: List[float] = []
+    for trace_spans in group_traces(spans).values():
+        roots = [s for s in trace_spans if s.get("root")]
+        if not roots:
+            continue
+        totals.append(roots[0]["dur"] / 1000)
+        sums: Dict[str, float] = defaultdict(float)
+        for s in trace_spans:
+            if not s.get("root"):
+                sums[s["name"]] += s["dur"] / 1000
+        for name, value in sums.items():
+            per_phase[name].append(value)
+
+    def make(name: str, values: List[float]) -> PhaseSummary:
+        return PhaseSummary(
+            name, len(values), percentile(values, 50), percentile(values, 95),
+            percentile(values, 99), sum(values) / len(values),
+            sum(values) / sum(totals) if sum(totals) > 0 else 0.0,
+        )
+
+    order = {name: i for i, name in enumerate(PHASES)}
+    phases = [make(name, values) for name, values in
+              sorted(per_phase.items(), key=lambda kv: order.get(kv[0], len(order)))]
+    return phases, make("total", totals) if totals else None
+
+
+def format_summary(phases: List[PhaseSummary], total: Optional[PhaseSummary]) -> str:
+    if total is None:
+        return "📭 Trace пуст"
+    lines = [
+        f"🔎 Запросов: {total.count}",
+        f"   {'фаза':<11} {'n':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'доля':>6}",
+    ]
+    for p in phases + [total]:
+        share = f"{p.share * 100:5.1f}%" if p is not total else ""
+        lines.append(f"   {p.name:<11} {p.count:>6} {p.p50:>9.1f} {p.p95:>9.1f} {p.p99:>9.1f} {share:>6}")
+    lines.append("   (доли вложенных фаз пересекаются: image включает read/encode, build - image)")
+    return "\n".join(lines)
+
+
+def to_chrome_trace(spans: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Chrome trace event format: каждый запрос - отдельная строка (tid),
+    чтобы параллельные запросы не накладывались
+    """
+    events = []
+    rows: Dict[str, int] = {}
+    for s in spans:
+        row = rows.setdefault(s["trace_id"], len(rows) + 1)
+        events.append({
+            "name": s["name"],
+            "ph": "X",
+            "ts": s["ts"],
+            "dur": s["dur"],
+            "pid": s.get("pid", 0),
+            "tid": row,
+            "args": {"trace_id": s["trace_id"], **s.get("attrs", {})},
+        })
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+# --- CLI флаги для клиентов ---
+
+def add_tracing_arguments(parser) -> None:
+    """Общие флаги трассировки для CLI"""
+    parser.add_argument(
+        "--trace",
+        metavar="FILE",
+        help="Писать фазы запросов (spans) в JSONL; отчет: python client_tracing.py summary FILE"
+    )
+
+    parser.add_argument(
+        "--trace-sample",
+        type=float,
+        default=1.0,
+        help="Доля трассируемых запросов (по умолчанию: 1.0)"
+    )
+
+
+def tracer_from_args(args) -> Optional[Tracer]:
+    """Tracer из флагов add_tracing_arguments() (None если выключен)"""
+    if not args.trace:
+        return None
+    return Tracer(args.trace, args.trace_sample)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Анализ trace клиентских запросов")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    summary = commands.add_parser("summary", help="Перцентили фаз по запросам")
+    summary.add_argument("trace", help="JSONL файл --trace")
+
+    chrome = commands.add_parser("chrome", help="Экспорт в Chrome trace format (chrome://tracing, Perfetto)")
+    chrome.add_argument("trace", help="JSONL файл --trace")
+
+    chrome.add_argument(
+        "-o", "--output",
+        help="Файл JSON (по умолчанию: <trace>.chrome.json)"
+    )
+
+    args = parser.parse_args()
+    spans = list(read_spans(args.trace))
+
+    if args.command == "summary":
+        print(format_summary(*summarize(spans)))
+    else:
+        output = args.output or os.path.splitext(args.trace)[0] + ".chrome.json"
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(to_chrome_trace(spans), f)
+        print(f"💾 {len(spans)} spans -> {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,588 @@
+#!/usr/bin/env python3
+"""
+Планировщик параметров vLLM сервера по config.json модели и объему GPU памяти
+
+Вместо подбора gpu_mem/max_len методом OOM считает:
+- память весов (по размеру *.safetensors или по архитектуре из config.json,
+  с учетом dtype и AWQ/GPTQ/FP8 квантизации)
+- KV cache на токен: 2 (K и V) x слои x KV головы x head_dim x байты
+- сколько последовательностей полной длины помещается в KV cache
+  для каждой длины контекста
+
+и выдает аргументы запуска: --gpu-memory-utilization, --max-model-len,
+--max-num-seqs, --max-num-batched-tokens, --cpu-offload-gb.
+
+Работает только с файлами (локальный config.json или кэш HuggingFace),
+GPU не нужен.
+
+Запуск:
+    python config_planner.py Qwen/Qwen2.5-7B-Instruct --gpu-memory 24
+    python config_planner.py ./config.json --gpu-memory 32 --format args
+"""
+
+import argparse
+import glob
+import json
+import math
+import os
+import shutil
+import subprocess
+import sys
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+GIB = 1024**3
+
+DTYPE_BYTES = {
+    "float32": 4, "float": 4,
+    "bfloat16": 2, "float16": 2, "half": 2,
+    "float8": 1, "fp8": 1,
+}
+
+KV_CACHE_DTYPES = ("auto", "fp8", "fp8_e4m3", "fp8_e5m2")
+
+# Кандидаты --max-model-len (плюс max_position_embeddings модели)
+CONTEXT_LENGTHS = (2048, 4096, 8192, 16384, 32768, 65536, 131072, 262144)
+
+# Потолок планировщика vLLM для --max-num-seqs
+MAX_NUM_SEQS = 256
+
+# Контекст, на который считается --cpu-offload-gb, когда модель не помещается
+OFFLOAD_CONTEXT = 4096
+
+# CUDA graphs, аллокатор, NCCL - не зависит от модели
+FIXED_OVERHEAD_BYTES = int(1.0 * GIB)
+# Профилирование vision encoder (изображение максимального размера)
+VISION_PROFILE_BYTES = int(1.0 * GIB)
+
+
+class PlanError(ValueError):
+    """Модель не помещается даже с CPU offload"""
+
+
+@dataclass
+class ModelSpec:
+    """Параметры архитектуры, влияющие на память"""
+    name: str
+    num_layers: int
+    hidden_size: int
+    num_heads: int
+    num_kv_heads: int
+    head_dim: int
+    intermediate_size: int
+    vocab_size: int
+    max_position_embeddings: int
+    dtype: str = "bfloat16"
+    tie_embeddings: bool = False
+    quant_method: Optional[str] = None
+    weight_bits: int = 16
+    group_size: int = 128
+    num_experts: int = 0
+    moe_intermediate_size: int = 0
+    # MLA (DeepSeek V2/V3): в KV cache сжатый latent вместо K и V
+    kv_lora_rank: int = 0
+    qk_rope_head_dim: int = 0
+    vision_params: int = 0
+
+    @property
+    def dtype_bytes(self) -> int:
+        return DTYPE_BYTES.get(self.dtype, 2)
+
+    @property
+    def is_vlm(self) -> bool:
+        return self.vision_params > 0
+
+
+@dataclass
+class MemoryPlan:
+    """Итог планирования на одну GPU"""
+    model: str
+    gpu_memory_bytes: int
+    gpu_memory_utilization: float
+    weight_bytes: int
+    weight_source: str  # safetensors | config
+    overhead_bytes: int
+    kv_bytes_per_token: int
+    kv_cache_bytes: int
+    max_model_len: int
+    max_num_seqs: int
+    max_num_batched_tokens: int
+    cpu_offload_gb: int = 0
+    quantization: Optional[str] = None
+    kv_cache_dtype: str = "auto"
+    tensor_parallel_size: int = 1
+    # [(длина контекста, последовательностей полной длины)]
+    capacity: List[Tuple[int, int]] = field(default_factory=list)
+    warnings: List[str] = field(default_factory=list)
+
+    @property
+    def kv_cache_tokens(self) -> int:
+        return self.kv_cache_bytes // self.kv_bytes_per_token
+
+    def launcher_args(self) -> List[str]:
+        """Аргументы для vllm serve / vllm_server.py"""
+        args = [
+            "--gpu-memory-utilization", f"{self.gpu_memory_utilization:.2f}",
+            "--max-model-len", str(self.max_model_len),
+            "--max-num-seqs", str(self.max_num_seqs),
+            "--max-num-batched-tokens", str(self.max_num_batched_tokens),
+        ]
+        if self.cpu_offload_gb:
+            args += ["--cpu-offload-gb", str(self.cpu_offload_gb)]
+        if self.quantization:
+            args += ["--quantization", self.quantization]
+        if self.kv_cache_dtype != "auto":
+            args += ["--kv-cache-dtype", self.kv_cache_dtype]
+        if self.tensor_parallel_size > 1:
+            args += ["--tensor-parallel-size", str(self.tensor_parallel_size)]
+        return args
+
+    def format_report(self) -> str:
+        gib = lambda value: f"{value / GIB:.2f} GiB"
+        budget = self.gpu_memory_bytes * self.gpu_memory_utilization
+        lines = [
+            f"📦 Модель:            {self.model}",
+            f"🎮 GPU память:        {gib(self.gpu_memory_bytes)} x {self.gpu_memory_utilization:.2f} = {gib(budget)}",
+            f"⚖️  Веса:              {gib(self.weight_bytes)} ({self.weight_source})",
+            f"🧰 Активации/графы:   {gib(self.overhead_bytes)}",
+            f"🗃️  KV cache:          {gib(self.kv_cache_bytes)} "
+            f"({self.kv_bytes_per_token / 1024:.1f} KiB/токен, {self.kv_cache_tokens} токенов)",
+        ]
+        if self.cpu_offload_gb:
+            lines.append(f"💿 CPU offload:       {self.cpu_offload_gb} GB весов в RAM (медленно, PCIe)")
+        lines.append("")
+        lines.append("📏 Контекст -> последовательностей полной длины одновременно:")
+        for context, seqs in self.capacity:
+            marker = "  <-" if context == self.max_model_len else ""
+            lines.append(f"   {context:>7}: {seqs}{marker}")
+        for warning in self.warnings:
+            lines.append(f"⚠️  {warning}")
+        lines.append("")
+        lines.append("🚀 Аргументы запуска:")
+        lines.append("   " + " ".join(self.launcher_args()))
+        return "\n".join(lines)
+
+
+# --- config.json ---
+
+def hf_cache_dir() -> str:
+    if os.environ.get("HF_HUB_CACHE"):
+        return os.environ["HF_HUB_CACHE"]
+    hf_home = os.environ.get("HF_HOME", os.path.join("~", ".cache", "huggingface"))
+    return os.path.join(os.path.expanduser(hf_home), "hub")
+
+
+def find_model_dir(model: str, cache_dir: Optional[str] = None) -> Optional[str]:
+    """
+    Локальная директория модели: путь к директории/config.json или
+    последний snapshot HF id в кэше HuggingFace (None если не скачана)
+    """
+    path = os.path.expanduser(model)
+    if os.path.isfile(path):
+        return os.path.dirname(os.path.abspath(path))
+    if os.path.isdir(path):
+        return os.path.abspath(path)
+
+    repo = os.path.join(cache_dir or hf_cache_dir(), "models--" + model.replace("/", "--"))
+    ref = os.path.join(repo, "refs", "main")
+    if os.path.isfile(ref):
+        with open(ref, encoding="utf-8") as f:
+            snapshot = os.path.join(repo, "snapshots", f.read().strip())
+        if os.path.isdir(snapshot):
+            return snapshot
+    snapshots = sorted(glob.glob(os.path.join(repo, "snapshots", "*")), key=os.path.getmtime)
+    return snapshots[-1] if snapshots else None
+
+
+def load_config(model: str) -> Tuple[Dict[str, Any], Optional[str]]:
+    """(config.json, директория модели) - локально, без сети"""
+    path = os.path.expanduser(model)
+    if os.path.isfile(path):
+        with open(path, encoding="utf-8") as f:
+            return json.load(f), os.path.dirname(os.path.abspath(path))
+
+    model_dir = find_model_dir(model)
+    config_path = os.path.join(model_dir, "config.json") if model_dir else None
+    if not config_path or not os.path.isfile(config_path):
+        raise FileNotFoundError(
+            f"config.json для {model} не найден локально "
+            f"(укажите путь или скачайте: huggingface-cli download {model} config.json)"
+        )
+    with open(config_path, encoding="utf-8") as f:
+        return json.load(f), model_dir
+
+
+def safetensors_bytes(model_dir: Optional[str]) -> Optional[int]:
+    """Суммарный размер *.safetensors (симлинки кэша HF разыменовываются)"""
+    if not model_dir:
+        return None
+    files = glob.glob(os.path.join(model_dir, "*.safetensors"))
+    if not files:
+        return None
+    return sum(os.path.getsize(path) for path in files)
+
+
+def _quantization(config: Dict[str, Any]) -> Tuple[Optional[str], int, int]:
+    """(метод, бит на вес, group_size) из quantization_config"""
+    quant = config.get("quantization_config") or {}
+    method = quant.get("quant_method")
+    if not method:
+        return None, 16, 128
+    method = str(method).lower()
+    if method == "fp8":
+        return method, 8, 128
+    bits = quant.get("bits") or quant.get("w_bit") or 4
+    group_size = quant.get("group_size") or quant.get("q_group_size") or 128
+    if group_size <= 0:  # -1: одна шкала на канал
+        group_size = 4096
+    return method, int(bits), int(group_size)
+
+
+def _vision_params(vision: Dict[str, Any]) -> int:
+    """Грубая оценка параметров vision encoder (ViT блоки)"""
+    if not vision:
+        return 0
+    depth = vision.get("depth") or vision.get("num_hidden_layers") or 0
+    hidden = vision.get("hidden_size") or vision.get("embed_dim") or 0
+    intermediate = vision.get("intermediate_size") or 4 * hidden
+    # attention (qkv + proj) + MLP, плюс merger в hidden языковой модели
+    per_layer = 4 * hidden * hidden + 2 * hidden * intermediate
+    out_hidden = vision.get("out_hidden_size") or hidden
+    return depth * per_layer + 4 * hidden * hidden + hidden * 4 * out_hidden
+
+
+def model_spec(config: Dict[str, Any], name: str = "model") -> ModelSpec:
+    """ModelSpec из config.json (в т.ч. VLM с вложенным text_config)"""
+    text = config.get("text_config") or config.get("llm_config") or config
+
+    def get(*keys, default=None):
+        for key in keys:
+            for source in (text, config):
+                if source.get(key) is not None:
+                    return source[key]
+        return default
+
+    hidden = get("hidden_size", "d_model", "n_embd")
+    num_heads = get("num_attention_heads", "n_head")
+    num_layers = get("num_hidden_layers", "n_layer", "num_layers")
+    if not (hidden and num_heads and num_layers):
+        raise ValueError("config.json: нет hidden_size/num_attention_heads/num_hidden_layers")
+
+    method, bits, group_size = _quantization(config)
+    dtype = str(get("torch_dtype", "dtype", default="bfloat16")).replace("torch.", "")
+
+    return ModelSpec(
+        name=name,
+        num_layers=num_layers,
+        hidden_size=hidden,
+        num_heads=num_heads,
+        num_kv_heads=get("num_key_value_heads", "num_kv_heads", default=num_heads),
+        head_dim=get("head_dim", default=hidden // num_heads),
+        intermediate_size=get("intermediate_size", "ffn_dim", default=4 * hidden),
+        vocab_size=get("vocab_size", default=32000),
+        max_position_embeddings=get("max_position_embeddings", "max_seq_len", default=8192),
+        dtype=dtype,
+        tie_embeddings=bool(get("tie_word_embeddings", default=False)),
+        quant_method=method,
+        weight_bits=bits,
+        group_size=group_size,
+        num_experts=get("num_experts", "num_local_experts", "n_routed_experts", default=0) or 0,
+        moe_intermediate_size=get("moe_intermediate_size", default=0) or 0,
+        kv_lora_rank=get("kv_lora_rank", default=0) or 0,
+        qk_rope_head_dim=get("qk_rope_head_dim", default=0) or 0,
+        vision_params=_vision_params(config.get("vision_config") or {}),
+    )
+
+
+# --- оценки памяти ---
+
+def parameter_counts(spec: ModelSpec) -> Tuple[int, int]:
+    """(параметры линейных слоев, параметры embedding/lm_head)"""
+    h = spec.hidden_size
+    q = spec.num_heads * spec.head_dim
+    kv = spec.num_kv_heads * spec.head_dim
+    attention = h * q + 2 * h * kv + q * h
+    if spec.num_experts:
+        mlp = spec.num_experts * 3 * h * spec.moe_intermediate_size + h * spec.num_experts
+    else:
+        mlp = 3 * h * spec.intermediate_size
+    linear = spec.num_layers * (attention + mlp) + spec.vision_params
+    embeddings = spec.vocab_size * h * (1 if spec.tie_embeddings else 2)
+    return linear, embeddings
+
+
+def estimate_weight_bytes(spec: ModelSpec) -> int:
+    """Память весов по архитектуре; квантизуются только линейные слои"""
+    linear, embeddings = parameter_counts(spec)
+    if spec.quant_method:
+        # + fp16 scale и упакованный zero point на группу
+        per_param = spec.weight_bits / 8 + (2 + spec.weight_bits / 8) / spec.group_size
+    else:
+        per_param = spec.dtype_bytes
+    return int(linear * per_param + embeddings * spec.dtype_bytes)
+
+
+def kv_bytes_per_token(spec: ModelSpec, kv_cache_dtype: str = "auto") -> int:
+    """KV cache на один токен контекста"""
+    element = 1 if kv_cache_dtype.startswith("fp8") else spec.dtype_bytes
+    if spec.kv_lora_rank:
+        return spec.num_layers * (spec.kv_lora_rank + spec.qk_rope_head_dim) * element
+    return 2 * spec.num_layers * spec.num_kv_heads * spec.head_dim * element
+
+
+def activation_bytes(spec: ModelSpec, max_num_batched_tokens: int, max_num_seqs: int) -> int:
+    """
+    Пик памяти вне весов и KV cache, который vLLM резервирует при профилировании:
+    промежуточные тензоры MLP на шаг, логиты на последовательность, CUDA graphs
+    """
+    intermediate = spec.moe_intermediate_size or spec.intermediate_size
+    step = max_num_batched_tokens * (2 * intermediate + 4 * spec.hidden_size) * spec.dtype_bytes
+    logits = max_num_seqs * spec.vocab_size * 4
+    total = FIXED_OVERHEAD_BYTES + step + logits
+    if spec.is_vlm:
+        total += VISION_PROFILE_BYTES
+    return total
+
+
+def context_candidates(spec: ModelSpec) -> List[int]:
+    limit = spec.max_position_embeddings
+    contexts = [c for c in CONTEXT_LENGTHS if c < limit]
+    return contexts + [limit]
+
+
+# --- план ---
+
+def plan(
+    spec: ModelSpec,
+    gpu_memory_gb: float,
+    gpu_memory_utilization: float = 0.90,
+    max_model_len: Optional[int] = None,
+    min_seqs: int = 4,
+    avg_seq_len: int = 1024,
+    max_num_batched_tokens: Optional[int] = None,
+    kv_cache_dtype: str = "auto",
+    tensor_parallel_size: int = 1,
+    weight_bytes: Optional[int] = None,
+) -> MemoryPlan:
+    """
+    Подобрать параметры запуска
+
+    Args:
+        spec: Архитектура модели
+        gpu_memory_gb: Память одной GPU, GiB
+        gpu_memory_utilization: Доля памяти GPU для vLLM
+        max_model_len: Нужный контекст (None - максимальный, при котором
+                       помещается min_seqs последовательностей полной длины)
+        min_seqs: Сколько последовательностей полной длины должно помещаться
+        avg_seq_len: Типичная длина prompt+ответ, для --max-num-seqs
+        max_num_batched_tokens: Токенов на шаг (None - 8192 для VLM, иначе 2048)
+        kv_cache_dtype: auto или fp8*
+        tensor_parallel_size: Веса и KV головы делятся между GPU
+        weight_bytes: Реальный размер весов (safetensors), иначе оценка по config
+
+    Raises:
+        PlanError: модель не помещается даже с CPU offload всех весов
+    """
+    if kv_cache_dtype not in KV_CACHE_DTYPES:
+        raise ValueError(f"kv_cache_dtype: {kv_cache_dtype} (доступны: {', '.join(KV_CACHE_DTYPES)})")
+    warnings = []
+    weight_source = "safetensors" if weight_bytes else "config"
+    if not weight_bytes:
+        weight_bytes = estimate_weight_bytes(spec)
+    weight_bytes //= tensor_parallel_size
+    kv_per_token = max(1, kv_bytes_per_token(spec, kv_cache_dtype) // tensor_parallel_size)
+
+    if max_num_batched_tokens is None:
+        max_num_batched_tokens = 8192 if spec.is_vlm else 2048
+    overhead = activation_bytes(spec, max_num_batched_tokens, MAX_NUM_SEQS)
+
+    budget = int(gpu_memory_gb * GIB * gpu_memory_utilization)
+    available = budget - weight_bytes - overhead
+    contexts = context_candidates(spec)
+
+    def seqs_at(context: int, kv_bytes: int) -> int:
+        return max(0, kv_bytes) // (kv_per_token * context)
+
+    if max_model_len is None:
+        fitting = [c for c in contexts if seqs_at(c, available) >= min_seqs]
+        if not fitting:
+            fitting = [c for c in contexts if seqs_at(c, available) >= 1]
+            if fitting:
+                warnings.append(
+                    f"меньше {min_seqs} последовательностей даже при контексте {contexts[0]} - "
+                    "высокая конкуренция за KV cache"
+                )
+        max_model_len = max(fitting) if fitting else min(OFFLOAD_CONTEXT, spec.max_position_embeddings)
+    elif max_model_len > spec.max_position_embeddings:
+        warnings.append(
+            f"max_model_len {max_model_len} > max_position_embeddings "
+            f"{spec.max_position_embeddings} (нужен rope scaling)"
+        )
+
+    # Не хватает даже на одну последовательность - часть весов в RAM
+    required_seqs = min_seqs if seqs_at(max_model_len, available) >= min_seqs else 1
+    cpu_offload_gb = 0
+    required_kv = kv_per_token * max_model_len * required_seqs
+    if available < required_kv:
+        cpu_offload_gb = math.ceil((required_kv - available) / GIB)
+        if cpu_offload_gb * GIB > weight_bytes:
+            raise PlanError(
+                f"Не помещается: веса {weight_bytes / GIB:.1f} GiB + активации "
+                f"{overhead / GIB:.1f} GiB при бюджете {budget / GIB:.1f} GiB не оставляют "
+                f"места даже под KV cache на {max_model_len} токенов"
+            )
+        available += cpu_offload_gb * GIB
+        warnings.append("нужен --cpu-offload-gb: генерация будет ограничена PCIe (в WSL2 может не работать)")
+
+    kv_tokens = available // kv_per_token
+    max_num_seqs = max(1, min(MAX_NUM_SEQS, kv_tokens // max(1, avg_seq_len)))
+    if max_num_seqs >= 8:
+        max_num_seqs -= max_num_seqs % 8  # размеры CUDA graphs кратны 8
+
+    return MemoryPlan(
+        model=spec.name,
+        gpu_memory_bytes=int(gpu_memory_gb * GIB),
+        gpu_memory_utilization=gpu_memory_utilization,
+        weight_bytes=weight_bytes,
+        weight_source=weight_source,
+        overhead_bytes=overhead,
+        kv_bytes_per_token=kv_per_token,
+        kv_cache_bytes=available,
+        max_model_len=max_model_len,
+        max_num_seqs=max_num_seqs,
+        max_num_batched_tokens=max_num_batched_tokens,
+        cpu_offload_gb=cpu_offload_gb,
+        quantization=spec.quant_method if spec.quant_method in ("awq", "gptq") else None,
+        kv_cache_dtype=kv_cache_dtype,
+        tensor_parallel_size=tensor_parallel_size,
+        capacity=[(c, seqs_at(c, available)) for c in contexts],
+        warnings=warnings,
+    )
+
+
+def plan_model(model: str, gpu_memory_gb: float, **kwargs) -> MemoryPlan:
+    """plan() по HF id или пути: config.json и размер safetensors с диска"""
+    config, model_dir = load_config(model)
+    spec = model_spec(config, name=model)
+    kwargs.setdefault("weight_bytes", safetensors_bytes(model_dir))
+    return plan(spec, gpu_memory_gb, **kwargs)
+
+
+def detect_gpu_memory_gb() -> Optional[float]:
+    """Память первой GPU по nvidia-smi, GiB (None если GPU нет)"""
+    if not shutil.which("nvidia-smi"):
+        return None
+    try:
+        output = subprocess.run(
+            ["nvidia-smi", "--query-gpu=memory.total", "--format=csv,noheader,nounits"],
+            capture_output=True, text=True, timeout=10, check=True,
+        ).stdout
+        return int(output.splitlines()[0]) / 1024
+    except (subprocess.SubprocessError, ValueError, IndexError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Расчет --max-model-len, --max-num-seqs и др. по config.json модели и памяти GPU"
+    )
+
+    parser.add_argument(
+        "model",
+        help="HF id (из локального кэша), директория модели или путь к config.json"
+    )
+
+    parser.add_argument(
+        "--gpu-memory",
+        type=float,
+        help="Память GPU, GiB (по умолчанию: nvidia-smi)"
+    )
+
+    parser.add_argument(
+        "--gpu-memory-utilization",
+        type=float,
+        default=0.90,
+        help="Доля памяти GPU для vLLM (по умолчанию: 0.90)"
+    )
+
+    parser.add_argument(
+        "--max-model-len",
+        type=int,
+        help="Нужный контекст (по умолчанию: максимальный, при котором помещается --min-seqs)"
+    )
+
+    parser.add_argument(
+        "--min-seqs",
+        type=int,
+        default=4,
+        help="Последовательностей полной длины, которые должны помещаться в KV cache (по умолчанию: 4)"
+    )
+
+    parser.add_argument(
+        "--avg-seq-len",
+        type=int,
+        default=1024,
+        help="Типичная длина prompt+ответ для --max-num-seqs (по умолчанию: 1024)"
+    )
+
+    parser.add_argument(
+        "--max-num-batched-tokens",
+        type=int,
+        help="Токенов на шаг (по умолчанию: 8192 для VLM, иначе 2048)"
+    )
+
+    parser.add_argument(
+        "--kv-cache-dtype",
+        choices=KV_CACHE_DTYPES,
+        default="auto",
+        help="Тип KV cache (fp8 вдвое увеличивает емкость)"
+    )
+
+    parser.add_argument(
+        "--tensor-parallel-size",
+        type=int,
+        default=1,
+        help="Количество GPU"
+    )
+
+    parser.add_argument(
+        "--format",
+        choices=("text", "args", "json"),
+        default="text",
+        help="Вывод: отчет, только аргументы запуска или JSON"
+    )
+
+    args = parser.parse_args()
+
+    gpu_memory = args.gpu_memory or detect_gpu_memory_gb()
+    if gpu_memory is None:
+        parser.error("GPU не найдена - укажите --gpu-memory")
+
+    try:
+        result = plan_model(
+            args.model,
+            gpu_memory,
+            gpu_memory_utilization=args.gpu_memory_utilization,
+            max_model_len=args.max_model_len,
+            min_seqs=args.min_seqs,
+            avg_seq_len=args.avg_seq_len,
+            max_num_batched_tokens=args.max_num_batched_tokens,
+            kv_cache_dtype=args.kv_cache_dtype,
+            tensor_parallel_size=args.tensor_parallel_size,
+        )
+    except (FileNotFoundError, ValueError) as e:
+        print(f"❌ {e}", file=sys.stderr)
+        sys.exit(1)
+
+    if args.format == "args":
+        print(" ".join(result.launcher_args()))
+    elif args.format == "json":
+        data = asdict(result)
+        data["launcher_args"] = result.launcher_args()
+        print(json.dumps(data, ensure_ascii=False, indent=2))
+    else:
+        print(result.format_report())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Hedging запросов против хвостовой latency
+
+Если за hedge delay (перцентиль недавних TTFT) первый токен не пришел,
+тот же запрос отправляется на следующий endpoint. Побеждает попытка,
+первой начавшая отдавать токены; остальные отменяются, их соединения
+закрываются, и vLLM прерывает их генерацию (abort по отключению клиента).
+"""
+
+import asyncio
+from collections import deque
+from typing import Awaitable, Callable, Deque, Optional, Tuple, TypeVar
+
+from streaming import percentile
+
+T = TypeVar("T")
+
+# Hedge delay, пока не набралось статистики TTFT
+DEFAULT_HEDGE_DELAY = 2.0
+
+
+class HedgeLost(Exception):
+    """Попытка проиграла гонку - прервать ее поток"""
+
+
+class LatencyTracker:
+    """Скользящее окно последних измерений (например, TTFT)"""
+
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        self.values: Deque[float] = deque(maxlen=window)
+        self.min_samples = min_samples
+
+    def record(self, value: float) -> None:
+        self.values.append(value)
+
+    def percentile(self, p: float) -> Optional[float]:
+        """p-й перцентиль или None, пока измерений меньше min_samples"""
+        if len(self.values) < self.min_samples:
+            return None
+        return percentile(list(self.values), p)
+
+
+async def hedged_race(
+    attempt: Callable[[int, Callable[[], bool]], Awaitable[T]],
+    count: int,
+    delay: float,
+) -> Tuple[T, int]:
+    """
+    Запустить attempt(0, claim) и при необходимости attempt(1..count-1, claim)
+
+    Попытка вызывает claim() на первом токене: True - она победила (остальные
+    попытки сразу отменяются), False - победила другая, попытка должна
+    прерваться (например, raise HedgeLost). Следующая попытка стартует через
+    delay секунд без победителя или сразу после ошибки предыдущей.
+
+    Returns:
+        (результат победившей попытки, ее номер)
+    """
+    winner: Optional[int] = None
+    tasks = {}
+    launched = 0
+    last_error: Optional[BaseException] = None
+
+    def cancel_others(keep: int) -> None:
+        for task, index in tasks.items():
+            if index != keep:
+                task.cancel()
+
+    def make_claim(index: int) -> Callable[[], bool]:
+        def claim() -> bool:
+            nonlocal winner
+            if winner is None:
+                winner = index
+                cancel_others(index)
+            return winner == index
+        return claim
+
+    def launch() -> None:
+        nonlocal launched
+        task = asyncio.ensure_future(attempt(launched, make_claim(launched)))
+        tasks[task] = launched
+        launched += 1
+
+    launch()
+    try:
+        while tasks:
+            timeout = delay if winner is None and launched < count else None
+            done, _ = await asyncio.wait(
+                list(tasks), timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+            )
+            if not done:
+                launch()
+                continue
+
+            for task in done:
+                index = tasks.pop(task)
+                if task.cancelled():
+                    continue
+                error = task.exception()
+                if error is None:
+                    # Завершилась, не отдав ни одного токена (пустой ответ) - тоже победа
+                    if winner in (None, index):
+                        winner = index
+                        cancel_others(index)
+                        return task.result(), index
+                    continue
+                if isinstance(error, HedgeLost):
+                    continue
+                last_error = error
+                if winner == index:
+                    raise error
+                if winner is None and launched < count:
+                    launch()
+
+        raise last_error or RuntimeError("все попытки отменены")
+    finally:
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+"""
+Кэш закодированных изображений: in-memory LRU + дисковый уровень с лимитом размера
+
+Ключ - SHA-256 содержимого файла плюс параметры подготовки, поэтому
+переименованный или скопированный файл попадает в тот же кэш, а
+измененный файл или другие параметры - нет.
+"""
+
+import argparse
+import base64
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Callable, Dict, Optional, Tuple, Union
+
+from client_tracing import span
+from image_preprocess import PreprocessOptions, PreprocessResult, guess_mime_type, preprocess_image
+
+DEFAULT_CACHE_DIR = Path.home() / ".cache" / "vllm-setup" / "images"
+
+
+@dataclass
+class CacheStats:
+    """Счетчики попаданий и промахов"""
+    memory_hits: int = 0
+    disk_hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    disk_bytes: int = 0
+
+    @property
+    def requests(self) -> int:
+        return self.memory_hits + self.disk_hits + self.misses
+
+    @property
+    def hit_rate(self) -> float:
+        if not self.requests:
+            return 0.0
+        return (self.memory_hits + self.disk_hits) / self.requests
+
+    def format_report(self) -> str:
+        return (
+            f"🗄️  Кэш изображений: {self.hit_rate * 100:.0f}% попаданий "
+            f"(память: {self.memory_hits}, диск: {self.disk_hits}, промахов: {self.misses}), "
+            f"на диске {self.disk_bytes / 1024**2:.1f} MB, вытеснено {self.evictions}"
+        )
+
+
+class ImageCache:
+    """
+    Двухуровневый кэш результатов encode_image()
+
+    - память: LRU по числу записей и суммарному размеру base64
+    - диск: подготовленные байты + метаданные, вытеснение самых старых
+      по времени последнего доступа при превышении disk_max_bytes
+
+    Без подготовки (options=None) используется только память: хранить на
+    диске копии исходных файлов бессмысленно.
+    """
+
+    def __init__(
+        self,
+        cache_dir: Optional[Path] = DEFAULT_CACHE_DIR,
+        memory_items: int = 256,
+        memory_max_bytes: int = 256 * 1024**2,
+        disk_max_bytes: int = 2 * 1024**3,
+    ):
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        self.memory_items = memory_items
+        self.memory_max_bytes = memory_max_bytes
+        self.disk_max_bytes = disk_max_bytes
+        self.stats = CacheStats()
+
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, Tuple[str, str, Optional[PreprocessResult]]]" = OrderedDict()
+        self._memory_bytes = 0
+        # path -> (size, mtime_ns, sha256): не перечитывать неизмененные файлы
+        self._digests: Dict[str, Tuple[int, int, str]] = {}
+
+        if self.cache_dir:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            self.stats.disk_bytes = sum(
+                p.stat().st_size for p in self.cache_dir.glob("*/*") if p.is_file()
+            )
+
+    def content_hash(self, image_path: str) -> str:
+        """SHA-256 содержимого файла (с мемоизацией по size + mtime)"""
+        st = os.stat(image_path)
+        key = os.path.abspath(image_path)
+        cached = self._digests.get(key)
+        if cached and cached[:2] == (st.st_size, st.st_mtime_ns):
+            return cached[2]
+
+        h = hashlib.sha256()
+        with open(image_path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                h.update(block)
+        digest = h.hexdigest()
+        self._digests[key] = (st.st_size, st.st_mtime_ns, digest)
+        return digest
+
+    def cache_key(self, image_path: str, options: Optional[PreprocessOptions]) -> str:
+        params = options.cache_key() if options else "raw"
+        return hashlib.sha256(
+            f"{self.content_hash(image_path)}:{params}".encode()
+        ).hexdigest()
+
+    # --- память ---
+
+    def _memory_get(self, key: str):
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+            return entry
+
+    def _memory_put(self, key: str, entry) -> None:
+        if self.memory_items <= 0:
+            return
+        size = len(entry[0]) + (len(entry[2].data) if entry[2] else 0)
+        with self._lock:
+            if key in self._memory:
+                return
+            self._memory[key] = entry
+            self._memory_bytes += size
+            while self._memory and (
+                len(self._memory) > self.memory_items
+                or self._memory_bytes > self.memory_max_bytes
+            ):
+                _, (b64, _, result) = self._memory.popitem(last=False)
+                self._memory_bytes -= len(b64) + (len(result.data) if result else 0)
+
+    # --- диск ---
+
+    def _disk_paths(self, key: str) -> Tuple[Path, Path]:
+        shard = self.cache_dir / key[:2]
+        return shard / f"{key}.bin", shard / f"{key}.json"
+
+    def _disk_get(self, key: str) -> Optional[PreprocessResult]:
+        data_path, meta_path = self._disk_paths(key)
+        try:
+            meta = json.loads(meta_path.read_text())
+            data = data_path.read_bytes()
+        except (OSError, ValueError):
+            return None
+        # Время доступа для LRU вытеснения (atime часто отключен через noatime)
+        os.utime(meta_path)
+        meta["original_size"] = tuple(meta["original_size"])
+        meta["size"] = tuple(meta["size"])
+        return PreprocessResult(data=data, **meta)
+
+    def _disk_put(self, key: str, result: PreprocessResult) -> None:
+        data_path, meta_path = self._disk_paths(key)
+        data_path.parent.mkdir(exist_ok=True)
+        meta = asdict(result)
+        del meta["data"]
+
+        # Атомарная запись: другие процессы не увидят половину файла. Временное
+        # имя свое у каждого потока: asyncio.to_thread кодирует одно изображение
+        # параллельно, и общий tmp исчезал бы из-под os.replace соседа
+        for path, payload in ((data_path, result.data), (meta_path, json.dumps(meta).encode())):
+            tmp = path.with_suffix(path.suffix + f".tmp{os.getpid()}-{threading.get_ident()}")
+            tmp.write_bytes(payload)
+            os.replace(tmp, path)
+
+        with self._lock:
+            self.stats.disk_bytes += len(result.data) + meta_path.stat().st_size
+        if self.stats.disk_bytes > self.disk_max_bytes:
+            self.evict()
+
+    def evict(self, target_bytes: Optional[int] = None) -> int:
+        """Удалить самые давно использованные записи до target_bytes (по умолчанию 90% лимита)"""
+        if not self.cache_dir:
+            return 0
+        target = self.disk_max_bytes * 0.9 if target_bytes is None else target_bytes
+        entries = []
+        total = 0
+        for meta_path in self.cache_dir.glob("*/*.json"):
+            data_path = meta_path.with_suffix(".bin")
+            try:
+                size = meta_path.stat().st_size + data_path.stat().st_size
+                entries.append((meta_path.stat().st_mtime, meta_path, data_path, size))
+            except OSError:
+                continue
+            total += size
+
+        removed = 0
+        for _, meta_path, data_path, size in sorted(entries, key=lambda e: e[0]):
+            if total <= target:
+                break
+            for path in (meta_path, data_path):
+                path.unlink(missing_ok=True)
+            total -= size
+            removed += 1
+
+        with self._lock:
+            self.stats.disk_bytes = total
+            self.stats.evictions += removed
+        return removed
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+        self.evict(target_bytes=0)
+
+    # --- основной API ---
+
+    def encode(
+        self,
+        image_path: str,
+        options: Optional[PreprocessOptions] = None,
+        report: Optional[Callable[[str, PreprocessResult], None]] = None,
+    ) -> tuple[str, str]:
+        """Кэширующий аналог image_preprocess.encode_image()"""
+        with span("hash"):
+            key = self.cache_key(image_path, options)
+
+        entry = self._memory_get(key)
+        if entry is not None:
+            self.stats.memory_hits += 1
+            b64, mime_type, result = entry
+            if report and result:
+                report(image_path, result)
+            return b64, mime_type
+
+        result = None
+        if options is not None and self.cache_dir:
+            result = self._disk_get(key)
+            if result is not None:
+                self.stats.disk_hits += 1
+
+        if result is None:
+            self.stats.misses += 1
+            if options is None:
+                with span("read"):
+                    with open(image_path, "rb") as f:
+                        data = f.read()
+                with span("encode"):
+                    b64 = base64.b64encode(data).decode("utf-8")
+                self._memory_put(key, (b64, guess_mime_type(image_path), None))
+                return b64, guess_mime_type(image_path)
+            with span("preprocess"):
+                result = preprocess_image(image_path, options)
+            if self.cache_dir:
+                self._disk_put(key, result)
+
+        if report:
+            report(image_path, result)
+        with span("encode"):
+            b64 = result.to_base64()
+        self._memory_put(key, (b64, result.mime_type, result))
+        return b64, result.mime_type
+
+
+_default_cache: Optional[ImageCache] = None
+
+
+def default_image_cache() -> ImageCache:
+    """Общий на процесс кэш в ~/.cache/vllm-setup/images"""
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = ImageCache()
+    return _default_cache
+
+
+def add_cache_arguments(parser) -> None:
+    """Общие флаги кэша изображений для CLI"""
+    parser.add_argument(
+        "--no-image-cache",
+        action="store_true",
+        help="Не использовать кэш закодированных изображений"
+    )
+
+    parser.add_argument(
+        "--image-cache-dir",
+        default=str(DEFAULT_CACHE_DIR),
+        help=f"Директория дискового кэша (по умолчанию: {DEFAULT_CACHE_DIR})"
+    )
+
+
+def cache_from_args(args) -> Optional[ImageCache]:
+    """ImageCache из флагов add_cache_arguments() (None если выключен)"""
+    if args.no_image_cache:
+        return None
+    return ImageCache(cache_dir=Path(args.image_cache_dir))
+
+
+def resolve_image_cache(image_cache: Union[ImageCache, bool, None]) -> Optional[ImageCache]:
+    """True - общий кэш процесса, False/None - без кэша, иначе переданный экземпляр"""
+    if image_cache is True:
+        return default_image_cache()
+    return image_cache or None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Управление кэшем изображений")
+
+    parser.add_argument(
+        "--cache-dir",
+        default=str(DEFAULT_CACHE_DIR),
+        help=f"Директория кэша (по умолчанию: {DEFAULT_CACHE_DIR})"
+    )
+
+    parser.add_argument(
+        "--clear",
+        action="store_true",
+        help="Удалить все записи"
+    )
+
+    args = parser.parse_args()
+
+    cache = ImageCache(cache_dir=Path(args.cache_dir))
+    if args.clear:
+        cache.clear()
+        print(f"🗑️  Кэш очищен: {args.cache_dir}")
+    else:
+        entries = len(list(cache.cache_dir.glob("*/*.json")))
+        print(f"🗄️  {args.cache_dir}: {entries} записей, {cache.stats.disk_bytes / 1024**2:.1f} MB")
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
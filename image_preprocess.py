@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+"""
+Подготовка изображений перед отправкой в VLM: уменьшение до бюджета пикселей
+по сетке патчей Qwen-VL, перекодирование в WebP/JPEG и удаление EXIF
+"""
+
+import base64
+import io
+import math
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Optional
+
+from PIL import Image, ImageOps
+
+from client_tracing import span
+
+MIME_TYPES = {
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.png': 'image/png',
+    '.gif': 'image/gif',
+    '.webp': 'image/webp',
+    '.bmp': 'image/bmp',
+}
+
+# Qwen3-VL: патч 16x16, merge 2x2 -> один vision токен на 32x32 пикселя
+# (для Qwen2-VL / Qwen2.5-VL: патч 14, factor 28)
+PATCH_SIZE = 16
+MERGE_SIZE = 2
+FACTOR = PATCH_SIZE * MERGE_SIZE
+
+# Границы по умолчанию у image processor на стороне сервера
+SERVER_MIN_PIXELS = 65536
+SERVER_MAX_PIXELS = 16777216
+
+MAX_RATIO = 200
+
+FORMATS = {
+    "webp": ("WEBP", "image/webp"),
+    "jpeg": ("JPEG", "image/jpeg"),
+}
+
+
+def guess_mime_type(image_path: str) -> str:
+    """MIME type по расширению файла"""
+    return MIME_TYPES.get(Path(image_path).suffix.lower(), 'image/jpeg')
+
+
+def smart_resize(
+    height: int,
+    width: int,
+    factor: int = FACTOR,
+    min_pixels: int = SERVER_MIN_PIXELS,
+    max_pixels: int = SERVER_MAX_PIXELS,
+) -> tuple[int, int]:
+    """
+    Размер, к которому Qwen-VL processor приводит изображение
+
+    Обе стороны кратны factor, площадь в [min_pixels, max_pixels],
+    пропорции сохраняются максимально близко к исходным.
+    """
+    if max(height, width) / min(height, width) > MAX_RATIO:
+        raise ValueError(
+            f"Соотношение сторон должно быть меньше {MAX_RATIO}, "
+            f"получено {max(height, width) / min(height, width):.1f}"
+        )
+    h_bar = max(factor, round(height / factor) * factor)
+    w_bar = max(factor, round(width / factor) * factor)
+    if h_bar * w_bar > max_pixels:
+        beta = math.sqrt((height * width) / max_pixels)
+        h_bar = max(factor, math.floor(height / beta / factor) * factor)
+        w_bar = max(factor, math.floor(width / beta / factor) * factor)
+    elif h_bar * w_bar < min_pixels:
+        beta = math.sqrt(min_pixels / (height * width))
+        h_bar = math.ceil(height * beta / factor) * factor
+        w_bar = math.ceil(width * beta / factor) * factor
+    return h_bar, w_bar
+
+
+def estimate_vision_tokens(height: int, width: int, factor: int = FACTOR) -> int:
+    """Число vision токенов для изображения, уже выровненного по сетке"""
+    return (height // factor) * (width // factor)
+
+
+def server_vision_tokens(height: int, width: int, factor: int = FACTOR) -> int:
+    """Сколько vision токенов сервер получит из изображения исходного размера"""
+    return estimate_vision_tokens(*smart_resize(height, width, factor), factor)
+
+
+def target_size(height: int, width: int, options: "PreprocessOptions") -> tuple[int, int]:
+    """
+    Размер, до которого клиенту стоит уменьшить изображение
+
+    Только уменьшение сверх max_pixels: в пределах бюджета сервер сам
+    выровняет стороны по сетке (с тем же числом токенов), а увеличение до
+    min_pixels тоже сделает сам - без лишних байт и перекодирования.
+    """
+    if height * width <= options.max_pixels:
+        return height, width
+    return smart_resize(height, width, options.factor, options.min_pixels, options.max_pixels)
+
+
+@dataclass(frozen=True)
+class PreprocessOptions:
+    """Параметры подготовки изображения"""
+    max_pixels: int = 1024 * FACTOR * FACTOR
+    # Меньше сервер все равно не отдаст в модель: он сам увеличит до SERVER_MIN_PIXELS
+    min_pixels: int = SERVER_MIN_PIXELS
+    factor: int = FACTOR
+    format: Optional[str] = None  # None - сохранить исходный, "webp" или "jpeg"
+    quality: int = 85
+    strip_exif: bool = True
+
+    def cache_key(self) -> str:
+        """Строка, однозначно описывающая параметры (для кэшей)"""
+        return (
+            f"px{self.min_pixels}-{self.max_pixels}-f{self.factor}-"
+            f"{self.format or 'keep'}-q{self.quality}-exif{int(not self.strip_exif)}"
+        )
+
+
+@dataclass
+class PreprocessResult:
+    """Подготовленное изображение и статистика экономии"""
+    data: bytes
+    mime_type: str
+    original_size: tuple[int, int]  # (width, height)
+    size: tuple[int, int]
+    original_bytes: int
+    original_tokens: int
+    tokens: int
+
+    @property
+    def bytes_saved(self) -> int:
+        return self.original_bytes - len(self.data)
+
+    @property
+    def tokens_saved(self) -> int:
+        return self.original_tokens - self.tokens
+
+    def to_base64(self) -> str:
+        return base64.b64encode(self.data).decode("utf-8")
+
+    def report(self) -> str:
+        """Одна строка отчета для CLI"""
+        (ow, oh), (w, h) = self.original_size, self.size
+        return (
+            f"{ow}x{oh} -> {w}x{h}, "
+            f"{self.original_bytes / 1024:.0f} KB -> {len(self.data) / 1024:.0f} KB "
+            f"(-{self.bytes_saved / 1024:.0f} KB), "
+            f"~{self.original_tokens} -> ~{self.tokens} vision токенов "
+            f"(-{self.tokens_saved})"
+        )
+
+
+def preprocess_image(image_path: str, options: PreprocessOptions) -> PreprocessResult:
+    """
+    Уменьшить изображение до бюджета пикселей и перекодировать
+
+    Если изображение уже укладывается в бюджет, формат не меняется и
+    EXIF удалять не нужно, исходные байты возвращаются без изменений.
+    """
+    with open(image_path, "rb") as f:
+        raw = f.read()
+
+    image = Image.open(io.BytesIO(raw))
+    source_format = image.format
+    exif = image.info.get("exif")
+    # Поворот по EXIF Orientation до удаления метаданных
+    if options.strip_exif:
+        image = ImageOps.exif_transpose(image)
+    width, height = image.size
+
+    # Для сравнения: сколько токенов дал бы исходник на стороне сервера
+    original_tokens = server_vision_tokens(height, width, options.factor)
+    target_h, target_w = target_size(height, width, options)
+    # Сервер применяет к присланному изображению свой smart_resize
+    tokens = server_vision_tokens(target_h, target_w, options.factor)
+
+    needs_resize = (target_w, target_h) != (width, height)
+    needs_reencode = options.format is not None
+    if not (needs_resize or needs_reencode or (options.strip_exif and exif)):
+        return PreprocessResult(
+            data=raw,
+            mime_type=guess_mime_type(image_path),
+            original_size=(width, height),
+            size=(width, height),
+            original_bytes=len(raw),
+            original_tokens=original_tokens,
+            tokens=server_vision_tokens(height, width, options.factor),
+        )
+
+    if image.mode == "P":
+        image = image.convert("RGBA")
+    if needs_resize:
+        image = image.resize((target_w, target_h), Image.Resampling.LANCZOS)
+
+    if options.format:
+        pil_format, mime_type = FORMATS[options.format]
+    elif source_format in ("JPEG", "PNG", "WEBP"):
+        pil_format, mime_type = source_format, Image.MIME[source_format]
+    else:
+        # GIF/BMP после ресайза отправляем как PNG без потерь
+        pil_format, mime_type = "PNG", "image/png"
+
+    if pil_format == "JPEG" and image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+
+    save_kwargs = {}
+    if pil_format in ("JPEG", "WEBP"):
+        save_kwargs["quality"] = options.quality
+    if not options.strip_exif and exif:
+        save_kwargs["exif"] = exif
+
+    out = io.BytesIO()
+    image.save(out, format=pil_format, **save_kwargs)
+    w, h = image.size
+
+    return PreprocessResult(
+        data=out.getvalue(),
+        mime_type=mime_type,
+        original_size=(width, height),
+        size=(w, h),
+        original_bytes=len(raw),
+        original_tokens=original_tokens,
+        tokens=tokens,
+    )
+
+
+def encode_image(
+    image_path: str,
+    options: Optional[PreprocessOptions] = None,
+    report: Optional[Callable[[str, PreprocessResult], None]] = None,
+) -> tuple[str, str]:
+    """
+    Кодировать изображение в base64 и определить MIME type
+
+    Args:
+        image_path: Путь к изображению
+        options: Параметры подготовки (None - отправить файл как есть)
+        report: Callback (путь, результат) для статистики экономии
+    """
+    if options is None:
+        with span("read"):
+            with open(image_path, "rb") as f:
+                data = f.read()
+        with span("encode"):
+            base64_data = base64.b64encode(data).decode("utf-8")
+        return base64_data, guess_mime_type(image_path)
+
+    with span("preprocess"):
+        result = preprocess_image(image_path, options)
+    if report:
+        report(image_path, result)
+    with span("encode"):
+        return result.to_base64(), result.mime_type
+
+
+def add_preprocess_arguments(parser) -> None:
+    """Общие флаги подготовки изображений для CLI"""
+    parser.add_argument(
+        "--preprocess",
+        action="store_true",
+        help="Уменьшать и перекодировать изображения перед отправкой"
+    )
+
+    parser.add_argument(
+        "--max-pixels",
+        type=int,
+        default=PreprocessOptions.max_pixels,
+        help=f"Бюджет пикселей на изображение (по умолчанию: {PreprocessOptions.max_pixels}, "
+             f"~{PreprocessOptions.max_pixels // (FACTOR * FACTOR)} vision токенов)"
+    )
+
+    parser.add_argument(
+        "--image-format",
+        choices=sorted(FORMATS),
+        default=None,
+        help="Перекодировать в WebP/JPEG (по умолчанию: исходный формат)"
+    )
+
+    parser.add_argument(
+        "--image-quality",
+        type=int,
+        default=PreprocessOptions.quality,
+        help=f"Качество WebP/JPEG (по умолчанию: {PreprocessOptions.quality})"
+    )
+
+    parser.add_argument(
+        "--keep-exif",
+        action="store_true",
+        help="Не удалять EXIF метаданные"
+    )
+
+
+def options_from_args(args) -> Optional[PreprocessOptions]:
+    """PreprocessOptions из флагов add_preprocess_arguments() (None если выключено)"""
+    if not args.preprocess:
+        return None
+    return PreprocessOptions(
+        max_pixels=args.max_pixels,
+        format=args.image_format,
+        quality=args.image_quality,
+        strip_exif=not args.keep_exif,
+    )
+
+
+def print_report(image_path: str, result: PreprocessResult) -> None:
+    """Callback для encode_image(): печать экономии по изображению"""
+    print(f"   🗜️  {Path(image_path).name}: {result.report()}")
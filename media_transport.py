@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+Способ передачи локальных изображений в vLLM
+
+- data: base64 data URI прямо в JSON (по умолчанию, работает везде)
+- file: file:// URL, сервер читает файл сам (нужен --allowed-local-media-path)
+- http: локальный статический HTTP сервер, в запросе только http:// URL
+- auto: file если сервер на этой же машине и запущен vllm_server.py с
+  --allowed-local-media-path, покрывающим spool директорию (по умолчанию
+  так и есть для VLM), иначе http
+"""
+
+import os
+import socket
+import threading
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Callable, Dict, Optional
+from urllib.parse import urlparse
+
+from client_tracing import span
+from image_cache import ImageCache
+from image_preprocess import PreprocessOptions, PreprocessResult, encode_image, preprocess_image
+from server_info import MEDIA_SPOOL_DIR, is_colocated, read_launch_info
+
+TRANSPORT_MODES = ("data", "file", "http", "auto")
+
+DEFAULT_SPOOL_DIR = MEDIA_SPOOL_DIR
+
+EXTENSIONS = {
+    "image/jpeg": ".jpg",
+    "image/png": ".png",
+    "image/gif": ".gif",
+    "image/webp": ".webp",
+    "image/bmp": ".bmp",
+}
+
+
+def allowed_media_dir(api_url: str) -> Optional[Path]:
+    """--allowed-local-media-path сервера по описанию запуска vllm_server.py"""
+    info = read_launch_info(api_url)
+    allowed = (info or {}).get("allowed_local_media_path")
+    return Path(allowed).resolve() if allowed else None
+
+
+def resolve_mode(mode: str, api_url: str, spool_dir: Path = DEFAULT_SPOOL_DIR) -> str:
+    """
+    Выбрать конкретный режим для auto: file только если сервер может читать
+    spool директорию, иначе каждый запрос получил бы 400
+    """
+    if mode != "auto":
+        return mode
+    allowed = allowed_media_dir(api_url)
+    if allowed is not None and Path(spool_dir).resolve().is_relative_to(allowed):
+        return "file"
+    return "http"
+
+
+def outbound_address(api_url: str) -> str:
+    """Локальный IP, через который сервер может достучаться до клиента"""
+    parsed = urlparse(api_url)
+    host = parsed.hostname or "localhost"
+    if is_colocated(api_url):
+        return "127.0.0.1"
+    # UDP connect не отправляет пакетов, но выбирает исходящий интерфейс
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        s.connect((host, parsed.port or 80))
+        return s.getsockname()[0]
+
+
+class _MediaHandler(SimpleHTTPRequestHandler):
+    """Отдает только зарегистрированные файлы, без листинга директорий"""
+
+    def __init__(self, *args, files: Dict[str, Path], **kwargs):
+        self.files = files
+        super().__init__(*args, **kwargs)
+
+    def translate_path(self, path: str) -> str:
+        name = urlparse(path).path.rsplit("/", 1)[-1]
+        target = self.files.get(name)
+        # Несуществующий путь -> 404 от базового класса
+        return str(target) if target else "/nonexistent"
+
+    def list_directory(self, path):
+        self.send_error(404)
+        return None
+
+    def log_message(self, format, *args):
+        pass
+
+
+class LocalMediaServer:
+    """Минимальный статический сервер для изображений в режиме http"""
+
+    def __init__(self, host: str = "0.0.0.0", port: int = 0):
+        self.files: Dict[str, Path] = {}
+        self.httpd = ThreadingHTTPServer(
+            (host, port), partial(_MediaHandler, files=self.files)
+        )
+        self.port = self.httpd.server_address[1]
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+
+    def register(self, name: str, path: Path) -> None:
+        self.files[name] = path
+
+    def close(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class MediaTransport:
+    """
+    Превращает путь к изображению в значение image_url.url
+
+    В режимах file/http подготовленные (preprocess) изображения сначала
+    записываются в spool директорию под именем по хэшу содержимого, и
+    сервер получает ссылку на этот файл.
+    """
+
+    def __init__(
+        self,
+        mode: str = "data",
+        api_url: str = "http://localhost:8000",
+        image_cache: Optional[ImageCache] = None,
+        spool_dir: Path = DEFAULT_SPOOL_DIR,
+        http_port: int = 0,
+    ):
+        if mode not in TRANSPORT_MODES:
+            raise ValueError(f"Неизвестный режим передачи: {mode} (доступны: {', '.join(TRANSPORT_MODES)})")
+        self.mode = resolve_mode(mode, api_url, spool_dir)
+        self.api_url = api_url
+        self.image_cache = image_cache
+        # Без кэша хэш содержимого все равно нужен для имен в spool и http
+        self._hasher = image_cache or ImageCache(cache_dir=None, memory_items=0)
+        self.spool_dir = Path(spool_dir)
+        # auto выбрал file по разрешенной директории: файлы вне ее идут через spool
+        self.spool_all = mode == "auto" and self.mode == "file"
+        self.http_port = http_port
+        self._server: Optional[LocalMediaServer] = None
+        self._public_host: Optional[str] = None
+
+    def _spool(
+        self,
+        image_path: str,
+        options: Optional[PreprocessOptions],
+        report: Optional[Callable[[str, PreprocessResult], None]],
+    ) -> Path:
+        key = self._hasher.cache_key(image_path, options)
+        existing = list(self.spool_dir.glob(f"{key}.*"))
+        if existing:
+            return existing[0]
+
+        if options is None:
+            data = Path(image_path).read_bytes()
+            suffix = Path(image_path).suffix.lower() or ".img"
+        else:
+            result = preprocess_image(image_path, options)
+            if report:
+                report(image_path, result)
+            data = result.data
+            suffix = EXTENSIONS.get(result.mime_type, ".img")
+        self.spool_dir.mkdir(parents=True, exist_ok=True)
+        target = self.spool_dir / f"{key}{suffix}"
+        # Свое временное имя у каждого потока: одно изображение может
+        # спулиться параллельно (asyncio.to_thread в асинхронном клиенте)
+        tmp = target.with_suffix(target.suffix + f".tmp{os.getpid()}-{threading.get_ident()}")
+        tmp.write_bytes(data)
+        tmp.replace(target)
+        return target
+
+    def _local_file(
+        self,
+        image_path: str,
+        options: Optional[PreprocessOptions],
+        report: Optional[Callable[[str, PreprocessResult], None]],
+    ) -> Path:
+        if options is None and not self.spool_all:
+            return Path(image_path).resolve()
+        return self._spool(image_path, options, report).resolve()
+
+    def _http_url(self, path: Path, image_path: str, options: Optional[PreprocessOptions]) -> str:
+        if self._server is None:
+            self._server = LocalMediaServer(port=self.http_port)
+            self._public_host = outbound_address(self.api_url)
+        name = f"{self._hasher.cache_key(image_path, options)}{path.suffix}"
+        self._server.register(name, path)
+        return f"http://{self._public_host}:{self._server.port}/media/{name}"
+
+    def image_url(
+        self,
+        image_path: str,
+        options: Optional[PreprocessOptions] = None,
+        report: Optional[Callable[[str, PreprocessResult], None]] = None,
+    ) -> str:
+        """URL изображения для content part {"type": "image_url"}"""
+        with span("image", transport=self.mode):
+            if self.mode == "data":
+                if self.image_cache is not None:
+                    base64_image, mime_type = self.image_cache.encode(image_path, options, report)
+                else:
+                    base64_image, mime_type = encode_image(image_path, options, report)
+                return f"data:{mime_type};base64,{base64_image}"
+
+            path = self._local_file(image_path, options, report)
+            if self.mode == "file":
+                return path.as_uri()
+            return self._http_url(path, image_path, options)
+
+    def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+
+
+def add_transport_arguments(parser) -> None:
+    """Общие флаги режима передачи изображений для CLI"""
+    parser.add_argument(
+        "--transport",
+        choices=TRANSPORT_MODES,
+        default="data",
+        help="Передача изображений: data (base64 в JSON), file (file:// URL, "
+             "сервер с --allowed-local-media-path), http (локальный HTTP сервер), "
+             "auto (file если локальный vllm_server.py разрешает spool директорию, "
+             "иначе http). По умолчанию: data"
+    )
+
+    parser.add_argument(
+        "--media-port",
+        type=int,
+        default=0,
+        help="Порт локального HTTP сервера для --transport http (по умолчанию: случайный)"
+    )
@@ -0,0 +1,399 @@
+#!/usr/bin/env python3
+"""
+Mock OpenAI-совместимый сервер для проверки клиентов и бенчмарков без GPU
+
+Имитирует vLLM: /v1/models, /v1/chat/completions (обычный и SSE поток,
+включая image_url части), /health и /metrics. Задержки складываются из
+prefill (на токен промпта) и decode (токенов/s на последовательность),
+одновременно выполняется не больше --max-num-seqs запросов, остальные ждут
+в очереди ограниченной емкости. Ошибки 429/5xx и зависания включаются
+вероятностями.
+
+Запуск: python mock_server.py --port 8000
+"""
+
+import argparse
+import asyncio
+import base64
+import io
+import json
+import random
+import time
+import uuid
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+from urllib.parse import unquote, urlparse
+
+from aiohttp import web
+
+WORDS = (
+    "the model answers with a short and plain text so that clients can be "
+    "tested without a GPU and every token arrives at a steady decode rate"
+).split()
+
+TTFT_BUCKETS = (0.001, 0.005, 0.01, 0.02, 0.04, 0.06, 0.08, 0.1, 0.25, 0.5,
+                0.75, 1.0, 2.5, 5.0, 7.5, 10.0, 20.0, 40.0, 80.0)
+
+
+@dataclass
+class MockConfig:
+    """Параметры имитации"""
+    served_model_name: str = "vllm-model"
+    max_model_len: int = 8192
+    prefill_ms_per_token: float = 0.1
+    decode_tokens_per_second: float = 50.0
+    default_output_tokens: int = 64
+    image_tokens: int = 256
+    max_num_seqs: int = 256
+    queue_capacity: int = 1024
+    error_rate_429: float = 0.0
+    error_rate_500: float = 0.0
+    error_rate_503: float = 0.0
+    timeout_rate: float = 0.0
+    hang_seconds: float = 300.0
+    seed: int = 0
+
+
+@dataclass
+class MockState:
+    """Счетчики для /metrics (имена как у vLLM)"""
+    running: int = 0
+    waiting: int = 0
+    prompt_tokens_total: int = 0
+    generation_tokens_total: int = 0
+    requests_total: Dict[str, int] = field(default_factory=dict)
+    ttft_buckets: List[int] = field(default_factory=lambda: [0] * len(TTFT_BUCKETS))
+    ttft_sum: float = 0.0
+    ttft_count: int = 0
+
+    def observe_ttft(self, value: float) -> None:
+        for i, bound in enumerate(TTFT_BUCKETS):
+            if value <= bound:
+                self.ttft_buckets[i] += 1
+        self.ttft_sum += value
+        self.ttft_count += 1
+
+
+def _image_tokens(url: str, config: MockConfig) -> int:
+    """Vision токены по реальному размеру изображения, если его можно прочитать"""
+    try:
+        from PIL import Image
+        from image_preprocess import server_vision_tokens
+
+        if url.startswith("data:"):
+            data = base64.b64decode(url.split(",", 1)[1])
+        elif url.startswith("file://"):
+            data = Path(unquote(urlparse(url).path)).read_bytes()
+        else:
+            return config.image_tokens
+        width, height = Image.open(io.BytesIO(data)).size
+        return server_vision_tokens(height, width)
+    except Exception:
+        return config.image_tokens
+
+
+def count_prompt_tokens(messages: List[Dict[str, Any]], config: MockConfig) -> int:
+    """Грубая оценка: ~4 символа на токен + vision токены + служебные токены шаблона"""
+    tokens = 0
+    for message in messages:
+        tokens += 4
+        content = message.get("content")
+        if isinstance(content, str):
+            tokens += max(1, len(content) // 4)
+            continue
+        for part in content or []:
+            if part.get("type") == "text":
+                tokens += max(1, len(part.get("text", "")) // 4)
+            elif part.get("type") == "image_url":
+                tokens += _image_tokens(part["image_url"]["url"], config)
+    return tokens
+
+
+class MockServer:
+    def __init__(self, config: MockConfig):
+        self.config = config
+        self.state = MockState()
+        self.rng = random.Random(config.seed)
+        self.slots = asyncio.Semaphore(config.max_num_seqs)
+
+    def _error(self, status: int, message: str) -> web.Response:
+        self.state.requests_total[str(status)] = self.state.requests_total.get(str(status), 0) + 1
+        return web.json_response(
+            {"object": "error", "message": message, "type": "MockError", "code": status},
+            status=status,
+        )
+
+    async def models(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            "object": "list",
+            "data": [{
+                "id": self.config.served_model_name,
+                "object": "model",
+                "created": int(time.time()),
+                "owned_by": "vllm",
+                "root": self.config.served_model_name,
+                "max_model_len": self.config.max_model_len,
+            }],
+        })
+
+    async def health(self, request: web.Request) -> web.Response:
+        return web.Response(status=200)
+
+    async def metrics(self, request: web.Request) -> web.Response:
+        s = self.state
+        name = self.config.served_model_name
+        labels = f'model_name="{name}"'
+        usage = min(1.0, s.running / self.config.max_num_seqs)
+        lines = [
+            "# TYPE vllm:num_requests_running gauge",
+            f"vllm:num_requests_running{{{labels}}} {s.running}",
+            "# TYPE vllm:num_requests_waiting gauge",
+            f"vllm:num_requests_waiting{{{labels}}} {s.waiting}",
+            "# TYPE vllm:kv_cache_usage_perc gauge",
+            f"vllm:kv_cache_usage_perc{{{labels}}} {usage}",
+            "# TYPE vllm:prompt_tokens_total counter",
+            f"vllm:prompt_tokens_total{{{labels}}} {s.prompt_tokens_total}",
+            "# TYPE vllm:generation_tokens_total counter",
+            f"vllm:generation_tokens_total{{{labels}}} {s.generation_tokens_total}",
+            "# TYPE vllm:time_to_first_token_seconds histogram",
+        ]
+        for bound, count in zip(TTFT_BUCKETS, s.ttft_buckets):
+            lines.append(f'vllm:time_to_first_token_seconds_bucket{{{labels},le="{bound}"}} {count}')
+        lines += [
+            f'vllm:time_to_first_token_seconds_bucket{{{labels},le="+Inf"}} {s.ttft_count}',
+            f"vllm:time_to_first_token_seconds_sum{{{labels}}} {s.ttft_sum}",
+            f"vllm:time_to_first_token_seconds_count{{{labels}}} {s.ttft_count}",
+            "# TYPE vllm:request_success_total counter",
+        ]
+        for code, count in sorted(s.requests_total.items()):
+            lines.append(f'vllm:request_success_total{{{labels},status="{code}"}} {count}')
+        return web.Response(text="\n".join(lines) + "\n", content_type="text/plain")
+
+    def _output_tokens(self, body: Dict[str, Any]) -> int:
+        max_tokens = body.get("max_tokens") or body.get("max_completion_tokens")
+        if body.get("ignore_eos") and max_tokens:
+            return max_tokens
+        return min(max_tokens or self.config.default_output_tokens, self.config.default_output_tokens)
+
+    async def chat_completions(self, request: web.Request) -> web.StreamResponse:
+        try:
+            body = await request.json()
+        except ValueError:
+            return self._error(400, "Некорректный JSON")
+
+        if body.get("model") != self.config.served_model_name:
+            return self._error(404, f"The model `{body.get('model')}` does not exist.")
+
+        # Инъекция ошибок до постановки в очередь
+        roll = self.rng.random()
+        cfg = self.config
+        if roll < cfg.error_rate_429:
+            return self._error(429, "Too Many Requests (mock)")
+        roll -= cfg.error_rate_429
+        if roll < cfg.error_rate_500:
+            return self._error(500, "Internal Server Error (mock)")
+        roll -= cfg.error_rate_500
+        if roll < cfg.error_rate_503:
+            return self._error(503, "Service Unavailable (mock)")
+        roll -= cfg.error_rate_503
+        if roll < cfg.timeout_rate:
+            await asyncio.sleep(cfg.hang_seconds)
+            return self._error(504, "Timeout (mock)")
+
+        prompt_tokens = count_prompt_tokens(body.get("messages") or [], cfg)
+        output_tokens = self._output_tokens(body)
+        if prompt_tokens + output_tokens > cfg.max_model_len:
+            return self._error(
+                400,
+                f"This model's maximum context length is {cfg.max_model_len} tokens. "
+                f"However, you requested {prompt_tokens + output_tokens} tokens "
+                f"({prompt_tokens} in the messages, {output_tokens} in the completion).",
+            )
+
+        if self.state.waiting >= cfg.queue_capacity:
+            return self._error(503, "Queue is full (mock)")
+
+        start = time.perf_counter()
+        self.state.waiting += 1
+        try:
+            await self.slots.acquire()
+        finally:
+            self.state.waiting -= 1
+        self.state.running += 1
+        try:
+            if body.get("stream"):
+                return await self._stream(request, body, prompt_tokens, output_tokens, start)
+            return await self._complete(body, prompt_tokens, output_tokens, start)
+        finally:
+            self.state.running -= 1
+            self.slots.release()
+
+    async def _prefill(self, prompt_tokens: int, start: float) -> None:
+        await asyncio.sleep(prompt_tokens * self.config.prefill_ms_per_token / 1000)
+        self.state.prompt_tokens_total += prompt_tokens
+        self.state.observe_ttft(time.perf_counter() - start)
+
+    def _token(self, i: int) -> str:
+        return WORDS[i % len(WORDS)] + " "
+
+    async def _complete(self, body, prompt_tokens: int, output_tokens: int, start: float) -> web.Response:
+        await self._prefill(prompt_tokens, start)
+        await asyncio.sleep(output_tokens / self.config.decode_tokens_per_second)
+        self.state.generation_tokens_total += output_tokens
+        self.state.requests_total["200"] = self.state.requests_total.get("200", 0) + 1
+        return web.json_response({
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": self.config.served_model_name,
+            "choices": [{
+                "index": 0,
+                "message": {
+                    "role": "assistant",
+                    "content": "".join(self._token(i) for i in range(output_tokens)),
+                },
+                "finish_reason": "length" if output_tokens == body.get("max_tokens") else "stop",
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": output_tokens,
+                "total_tokens": prompt_tokens + output_tokens,
+            },
+        })
+
+    async def _stream(self, request, body, prompt_tokens: int, output_tokens: int, start: float):
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+
+        def chunk(choices, usage=None) -> bytes:
+            data = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": self.config.served_model_name,
+                "choices": choices,
+            }
+            if usage is not None:
+                data["usage"] = usage
+            return f"data: {json.dumps(data)}\n\n".encode()
+
+        await response.write(chunk([{"index": 0, "delta": {"role": "assistant", "content": ""}}]))
+        await self._prefill(prompt_tokens, start)
+
+        interval = 1 / self.config.decode_tokens_per_second
+        next_at = time.perf_counter()
+        try:
+            for i in range(output_tokens):
+                await response.write(chunk([{"index": 0, "delta": {"content": self._token(i)}}]))
+                self.state.generation_tokens_total += 1
+                next_at += interval
+                await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+        except (ConnectionResetError, asyncio.CancelledError):
+            # Клиент закрыл соединение - как vLLM, прерываем генерацию
+            self.state.requests_total["aborted"] = self.state.requests_total.get("aborted", 0) + 1
+            raise
+
+        finish = "length" if output_tokens == body.get("max_tokens") else "stop"
+        await response.write(chunk([{"index": 0, "delta": {}, "finish_reason": finish}]))
+        if (body.get("stream_options") or {}).get("include_usage"):
+            await response.write(chunk([], {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": output_tokens,
+                "total_tokens": prompt_tokens + output_tokens,
+            }))
+        await response.write(b"data: [DONE]\n\n")
+        self.state.requests_total["200"] = self.state.requests_total.get("200", 0) + 1
+        return response
+
+
+def create_app(config: Optional[MockConfig] = None) -> web.Application:
+    """aiohttp приложение (для запуска в тестах через aiohttp.test_utils)"""
+    server = MockServer(config or MockConfig())
+    app = web.Application(client_max_size=256 * 1024**2)
+    app["mock"] = server
+    app.router.add_get("/v1/models", server.models)
+    app.router.add_get("/health", server.health)
+    app.router.add_get("/metrics", server.metrics)
+    app.router.add_post("/v1/chat/completions", server.chat_completions)
+    return app
+
+
+def main():
+    defaults = MockConfig()
+    parser = argparse.ArgumentParser(
+        description="Mock vLLM OpenAI API сервер (без GPU)"
+    )
+
+    parser.add_argument("--host", default="127.0.0.1",
+                        help="Host (по умолчанию: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8000,
+                        help="Порт (по умолчанию: 8000)")
+    parser.add_argument("--served-model-name", default=defaults.served_model_name,
+                        help=f"Имя модели (по умолчанию: {defaults.served_model_name})")
+    parser.add_argument("--max-model-len", type=int, default=defaults.max_model_len,
+                        help=f"Максимальный контекст (по умолчанию: {defaults.max_model_len})")
+    parser.add_argument("--prefill-ms-per-token", type=float, default=defaults.prefill_ms_per_token,
+                        help=f"Задержка prefill на токен промпта, ms (по умолчанию: {defaults.prefill_ms_per_token})")
+    parser.add_argument("--decode-tps", type=float, default=defaults.decode_tokens_per_second,
+                        help=f"Токенов/s на последовательность (по умолчанию: {defaults.decode_tokens_per_second})")
+    parser.add_argument("--output-tokens", type=int, default=defaults.default_output_tokens,
+                        help=f"Длина ответа без ignore_eos (по умолчанию: {defaults.default_output_tokens})")
+    parser.add_argument("--image-tokens", type=int, default=defaults.image_tokens,
+                        help=f"Vision токенов на нечитаемое изображение (по умолчанию: {defaults.image_tokens})")
+    parser.add_argument("--max-num-seqs", type=int, default=defaults.max_num_seqs,
+                        help=f"Одновременно выполняемых запросов (по умолчанию: {defaults.max_num_seqs})")
+    parser.add_argument("--queue-capacity", type=int, default=defaults.queue_capacity,
+                        help=f"Емкость очереди ожидания, сверх - 503 (по умолчанию: {defaults.queue_capacity})")
+    parser.add_argument("--error-rate-429", type=float, default=0.0,
+                        help="Доля ответов 429")
+    parser.add_argument("--error-rate-500", type=float, default=0.0,
+                        help="Доля ответов 500")
+    parser.add_argument("--error-rate-503", type=float, default=0.0,
+                        help="Доля ответов 503")
+    parser.add_argument("--timeout-rate", type=float, default=0.0,
+                        help="Доля запросов, которые зависают на --hang-seconds")
+    parser.add_argument("--hang-seconds", type=float, default=defaults.hang_seconds,
+                        help=f"Длительность зависания (по умолчанию: {defaults.hang_seconds})")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="Seed для инъекции ошибок (по умолчанию: 0)")
+
+    args = parser.parse_args()
+
+    config = MockConfig(
+        served_model_name=args.served_model_name,
+        max_model_len=args.max_model_len,
+        prefill_ms_per_token=args.prefill_ms_per_token,
+        decode_tokens_per_second=args.decode_tps,
+        default_output_tokens=args.output_tokens,
+        image_tokens=args.image_tokens,
+        max_num_seqs=args.max_num_seqs,
+        queue_capacity=args.queue_capacity,
+        error_rate_429=args.error_rate_429,
+        error_rate_500=args.error_rate_500,
+        error_rate_503=args.error_rate_503,
+        timeout_rate=args.timeout_rate,
+        hang_seconds=args.hang_seconds,
+        seed=args.seed,
+    )
+
+    print("=" * 70)
+    print("🧪 Mock vLLM API сервер")
+    print("=" * 70)
+    print(f"🌐 http://{args.host}:{args.port}/v1")
+    print(f"📦 Модель: {config.served_model_name} (max_model_len={config.max_model_len})")
+    print(f"⏱️  Prefill: {config.prefill_ms_per_token} ms/токен, decode: {config.decode_tokens_per_second} ток/s")
+    print(f"📥 max_num_seqs={config.max_num_seqs}, очередь={config.queue_capacity}")
+    print("=" * 70)
+
+    # Как vLLM: отключение клиента прерывает обработку запроса
+    web.run_app(
+        create_app(config), host=args.host, port=args.port, print=None,
+        handler_cancellation=True,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+Реестр моделей и профилей запуска vLLM (models.yaml)
+
+Модель задает model_id, аргументы движка и параметры генерации по
+умолчанию, профиль (latency, throughput, long-context) - настройки
+планировщика поверх модели. engine_args() сводит defaults -> модель ->
+профиль -> флаги командной строки в один словарь, to_cli_args() превращает
+его в аргументы vLLM.
+
+Параметры генерации отдаются самим сервером через
+--override-generation-config, поэтому действуют и для клиентов, которые их
+не передают. vLLM принимает там только GENERATION_CONFIG_KEYS - остальные
+(например, presence_penalty) по-прежнему нужно передавать в запросе.
+"""
+
+import json
+import os
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+import yaml
+
+DEFAULT_REGISTRY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "models.yaml")
+SERVED_MODEL_NAME = "vllm-model"
+
+# Ключи, которые vLLM берет из --override-generation-config
+GENERATION_CONFIG_KEYS = (
+    "repetition_penalty", "temperature", "top_k", "top_p", "min_p", "max_new_tokens",
+)
+
+
+@dataclass
+class Profile:
+    name: str
+    description: str = ""
+    engine: Dict[str, Any] = field(default_factory=dict)
+
+
+@dataclass
+class ModelEntry:
+    name: str
+    model_id: str
+    description: str = ""
+    group: str = ""
+    vlm: bool = False
+    engine: Dict[str, Any] = field(default_factory=dict)
+    sampling: Dict[str, Any] = field(default_factory=dict)
+
+    def served_sampling(self) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """(параметры для --override-generation-config, неподдерживаемые сервером)"""
+        served = {k: v for k, v in self.sampling.items() if k in GENERATION_CONFIG_KEYS}
+        unsupported = {k: v for k, v in self.sampling.items() if k not in GENERATION_CONFIG_KEYS}
+        return served, unsupported
+
+
+def _mapping(value: Any, where: str) -> Dict[str, Any]:
+    if value is None:
+        return {}
+    if not isinstance(value, dict):
+        raise ValueError(f"{where}: ожидается словарь, получено {type(value).__name__}")
+    return value
+
+
+@dataclass
+class Registry:
+    defaults: Dict[str, Any] = field(default_factory=dict)
+    profiles: Dict[str, Profile] = field(default_factory=dict)
+    models: Dict[str, ModelEntry] = field(default_factory=dict)
+    path: Optional[str] = None
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any], path: Optional[str] = None) -> "Registry":
+        data = _mapping(data, "models.yaml")
+        profiles = {}
+        for name, raw in _mapping(data.get("profiles"), "profiles").items():
+            raw = _mapping(raw, f"profiles.{name}")
+            profiles[name] = Profile(
+                name=name,
+                description=raw.get("description", ""),
+                engine=_mapping(raw.get("engine"), f"profiles.{name}.engine"),
+            )
+        models = {}
+        for name, raw in _mapping(data.get("models"), "models").items():
+            raw = _mapping(raw, f"models.{name}")
+            if not raw.get("model_id"):
+                raise ValueError(f"models.{name}: нет model_id")
+            models[name] = ModelEntry(
+                name=name,
+                model_id=raw["model_id"],
+                description=raw.get("description", ""),
+                group=str(raw.get("group", "")),
+                vlm=bool(raw.get("vlm", False)),
+                engine=_mapping(raw.get("engine"), f"models.{name}.engine"),
+                sampling=_mapping(raw.get("sampling"), f"models.{name}.sampling"),
+            )
+        return cls(
+            defaults=_mapping(data.get("defaults"), "defaults"),
+            profiles=profiles,
+            models=models,
+            path=path,
+        )
+
+    def model(self, name: str) -> ModelEntry:
+        """Модель по имени из реестра; HF id/путь вне реестра - без настроек"""
+        if name in self.models:
+            return self.models[name]
+        if "/" in name or os.path.isdir(os.path.expanduser(name)):
+            return ModelEntry(name=name, model_id=name)
+        raise ValueError(
+            f"Модель '{name}' не найдена в реестре (доступны: {', '.join(sorted(self.models))})"
+        )
+
+    def profile(self, name: Optional[str]) -> Optional[Profile]:
+        if name is None:
+            return None
+        if name not in self.profiles:
+            raise ValueError(
+                f"Профиль '{name}' не найден (доступны: {', '.join(sorted(self.profiles))})"
+            )
+        return self.profiles[name]
+
+
+def load_registry(path: str = DEFAULT_REGISTRY) -> Registry:
+    with open(path, encoding="utf-8") as f:
+        return Registry.from_dict(yaml.safe_load(f) or {}, path=path)
+
+
+def engine_args(
+    registry: Registry,
+    entry: ModelEntry,
+    profile: Optional[Profile] = None,
+    overrides: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    """
+    Итоговые аргументы движка: defaults -> модель -> профиль -> overrides
+
+    None в overrides означает "не задано" и не перекрывает реестр.
+    """
+    args: Dict[str, Any] = {"model": entry.model_id, "served_model_name": SERVED_MODEL_NAME}
+    args.update(registry.defaults)
+    args.update(entry.engine)
+    if profile is not None:
+        args.update(profile.engine)
+    args.update({k: v for k, v in (overrides or {}).items() if v is not None})
+
+    served, _ = entry.served_sampling()
+    if served and "override_generation_config" not in args:
+        args["override_generation_config"] = served
+    return args
+
+
+def to_cli_args(args: Dict[str, Any]) -> List[str]:
+    """
+    Словарь snake_case -> ["--kebab-case", "значение", ...]
+
+    False - явное выключение (--no-flag): иначе профиль не смог бы выключить
+    флаг, включенный моделью или включенный в vLLM по умолчанию.
+    """
+    argv = []
+    for key, value in args.items():
+        flag = "--" + key.replace("_", "-")
+        if value is True:
+            argv.append(flag)
+        elif value is False:
+            argv.append("--no-" + flag[2:])
+        elif value is None:
+            continue
+        elif isinstance(value, (dict, list)):
+            argv.extend([flag, json.dumps(value)])
+        else:
+            argv.extend([flag, str(value)])
+    return argv
+
+
+def write_profile(path: str, name: str, description: str, engine: Dict[str, Any]) -> None:
+    """
+    Добавить или заменить профиль в models.yaml
+
+    Файл правится как текст, чтобы сохранить комментарии и порядок: блок
+    профиля - строки от "  name:" до следующего ключа с отступом <= 2.
+    """
+    with open(path, encoding="utf-8") as f:
+        lines = f.read().splitlines(keepends=True)
+
+    block = yaml.safe_dump(
+        {name: {"description": description, "engine": engine}},
+        allow_unicode=True, sort_keys=False, default_flow_style=False, width=1000,
+    )
+    block_lines = ["  " + line if line.strip() else line for line in block.splitlines(keepends=True)]
+    block_lines.append("\n")
+
+    def indent(line: str) -> int:
+        return len(line) - len(line.lstrip(" "))
+
+    try:
+        section = next(i for i, line in enumerate(lines) if line.rstrip() == "profiles:")
+    except StopIteration:
+        raise ValueError(f"{path}: нет секции profiles") from None
+    end = next((i for i in range(section + 1, len(lines))
+                if lines[i].strip() and not lines[i].lstrip().startswith("#") and indent(lines[i]) == 0),
+               len(lines))
+
+    start = next((i for i in range(section + 1, end) if lines[i].rstrip() == f"  {name}:"), None)
+    if start is None:
+        # Новый профиль - в конец секции, перед пустыми строками/комментариями следующей
+        insert = end
+        while insert > section + 1 and (not lines[insert - 1].strip() or lines[insert - 1].lstrip().startswith("#")):
+            insert -= 1
+        new_lines = lines[:insert] + ["\n"] + block_lines[:-1] + lines[insert:]
+    else:
+        stop = next((i for i in range(start + 1, end)
+                     if lines[i].strip() and indent(lines[i]) <= 2), end)
+        while stop > start + 1 and not lines[stop - 1].strip():
+            stop -= 1
+        new_lines = lines[:start] + block_lines[:-1] + lines[stop:]
+
+    text = "".join(new_lines)
+    # Проверка: файл по-прежнему разбирается, профиль на месте
+    registry = Registry.from_dict(yaml.safe_load(text), path=path)
+    if registry.profiles[name].engine != engine:
+        raise ValueError(f"{path}: профиль {name} записан некорректно")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+
+
+def format_models(registry: Registry) -> str:
+    """Список моделей и профилей для --list-models"""
+    lines = ["Модели:"]
+    for entry in registry.models.values():
+        tag = " [VLM]" if entry.vlm else ""
+        group = f"{entry.group:>7}  " if entry.group else ""
+        lines.append(f"  {group}{entry.name:<16} {entry.model_id}{tag}")
+        if entry.description:
+            lines.append(f"  {'':>9}{'':<16} {entry.description}")
+    lines.append("")
+    lines.append("Профили (--profile):")
+    for profile in registry.profiles.values():
+        lines.append(f"  {profile.name:<14} {profile.description}")
+    return "\n".join(lines)
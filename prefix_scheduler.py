@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+Порядок запросов batch нагрузки с учетом prefix cache vLLM
+
+Сервер (--enable-prefix-caching) переиспользует KV cache только для
+совпадающего начала промпта. Запрос раскладывается на сегменты в том
+порядке, в каком они идут в промпте (system prompt, few-shot сообщения,
+изображения, вопрос - см. Qwen3VLClient.build_payload), задачи сортируются
+так, чтобы запросы с общим началом шли подряд, пока оно еще в кэше, и
+оценивается доля prompt токенов, которые сервер возьмет из кэша.
+
+Оценка приблизительная: текст ~4 байта UTF-8 на токен, изображения -
+по сетке патчей, кэш - LRU на cache_tokens токенов.
+"""
+
+import hashlib
+import json
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from PIL import Image
+
+from image_cache import ImageCache
+from image_preprocess import PreprocessOptions, server_vision_tokens, target_size
+
+# Порядка KV cache одной 24-32GB GPU для небольшой модели;
+# точное значение - "GPU KV cache size" в логе запуска vLLM
+DEFAULT_CACHE_TOKENS = 200_000
+
+
+@dataclass(frozen=True)
+class Segment:
+    """Часть промпта: хэш содержимого и оценка числа токенов"""
+    key: str
+    tokens: int
+
+
+@dataclass
+class PrefixReport:
+    """Оценка переиспользования prefix cache для последовательности запросов"""
+    requests: int = 0
+    prompt_tokens: int = 0
+    cached_tokens: int = 0
+    groups: int = 0
+
+    @property
+    def reuse_ratio(self) -> float:
+        return self.cached_tokens / self.prompt_tokens if self.prompt_tokens else 0.0
+
+    def format_report(self) -> str:
+        return (
+            f"{self.requests} запросов, {self.groups} групп с общим префиксом, "
+            f"~{self.cached_tokens}/{self.prompt_tokens} prompt токенов из кэша "
+            f"({self.reuse_ratio:.0%})"
+        )
+
+
+def canonical_json(value: Any) -> str:
+    """Байт-в-байт стабильная сериализация: одинаковые данные - одинаковая строка"""
+    return json.dumps(value, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+
+
+def _digest(kind: str, value: str) -> str:
+    return hashlib.sha1(f"{kind}\0{value}".encode("utf-8")).hexdigest()[:16]
+
+
+def text_tokens(text: str) -> int:
+    """Грубая оценка числа токенов текста"""
+    return max(1, len(text.encode("utf-8")) // 4)
+
+
+def image_tokens(image_path: str, options: Optional[PreprocessOptions] = None) -> int:
+    """Число vision токенов изображения (читается только заголовок файла)"""
+    with Image.open(image_path) as img:
+        width, height = img.size
+    if options is not None:
+        height, width = target_size(height, width, options)
+    return server_vision_tokens(height, width)
+
+
+def job_segments(
+    question: str,
+    image_paths: Optional[Sequence[str]] = None,
+    system: Optional[str] = None,
+    history: Optional[List[Dict[str, Any]]] = None,
+    preprocess: Optional[PreprocessOptions] = None,
+    hasher: Optional[ImageCache] = None,
+) -> List[Segment]:
+    """
+    Сегменты промпта запроса в порядке build_payload()
+
+    Изображения идентифицируются хэшем содержимого (и параметрами
+    подготовки), так что одна картинка под разными путями - один сегмент.
+    """
+    hasher = hasher or ImageCache(cache_dir=None, memory_items=0)
+    segments = []
+    if system:
+        segments.append(Segment(_digest("system", system), text_tokens(system)))
+    for message in history or []:
+        serialized = canonical_json(message)
+        segments.append(Segment(_digest("message", serialized), text_tokens(serialized)))
+    for image_path in image_paths or []:
+        try:
+            key = hasher.cache_key(image_path, preprocess)
+            tokens = image_tokens(image_path, preprocess)
+        except OSError:
+            # Запрос все равно упадет на чтении файла - в кэш он ничего не внесет
+            key, tokens = _digest("missing", image_path), 0
+        segments.append(Segment(_digest("image", key), tokens))
+    segments.append(Segment(_digest("text", question), text_tokens(question)))
+    return segments
+
+
+def order_by_prefix(segment_lists: Sequence[List[Segment]]) -> List[int]:
+    """
+    Индексы запросов в порядке обхода дерева префиксов
+
+    Лексикографическая сортировка по ключам сегментов ставит рядом запросы
+    с самым длинным общим началом; сортировка стабильна, так что внутри
+    группы сохраняется исходный порядок.
+    """
+    return sorted(
+        range(len(segment_lists)),
+        key=lambda i: [s.key for s in segment_lists[i]],
+    )
+
+
+def estimate_reuse(
+    segment_lists: Sequence[List[Segment]],
+    cache_tokens: Optional[int] = DEFAULT_CACHE_TOKENS,
+) -> PrefixReport:
+    """
+    Сколько prompt токенов сервер возьмет из prefix cache при данном порядке
+
+    Кэш моделируется как LRU по префиксам (цепочкам сегментов) общим
+    объемом cache_tokens; None - без вытеснения.
+    """
+    report = PrefixReport(requests=len(segment_lists))
+    cache: "OrderedDict[str, int]" = OrderedDict()
+    used = 0
+    groups = set()
+
+    for segments in segment_lists:
+        chain = ""
+        hit = True
+        for segment in segments:
+            chain = _digest("chain", chain + segment.key)
+            report.prompt_tokens += segment.tokens
+            if hit and chain in cache:
+                report.cached_tokens += segment.tokens
+                cache.move_to_end(chain)
+                continue
+            hit = False
+            if chain not in cache:
+                cache[chain] = segment.tokens
+                used += segment.tokens
+        # Группа - все, кроме последнего (уникального) сегмента
+        groups.add(tuple(s.key for s in segments[:-1]))
+
+        while cache_tokens is not None and used > cache_tokens and cache:
+            _, tokens = cache.popitem(last=False)
+            used -= tokens
+
+    report.groups = len(groups)
+    return report
+
+
+def schedule_batch_jobs(
+    jobs: List[Dict[str, Any]],
+    preprocess: Optional[PreprocessOptions] = None,
+    image_cache: Optional[ImageCache] = None,
+    cache_tokens: Optional[int] = DEFAULT_CACHE_TOKENS,
+) -> Tuple[List[Dict[str, Any]], PrefixReport, PrefixReport]:
+    """
+    Переупорядочить задачи batch_runner.load_jobs() по общему префиксу
+
+    Returns:
+        (задачи в новом порядке, оценка для исходного порядка, оценка для нового)
+    """
+    hasher = image_cache or ImageCache(cache_dir=None, memory_items=0)
+    segment_lists = [
+        job_segments(
+            job["question"],
+            job["images"],
+            system=job["params"].get("system"),
+            history=job["params"].get("history"),
+            preprocess=preprocess,
+            hasher=hasher,
+        )
+        for job in jobs
+    ]
+    order = order_by_prefix(segment_lists)
+    before = estimate_reuse(segment_lists, cache_tokens)
+    after = estimate_reuse([segment_lists[i] for i in order], cache_tokens)
+    return [jobs[i] for i in order], before, after
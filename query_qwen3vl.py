@@ -3,16 +3,102 @@
 Helper для запросов к Qwen3-VL-2B с оптимальными параметрами
 """
 
+import asyncio
+import contextlib
 import requests
-import base64
-from pathlib import Path
-from typing import List, Optional
+import aiohttp
+import time
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, Iterator, List, Optional, Union
 
-class Qwen3VLClient:
-    """Клиент для Qwen3-VL-2B с оптимальными параметрами"""
+from adaptive_concurrency import AdaptiveConcurrency
+from client_tracing import (
+    Tracer,
+    add_span,
+    add_tracing_arguments,
+    aiohttp_trace_config,
+    span,
+    trace_request,
+    tracer_from_args,
+)
+from hedging import DEFAULT_HEDGE_DELAY, HedgeLost, LatencyTracker, hedged_race
+from image_cache import ImageCache, add_cache_arguments, cache_from_args, resolve_image_cache
+from image_preprocess import (
+    PreprocessOptions,
+    PreprocessResult,
+    add_preprocess_arguments,
+    encode_image,
+    options_from_args,
+    print_report,
+)
+from media_transport import MediaTransport, add_transport_arguments
+from response_cache import ResponseCache, add_response_cache_arguments, response_cache_from_args
+from token_preflight import TokenPreflight, add_preflight_arguments, preflight_from_args
+from streaming import (
+    JSON_HEADERS,
+    APIError,
+    StreamStats,
+    astream_chat_completion,
+    encode_body,
+    stream_chat_completion,
+)
+
+
+@dataclass
+class AskResult:
+    """Результат одного запроса из ask_many()"""
+    index: int
+    job: Dict[str, Any]
+    content: Optional[str] = None
+    error: Optional[Exception] = None
+    latency: float = 0.0
+    stats: Optional[StreamStats] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+class _Qwen3VLBase:
+    """Общая часть синхронного и асинхронного клиентов: параметры и payload"""
     
-    def __init__(self, api_url: str = "http://localhost:8000"):
+    def __init__(
+        self,
+        api_url: str = "http://localhost:8000",
+        preprocess: Optional[PreprocessOptions] = None,
+        image_cache: Union[ImageCache, bool] = True,
+        transport: Union[str, MediaTransport] = "data",
+        response_cache: Optional[ResponseCache] = None,
+        hedge_urls: Optional[List[str]] = None,
+        hedge_delay: Optional[float] = None,
+        hedge_percentile: float = 95.0,
+    ):
         self.api_url = api_url
+        # Подготовка изображений (None - отправлять файлы как есть)
+        self.preprocess = preprocess
+        # Кэш base64 по хэшу содержимого (True - общий кэш процесса, False - выключен)
+        self.image_cache = resolve_image_cache(image_cache)
+        # data (base64 в JSON), file, http или auto - см. media_transport.py
+        if isinstance(transport, str):
+            transport = MediaTransport(transport, api_url, self.image_cache)
+        self.transport = transport
+        # Кэш ответов детерминированных запросов (None - выключен)
+        self.response_cache = response_cache
+        if response_cache is not None:
+            response_cache.bind(api_url)
+        # Hedging: дубль запроса на следующий endpoint, если первого токена нет
+        # дольше hedge_delay (None - hedge_percentile недавних TTFT)
+        self.hedge_urls = list(hedge_urls or [])
+        self.hedge_delay = hedge_delay
+        self.hedge_percentile = hedge_percentile
+        self.ttft_tracker = LatencyTracker()
+        # Проверка бюджета токенов до отправки (None - выключена)
+        self.preflight: Optional[TokenPreflight] = None
+        self.last_preflight = None
+        # Фазы запросов в JSONL (None - выключено, см. client_tracing.py)
+        self.tracer: Optional[Tracer] = None
+        # Callback (путь, PreprocessResult) со статистикой экономии
+        self.on_preprocess: Optional[Callable[[str, PreprocessResult], None]] = None
         self.default_params = {
             # Параметры из llama.cpp
             "top_p": 0.8,
@@ -22,72 +108,545 @@ class Qwen3VLClient:
             "max_tokens": 500,
         }
     
+    def current_hedge_delay(self) -> float:
+        """Через сколько секунд без первого токена отправлять дубль"""
+        if self.hedge_delay is not None:
+            return self.hedge_delay
+        return self.ttft_tracker.percentile(self.hedge_percentile) or DEFAULT_HEDGE_DELAY
+    
     def encode_image(self, image_path: str) -> tuple[str, str]:
-        """Кодировать изображение в base64"""
-        ext = Path(image_path).suffix.lower()
-        mime_types = {
-            '.jpg': 'image/jpeg',
-            '.jpeg': 'image/jpeg',
-            '.png': 'image/png',
-            '.gif': 'image/gif',
-            '.webp': 'image/webp',
-            '.bmp': 'image/bmp',
-        }
-        mime_type = mime_types.get(ext, 'image/jpeg')
-        
-        with open(image_path, "rb") as f:
-            base64_data = base64.b64encode(f.read()).decode("utf-8")
-        
-        return base64_data, mime_type
+        """Кодировать изображение в base64 (с подготовкой, если задан preprocess)"""
+        if self.image_cache is not None:
+            return self.image_cache.encode(image_path, self.preprocess, self.on_preprocess)
+        return encode_image(image_path, self.preprocess, self.on_preprocess)
     
-    def ask(
+    def build_payload(
         self,
         question: str,
         image_paths: Optional[List[str]] = None,
+        system: Optional[str] = None,
+        history: Optional[List[Dict[str, Any]]] = None,
         **kwargs
-    ) -> str:
+    ) -> dict:
         """
-        Отправить запрос с оптимальными параметрами
+        Собрать тело запроса /v1/chat/completions
         
-        Args:
-            question: Вопрос
-            image_paths: Список путей к изображениям (опционально)
-            **kwargs: Переопределить параметры генерации
+        Порядок частей промпта - от общих к уникальным: system, history
+        (few-shot сообщения), изображения, вопрос. Так запросы с общими
+        system prompt и изображениями делят начало промпта и попадают в
+        prefix cache сервера (см. prefix_scheduler.py).
         """
         
+        with span("build", images=len(image_paths or [])):
+            return self._build_payload(question, image_paths, system, history, **kwargs)
+    
+    def _build_payload(
+        self,
+        question: str,
+        image_paths: Optional[List[str]],
+        system: Optional[str],
+        history: Optional[List[Dict[str, Any]]],
+        **kwargs
+    ) -> dict:
         # Объединяем параметры
         params = {**self.default_params, **kwargs}
+        preprocess = self.preprocess
+        
+        # Подгонка под контекст сервера: history, размер изображений, max_tokens
+        if self.preflight is not None:
+            history, preprocess, result = self.preflight.check(
+                question, image_paths, system, history, preprocess,
+                params.get("max_tokens"),
+            )
+            params["max_tokens"] = result.max_tokens
+            self.last_preflight = result
         
         # Формируем content
         if image_paths:
-            content = [{"type": "text", "text": question}]
+            content = []
             
             for image_path in image_paths:
-                base64_image, mime_type = self.encode_image(image_path)
+                url = self.transport.image_url(
+                    image_path, preprocess, self.on_preprocess
+                )
                 content.append({
                     "type": "image_url",
                     "image_url": {
-                        "url": f"data:{mime_type};base64,{base64_image}"
+                        "url": url
                     }
                 })
+            
+            content.append({"type": "text", "text": question})
         else:
             content = question
         
-        # Запрос
-        response = requests.post(
-            f"{self.api_url}/v1/chat/completions",
-            json={
-                "model": "vllm-model",
-                "messages": [{"role": "user", "content": content}],
-                **params
-            },
-            timeout=120
+        messages = []
+        if system:
+            messages.append({"role": "system", "content": system})
+        messages.extend(history or [])
+        messages.append({"role": "user", "content": content})
+        
+        return {
+            "model": "vllm-model",
+            "messages": messages,
+            **params
+        }
+
+
+class Qwen3VLClient(_Qwen3VLBase):
+    """Клиент для Qwen3-VL-2B с оптимальными параметрами"""
+    
+    def __init__(
+        self,
+        api_url: str = "http://localhost:8000",
+        max_concurrency: int = 32,
+        preprocess: Optional[PreprocessOptions] = None,
+        image_cache: Union[ImageCache, bool] = True,
+        transport: Union[str, MediaTransport] = "data",
+        response_cache: Optional[ResponseCache] = None,
+        hedge_urls: Optional[List[str]] = None,
+        hedge_delay: Optional[float] = None,
+        hedge_percentile: float = 95.0,
+    ):
+        super().__init__(
+            api_url, preprocess, image_cache, transport, response_cache,
+            hedge_urls, hedge_delay, hedge_percentile,
+        )
+        self.max_concurrency = max_concurrency
+        # Keep-alive: переиспользуем TCP соединение между вызовами
+        self.session = requests.Session()
+        # Статистика последнего потокового запроса (ask(stream=True))
+        self.last_stream_stats: Optional[StreamStats] = None
+        # Асинхронный клиент для hedging и дедлайнов (создается при первой надобности)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._async: Optional["AsyncQwen3VLClient"] = None
+    
+    def _copy_settings(self, client: "AsyncQwen3VLClient") -> "AsyncQwen3VLClient":
+        """Перенести параметры в асинхронный клиент"""
+        client.default_params = dict(self.default_params)
+        client.on_preprocess = self.on_preprocess
+        client.transport = self.transport
+        client.response_cache = self.response_cache
+        client.hedge_urls = self.hedge_urls
+        client.hedge_delay = self.hedge_delay
+        client.hedge_percentile = self.hedge_percentile
+        client.ttft_tracker = self.ttft_tracker
+        client.preflight = self.preflight
+        client.tracer = self.tracer
+        return client
+    
+    def _async_client(self) -> "AsyncQwen3VLClient":
+        """Асинхронный клиент на собственном event loop (keep-alive между вызовами)"""
+        if self._async is None:
+            self._loop = asyncio.new_event_loop()
+            self._async = self._copy_settings(AsyncQwen3VLClient(
+                api_url=self.api_url,
+                max_concurrency=self.max_concurrency,
+                preprocess=self.preprocess,
+                image_cache=self.image_cache or False,
+            ))
+        return self._async
+    
+    def close(self) -> None:
+        if self._loop is not None:
+            self._loop.run_until_complete(self._async.close())
+            self._loop.close()
+            self._loop = None
+        self.session.close()
+    
+    def ask(
+        self,
+        question: str,
+        image_paths: Optional[List[str]] = None,
+        stream: bool = False,
+        on_token: Optional[Callable[[str], None]] = None,
+        deadline: Optional[float] = None,
+        **kwargs
+    ) -> str:
+        """
+        Отправить запрос с оптимальными параметрами
+        
+        Args:
+            question: Вопрос
+            image_paths: Список путей к изображениям (опционально)
+            stream: Читать ответ SSE потоком (TTFT/ITL в last_stream_stats)
+            on_token: Callback для каждого фрагмента текста при stream=True
+            deadline: Секунды на весь запрос; по истечении соединение
+                      закрывается и сервер прерывает генерацию (TimeoutError)
+            **kwargs: Переопределить параметры генерации
+                      (system и history - см. build_payload)
+        """
+        with trace_request(self.tracer, "ask", images=len(image_paths or []), stream=stream):
+            return self._ask(question, image_paths, stream, on_token, deadline, **kwargs)
+    
+    def _ask(
+        self,
+        question: str,
+        image_paths: Optional[List[str]],
+        stream: bool,
+        on_token: Optional[Callable[[str], None]],
+        deadline: Optional[float],
+        **kwargs
+    ) -> str:
+        payload = self.build_payload(question, image_paths, **kwargs)
+        
+        if self.hedge_urls or deadline is not None:
+            # Hedging и дедлайн работают через асинхронный потоковый запрос
+            def fetch() -> str:
+                client = self._async_client()
+                content, self.last_stream_stats = self._loop.run_until_complete(
+                    client.stream_completion(payload, on_token if stream else None, deadline)
+                )
+                return content
+            
+            if not stream and self.response_cache is not None and self.response_cache.applies(payload):
+                return self.response_cache.get_or_fetch(payload, fetch)
+            return fetch()
+        
+        if stream:
+            content, self.last_stream_stats = stream_chat_completion(
+                self.session,
+                f"{self.api_url}/v1/chat/completions",
+                payload,
+                on_token=on_token,
+                timeout=120,
+            )
+            return content
+        
+        def post() -> str:
+            body = encode_body(payload)
+            start = time.perf_counter()
+            response = self.session.post(
+                f"{self.api_url}/v1/chat/completions",
+                data=body,
+                headers=JSON_HEADERS,
+                timeout=120
+            )
+            # elapsed - до заголовков ответа; без потока они приходят после генерации
+            headers = start + response.elapsed.total_seconds()
+            add_span("send", start, headers, bytes=len(body))
+            
+            if response.status_code == 200:
+                content = response.json()["choices"][0]["message"]["content"]
+                add_span("response", headers, time.perf_counter())
+                return content
+            else:
+                raise APIError(response.status_code, response.text)
+        
+        # Запрос (детерминированный - через кэш ответов, если он включен)
+        if self.response_cache is not None and self.response_cache.applies(payload):
+            return self.response_cache.get_or_fetch(payload, post)
+        return post()
+    
+    def ask_many(
+        self,
+        jobs: Iterable[Dict[str, Any]],
+        max_concurrency: Optional[int] = None,
+        **kwargs
+    ) -> Iterator[AskResult]:
+        """
+        Синхронная обертка над AsyncQwen3VLClient.ask_many()
+        
+        Результаты отдаются по мере готовности (не в порядке jobs),
+        порядок восстанавливается по AskResult.index.
+        """
+        client = AsyncQwen3VLClient(
+            api_url=self.api_url,
+            max_concurrency=max_concurrency or self.max_concurrency,
+            preprocess=self.preprocess,
+            image_cache=self.image_cache or False,
         )
+        self._copy_settings(client)
         
-        if response.status_code == 200:
-            return response.json()["choices"][0]["message"]["content"]
-        else:
-            raise Exception(f"API Error: {response.status_code} - {response.text}")
+        loop = asyncio.new_event_loop()
+        results = client.ask_many(jobs, **kwargs)
+        try:
+            while True:
+                try:
+                    yield loop.run_until_complete(results.__anext__())
+                except StopAsyncIteration:
+                    break
+        finally:
+            loop.run_until_complete(results.aclose())
+            loop.run_until_complete(client.close())
+            loop.close()
+
+
+class AsyncQwen3VLClient(_Qwen3VLBase):
+    """
+    Асинхронный клиент с общим пулом keep-alive соединений
+    
+    Сервер запускается с --max-num-seqs 256, поэтому для batch задач
+    выгодно держать много запросов одновременно в полете.
+    """
+    
+    def __init__(
+        self,
+        api_url: str = "http://localhost:8000",
+        max_concurrency: int = 32,
+        timeout: float = 120,
+        preprocess: Optional[PreprocessOptions] = None,
+        image_cache: Union[ImageCache, bool] = True,
+        transport: Union[str, MediaTransport] = "data",
+        response_cache: Optional[ResponseCache] = None,
+        concurrency: Optional[AdaptiveConcurrency] = None,
+        hedge_urls: Optional[List[str]] = None,
+        hedge_delay: Optional[float] = None,
+        hedge_percentile: float = 95.0,
+    ):
+        super().__init__(
+            api_url, preprocess, image_cache, transport, response_cache,
+            hedge_urls, hedge_delay, hedge_percentile,
+        )
+        # AdaptiveConcurrency вместо фиксированного окна: max_concurrency
+        # становится верхней границей окна
+        self.concurrency = concurrency
+        self.max_concurrency = concurrency.max_limit if concurrency else max_concurrency
+        self.timeout = timeout
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._semaphore: Optional[Union[asyncio.Semaphore, AdaptiveConcurrency]] = None
+        self._metrics_task: Optional[asyncio.Task] = None
+    
+    async def __aenter__(self) -> "AsyncQwen3VLClient":
+        return self
+    
+    async def __aexit__(self, *exc) -> None:
+        await self.close()
+    
+    def _get_session(self) -> aiohttp.ClientSession:
+        """Лениво создать сессию (она привязана к текущему event loop)"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.max_concurrency,
+                keepalive_timeout=60,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                trace_configs=[aiohttp_trace_config()] if self.tracer else None,
+            )
+            if self.concurrency is not None:
+                self._semaphore = self.concurrency
+                self._metrics_task = asyncio.create_task(
+                    self.concurrency.poll_metrics(self._session, self.api_url)
+                )
+            else:
+                self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._session
+    
+    async def close(self) -> None:
+        if self._metrics_task is not None:
+            self._metrics_task.cancel()
+            self._metrics_task = None
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+    
+    @contextlib.asynccontextmanager
+    async def _slot(self):
+        """Слот в окне запросов; ошибки сообщаются AdaptiveConcurrency"""
+        async with self._semaphore:
+            try:
+                yield
+            except APIError as e:
+                if self.concurrency is not None:
+                    self.concurrency.on_error(e.status)
+                raise
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                if self.concurrency is not None:
+                    self.concurrency.on_error(None)
+                raise
+    
+    async def ask(
+        self,
+        question: str,
+        image_paths: Optional[List[str]] = None,
+        deadline: Optional[float] = None,
+        **kwargs
+    ) -> str:
+        """Асинхронный аналог Qwen3VLClient.ask()"""
+        with trace_request(self.tracer, "ask", images=len(image_paths or [])):
+            return await self._ask(question, image_paths, deadline, **kwargs)
+    
+    async def _ask(
+        self,
+        question: str,
+        image_paths: Optional[List[str]],
+        deadline: Optional[float],
+        **kwargs
+    ) -> str:
+        session = self._get_session()
+        # Чтение/подготовка изображений - CPU и диск, не блокируем event loop
+        payload = await asyncio.to_thread(
+            self.build_payload, question, image_paths, **kwargs
+        )
+        
+        async def post() -> str:
+            if self.hedge_urls or deadline is not None:
+                content, _ = await self.stream_completion(payload, deadline=deadline)
+                return content
+            body = encode_body(payload)
+            async with self._slot():
+                start = time.perf_counter()
+                async with session.post(
+                    f"{self.api_url}/v1/chat/completions",
+                    data=body,
+                    headers=JSON_HEADERS,
+                ) as response:
+                    add_span("send", start, time.perf_counter(), bytes=len(body))
+                    if response.status == 200:
+                        with span("response"):
+                            result = await response.json()
+                        # Без потока TTFT не измерить - окно растет по успехам
+                        if self.concurrency is not None:
+                            self.concurrency.on_success()
+                        return result["choices"][0]["message"]["content"]
+                    text = await response.text()
+                    raise APIError(response.status, text)
+        
+        # Попадания в кэш ответов не занимают слот семафора
+        if self.response_cache is not None and self.response_cache.applies(payload):
+            return await self.response_cache.aget_or_fetch(payload, post)
+        return await post()
+    
+    async def ask_stream(
+        self,
+        question: str,
+        image_paths: Optional[List[str]] = None,
+        on_token: Optional[Callable[[str], None]] = None,
+        deadline: Optional[float] = None,
+        **kwargs
+    ) -> tuple[str, StreamStats]:
+        """Потоковый запрос: ответ и статистика TTFT/ITL/tokens/s"""
+        with trace_request(self.tracer, "ask_stream", images=len(image_paths or [])):
+            # Чтение/подготовка изображений - CPU и диск, не блокируем event loop
+            payload = await asyncio.to_thread(
+                self.build_payload, question, image_paths, **kwargs
+            )
+            return await self.stream_completion(payload, on_token, deadline)
+    
+    async def stream_completion(
+        self,
+        payload: dict,
+        on_token: Optional[Callable[[str], None]] = None,
+        deadline: Optional[float] = None,
+    ) -> tuple[str, StreamStats]:
+        """
+        Потоковый запрос с готовым payload
+        
+        С hedge_urls: если первого токена нет дольше current_hedge_delay(),
+        тот же запрос уходит на следующий endpoint; побеждает первый начавший
+        отвечать, остальные потоки закрываются (сервер прерывает их генерацию).
+        deadline - секунды на весь запрос, по истечении соединения тоже
+        закрываются и поднимается TimeoutError.
+        """
+        session = self._get_session()
+        urls = [self.api_url, *self.hedge_urls]
+        
+        async def attempt(index: int, claim: Callable[[], bool]) -> tuple[str, StreamStats]:
+            def forward(text: str) -> None:
+                if not claim():
+                    raise HedgeLost()
+                if on_token:
+                    on_token(text)
+            
+            async with self._slot():
+                content, stats = await astream_chat_completion(
+                    session,
+                    f"{urls[index]}/v1/chat/completions",
+                    payload,
+                    on_token=forward,
+                )
+                if self.concurrency is not None:
+                    self.concurrency.on_success(stats.ttft)
+                return content, stats
+        
+        scope = asyncio.timeout(deadline)
+        try:
+            async with scope:
+                (content, stats), _ = await hedged_race(
+                    attempt, len(urls), self.current_hedge_delay()
+                )
+        except TimeoutError:
+            if scope.expired():
+                raise TimeoutError(
+                    f"Дедлайн {deadline} s истек, запрос на сервере прерван"
+                ) from None
+            raise
+        
+        if stats.ttft is not None:
+            self.ttft_tracker.record(stats.ttft)
+        return content, stats
+    
+    async def _run_job(self, index: int, job: Dict[str, Any], **kwargs) -> AskResult:
+        params = {
+            **kwargs,
+            **{k: v for k, v in job.items() if k not in ("question", "image_paths")},
+        }
+        stream = params.pop("stream", False)
+        start = time.perf_counter()
+        try:
+            stats = None
+            if stream:
+                content, stats = await self.ask_stream(
+                    job["question"], job.get("image_paths"), **params
+                )
+            else:
+                content = await self.ask(
+                    job["question"], job.get("image_paths"), **params
+                )
+            return AskResult(index, job, content=content,
+                             latency=time.perf_counter() - start, stats=stats)
+        except Exception as e:
+            return AskResult(index, job, error=e,
+                             latency=time.perf_counter() - start)
+    
+    async def ask_many(
+        self,
+        jobs: Iterable[Dict[str, Any]],
+        **kwargs
+    ) -> AsyncIterator[AskResult]:
+        """
+        Выполнить много запросов параллельно, отдавая результаты по мере готовности
+        
+        Args:
+            jobs: Задачи вида {"question": ..., "image_paths": [...], **params}.
+                  Параметры задачи переопределяют kwargs, а те - default_params;
+                  "system" и "history" попадают в сообщения (см. build_payload).
+            **kwargs: Общие параметры генерации для всех задач
+                      (stream=True заполняет AskResult.stats)
+        
+        Одновременно в полете не больше max_concurrency запросов; jobs
+        читаются лениво, так что можно передавать генератор на миллионы задач.
+        """
+        self._get_session()
+        pending = set()
+        job_iter = enumerate(jobs)
+        exhausted = False
+        
+        try:
+            while True:
+                while not exhausted and len(pending) < self.max_concurrency:
+                    try:
+                        index, job = next(job_iter)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    pending.add(asyncio.ensure_future(
+                        self._run_job(index, job, **kwargs)
+                    ))
+                
+                if not pending:
+                    break
+                
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    yield task.result()
+        finally:
+            for task in pending:
+                task.cancel()
 
 # CLI интерфейс
 if __name__ == "__main__":
@@ -150,10 +709,58 @@ if __name__ == "__main__":
         help="Max tokens (по умолчанию: 500)"
     )
     
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Печатать ответ по мере генерации и показать TTFT/ITL/tokens/s"
+    )
+    
+    add_preprocess_arguments(parser)
+    add_cache_arguments(parser)
+    add_transport_arguments(parser)
+    add_response_cache_arguments(parser)
+    add_preflight_arguments(parser)
+    add_tracing_arguments(parser)
+    
+    parser.add_argument(
+        "--hedge-url",
+        action="append",
+        default=[],
+        help="Дополнительный endpoint для hedging (можно указать несколько раз): "
+             "если первого токена нет дольше --hedge-delay, запрос дублируется туда"
+    )
+    
+    parser.add_argument(
+        "--hedge-delay",
+        type=float,
+        help="Задержка перед дублем, секунды (по умолчанию: p95 недавних TTFT, "
+             "пока статистики нет - 2.0)"
+    )
+    
+    parser.add_argument(
+        "--deadline",
+        type=float,
+        help="Дедлайн запроса, секунды: по истечении запрос прерывается и на сервере"
+    )
+    
     args = parser.parse_args()
     
     # Создаем клиент
-    client = Qwen3VLClient(api_url=args.api_url)
+    image_cache = cache_from_args(args)
+    client = Qwen3VLClient(
+        api_url=args.api_url,
+        preprocess=options_from_args(args),
+        image_cache=image_cache or False,
+        transport=MediaTransport(
+            args.transport, args.api_url, image_cache, http_port=args.media_port
+        ),
+        response_cache=response_cache_from_args(args),
+        hedge_urls=args.hedge_url,
+        hedge_delay=args.hedge_delay,
+    )
+    client.on_preprocess = print_report
+    client.preflight = preflight_from_args(args)
+    client.tracer = tracer_from_args(args)
     
     # Параметры
     params = {
@@ -179,18 +786,54 @@ if __name__ == "__main__":
     
     # Отправляем запрос
     try:
-        result = client.ask(
-            question=args.question,
-            image_paths=args.images,
-            **params
-        )
+        if args.stream:
+            print("=" * 80)
+            print("💬 ОТВЕТ")
+            print("=" * 80)
+            print()
+            client.ask(
+                question=args.question,
+                image_paths=args.images,
+                stream=True,
+                on_token=lambda text: print(text, end="", flush=True),
+                deadline=args.deadline,
+                **params
+            )
+            print()
+            print()
+            print(client.last_stream_stats.format_report())
+            print()
+            if client.image_cache and client.image_cache.stats.requests:
+                print(client.image_cache.stats.format_report())
+                print()
+        else:
+            result = client.ask(
+                question=args.question,
+                image_paths=args.images,
+                deadline=args.deadline,
+                **params
+            )
+            
+            print("=" * 80)
+            print("💬 ОТВЕТ")
+            print("=" * 80)
+            print()
+            print(result)
+            print()
+            if client.image_cache and client.image_cache.stats.requests:
+                print(client.image_cache.stats.format_report())
+                print()
+            if client.response_cache and client.response_cache.stats.requests:
+                print(client.response_cache.stats.format_report())
+                print()
+        
+        if client.last_preflight is not None:
+            print(client.last_preflight.format_report())
+            print()
         
-        print("=" * 80)
-        print("💬 ОТВЕТ")
-        print("=" * 80)
-        print()
-        print(result)
-        print()
+        if client.tracer is not None:
+            print(f"🔎 Trace: {args.trace} (python client_tracing.py summary {args.trace})")
+            print()
         
     except Exception as e:
         print(f"❌ Ошибка: {e}")
\ No newline at end of file
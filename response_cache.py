@@ -0,0 +1,422 @@
+#!/usr/bin/env python3
+"""
+Кэш ответов для детерминированных запросов (SQLite, TTL, лимит размера)
+
+Ключ - канонический JSON запроса: модель, сообщения (изображения - хэшем
+содержимого), параметры генерации. Все лаунчеры отдают модель под именем
+vllm-model, поэтому в ключ входят и настоящая модель (root из /v1/models),
+и версия vLLM сервера - их кэш узнает один раз при первом запросе. Кэш используется только если ответ
+воспроизводим (temperature 0 или top_k 1) либо это явно разрешено.
+Одинаковые запросы, отправленные одновременно, сливаются в один запрос
+к серверу.
+"""
+
+import argparse
+import asyncio
+import hashlib
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Optional
+from urllib.parse import unquote, urlparse
+
+from image_cache import ImageCache
+from prefix_scheduler import canonical_json
+
+DEFAULT_CACHE_PATH = Path.home() / ".cache" / "vllm-setup" / "responses.sqlite"
+
+# Повтор запроса модели/версии, если сервер не ответил, секунд
+SERVER_RETRY_SECONDS = 30.0
+
+# Поля, не влияющие на текст ответа. "model" остается в ключе, но это
+# лишь псевдоним: модель различает server (см. request_key)
+IGNORED_FIELDS = ("stream", "stream_options", "user")
+
+
+@dataclass
+class ResponseCacheStats:
+    """Счетчики кэша ответов"""
+    hits: int = 0
+    misses: int = 0
+    coalesced: int = 0
+    evictions: int = 0
+
+    @property
+    def requests(self) -> int:
+        return self.hits + self.misses + self.coalesced
+
+    def format_report(self) -> str:
+        saved = self.hits + self.coalesced
+        rate = saved / self.requests if self.requests else 0.0
+        return (
+            f"💾 Кэш ответов: {rate * 100:.0f}% без обращения к серверу "
+            f"(попаданий: {self.hits}, слито одновременных: {self.coalesced}, "
+            f"промахов: {self.misses}), вытеснено {self.evictions}"
+        )
+
+
+def is_deterministic(payload: Dict[str, Any]) -> bool:
+    """
+    Воспроизводим ли ответ на запрос
+
+    Без temperature в запросе сервер берет свою (generation_config модели),
+    поэтому такой запрос детерминированным не считается.
+    """
+    if payload.get("n", 1) != 1:
+        return False
+    return payload.get("temperature") == 0 or payload.get("top_k") == 1
+
+
+def _image_identity(url: str, hasher: ImageCache) -> str:
+    """Хэш вместо мегабайтного data URI; для file:// - хэш содержимого файла"""
+    if url.startswith("data:"):
+        return "sha256:" + hashlib.sha256(url.encode("ascii", "replace")).hexdigest()
+    if url.startswith("file://"):
+        try:
+            return "file-sha256:" + hasher.content_hash(unquote(urlparse(url).path))
+        except OSError:
+            return url
+    # http URL из media_transport уже содержат хэш содержимого в имени
+    return url
+
+
+def request_key(
+    payload: Dict[str, Any],
+    hasher: Optional[ImageCache] = None,
+    server: Optional[Dict[str, Optional[str]]] = None,
+) -> str:
+    """
+    Ключ кэша: SHA-256 канонического JSON запроса
+
+    server - {"model_id", "vllm"} сервера (server_info.server_info()): без него
+    ответы разных моделей под одним served name получили бы один ключ.
+    """
+    hasher = hasher or ImageCache(cache_dir=None, memory_items=0)
+    messages = []
+    for message in payload.get("messages", []):
+        content = message.get("content")
+        if isinstance(content, list):
+            parts = []
+            for part in content:
+                if part.get("type") == "image_url":
+                    url = part["image_url"]["url"]
+                    part = {"type": "image_url", "image": _image_identity(url, hasher)}
+                parts.append(part)
+            message = {**message, "content": parts}
+        messages.append(message)
+
+    canonical = {k: v for k, v in payload.items() if k not in IGNORED_FIELDS}
+    canonical["messages"] = messages
+    if server is not None:
+        canonical["server"] = server
+    return hashlib.sha256(canonical_json(canonical).encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Ответы модели в SQLite
+
+    - ttl: запись старше ttl секунд считается промахом (None - бессрочно)
+    - max_bytes: при превышении удаляются записи с самым старым доступом
+    """
+
+    def __init__(
+        self,
+        path: Path = DEFAULT_CACHE_PATH,
+        ttl: Optional[float] = 7 * 24 * 3600,
+        max_bytes: int = 256 * 1024**2,
+        allow_nondeterministic: bool = False,
+        api_url: Optional[str] = None,
+    ):
+        self.path = Path(path)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        # True - кэшировать и запросы с temperature > 0 (eval с фиксированным ответом)
+        self.allow_nondeterministic = allow_nondeterministic
+        self.stats = ResponseCacheStats()
+        self._hasher = ImageCache(cache_dir=None, memory_items=0)
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, Future] = {}
+        self._ainflight: Dict[str, asyncio.Future] = {}
+        # Сервер, чья модель входит в ключ (клиент задает через bind())
+        self.api_url = api_url
+        self._server: Optional[Dict[str, Optional[str]]] = None
+        self._server_failed = float("-inf")
+        self._server_lock = threading.Lock()
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY, response TEXT NOT NULL,"
+            " created REAL NOT NULL, accessed REAL NOT NULL, size INTEGER NOT NULL)"
+        )
+        self._db.commit()
+
+    def applies(self, payload: Dict[str, Any]) -> bool:
+        """Можно ли отвечать на этот запрос из кэша"""
+        if payload.get("stream"):
+            return False
+        return self.allow_nondeterministic or is_deterministic(payload)
+
+    def bind(self, api_url: str) -> None:
+        """Сервер для ключей (вызывает клиент; уже заданный не меняется)"""
+        if self.api_url is None:
+            self.api_url = api_url
+
+    def _server_pending(self) -> bool:
+        """Нужно ли (еще раз) спрашивать сервер о модели"""
+        return (
+            self._server is None and self.api_url is not None
+            and time.monotonic() - self._server_failed >= SERVER_RETRY_SECONDS
+        )
+
+    def server(self) -> Optional[Dict[str, Optional[str]]]:
+        """
+        Модель и версия vLLM сервера: запрашиваются один раз, неудача
+        запоминается на SERVER_RETRY_SECONDS (блокирующие HTTP запросы -
+        из асинхронного кода только через aserver())
+        """
+        if not self._server_pending():
+            return self._server
+        from server_info import server_info
+
+        with self._server_lock:
+            if self._server_pending():
+                info = server_info(self.api_url)
+                if info["model_id"] is not None:
+                    self._server = info
+                else:
+                    self._server_failed = time.monotonic()
+        return self._server
+
+    async def aserver(self) -> Optional[Dict[str, Optional[str]]]:
+        """server() в потоке, не блокируя event loop"""
+        if not self._server_pending():
+            return self._server
+        return await asyncio.to_thread(self.server)
+
+    def _key(self, payload: Dict[str, Any], server: Optional[Dict[str, Optional[str]]]) -> Optional[str]:
+        if server is None and self.api_url is not None:
+            # Модель неизвестна: без нее ключ мог бы совпасть с ответом другой модели
+            return None
+        return request_key(payload, self._hasher, server)
+
+    def key(self, payload: Dict[str, Any]) -> Optional[str]:
+        """Ключ запроса (None - модель сервера неизвестна, кэш не используется)"""
+        return self._key(payload, self.server())
+
+    async def akey(self, payload: Dict[str, Any]) -> Optional[str]:
+        return self._key(payload, await self.aserver())
+
+    # --- хранилище ---
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT response, created FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            response, created = row
+            if self.ttl is not None and now - created > self.ttl:
+                self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._db.commit()
+                return None
+            self._db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self._db.commit()
+            return response
+
+    def put(self, key: str, response: str) -> None:
+        now = time.time()
+        size = len(response.encode("utf-8"))
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                (key, response, now, now, size),
+            )
+            self._evict_locked()
+            self._db.commit()
+
+    def _evict_locked(self) -> None:
+        if self.ttl is not None:
+            cursor = self._db.execute(
+                "DELETE FROM responses WHERE created < ?", (time.time() - self.ttl,)
+            )
+            self.stats.evictions += cursor.rowcount
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self._db.execute("SELECT key, size FROM responses ORDER BY accessed").fetchall()
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+            self.stats.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._db.execute("DELETE FROM responses")
+            self._db.commit()
+
+    def close(self) -> None:
+        self._db.close()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    # --- запрос через кэш ---
+
+    def get_or_fetch(self, payload: Dict[str, Any], fetch: Callable[[], str]) -> str:
+        """
+        Ответ из кэша или fetch() (синхронный клиент, в т.ч. из нескольких потоков)
+
+        Пока один поток выполняет запрос, остальные с тем же ключом ждут его
+        результат; ошибка не кэшируется и передается всем ожидающим.
+        """
+        key = self.key(payload)
+        if key is None:
+            self.stats.misses += 1
+            return fetch()
+        cached = self.get(key)
+        if cached is not None:
+            self.stats.hits += 1
+            return cached
+
+        with self._lock:
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self._inflight[key] = Future()
+        if not owner:
+            self.stats.coalesced += 1
+            return future.result()
+
+        self.stats.misses += 1
+        try:
+            response = fetch()
+            self.put(key, response)
+            future.set_result(response)
+            return response
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+
+    async def aget_or_fetch(
+        self, payload: Dict[str, Any], fetch: Callable[[], Awaitable[str]]
+    ) -> str:
+        """Асинхронный аналог get_or_fetch() для одного event loop"""
+        key = await self.akey(payload)
+        if key is None:
+            self.stats.misses += 1
+            return await fetch()
+        cached = self.get(key)
+        if cached is not None:
+            self.stats.hits += 1
+            return cached
+
+        future = self._ainflight.get(key)
+        if future is not None:
+            self.stats.coalesced += 1
+            # shield: отмена одного ожидающего не отменяет общий запрос
+            return await asyncio.shield(future)
+
+        self.stats.misses += 1
+        future = self._ainflight[key] = asyncio.get_running_loop().create_future()
+        try:
+            response = await fetch()
+            self.put(key, response)
+            future.set_result(response)
+            return response
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Исключение уже передано владельцу; без ожидающих не логировать
+            future.exception()
+            raise
+        finally:
+            del self._ainflight[key]
+
+
+def add_response_cache_arguments(parser) -> None:
+    """Общие флаги кэша ответов для CLI"""
+    parser.add_argument(
+        "--response-cache",
+        action="store_true",
+        help="Кэшировать ответы детерминированных запросов (temperature 0 / top_k 1)"
+    )
+
+    parser.add_argument(
+        "--response-cache-path",
+        default=str(DEFAULT_CACHE_PATH),
+        help=f"SQLite файл кэша ответов (по умолчанию: {DEFAULT_CACHE_PATH})"
+    )
+
+    parser.add_argument(
+        "--response-cache-ttl",
+        type=float,
+        default=7 * 24,
+        help="Срок жизни записи в часах (по умолчанию: 168)"
+    )
+
+    parser.add_argument(
+        "--cache-any-temperature",
+        action="store_true",
+        help="Кэшировать ответы и при temperature > 0"
+    )
+
+
+def response_cache_from_args(args) -> Optional[ResponseCache]:
+    """ResponseCache из флагов add_response_cache_arguments() (None если выключен)"""
+    if not args.response_cache:
+        return None
+    return ResponseCache(
+        path=Path(args.response_cache_path),
+        ttl=args.response_cache_ttl * 3600,
+        allow_nondeterministic=args.cache_any_temperature,
+        api_url=getattr(args, "api_url", None),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Управление кэшем ответов")
+
+    parser.add_argument(
+        "--path",
+        default=str(DEFAULT_CACHE_PATH),
+        help=f"SQLite файл кэша (по умолчанию: {DEFAULT_CACHE_PATH})"
+    )
+
+    parser.add_argument(
+        "--clear",
+        action="store_true",
+        help="Удалить все записи"
+    )
+
+    args = parser.parse_args()
+
+    cache = ResponseCache(path=Path(args.path))
+    if args.clear:
+        cache.clear()
+        print(f"🗑️  Кэш ответов очищен: {args.path}")
+    else:
+        print(f"💾 {args.path}: {len(cache)} записей, "
+              f"{cache.path.stat().st_size / 1024**2:.1f} MB")
+    cache.close()
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Что известно о запущенном сервере
+
+- описание запуска от vllm_server.py (модель, профиль, аргументы,
+  --allowed-local-media-path) в ~/.cache/vllm-setup/launches/<порт>.json
+- модель (/v1/models) и версия vLLM (/version) от самого сервера
+
+Общий модуль для клиентов (media_transport, response_cache) и
+бенчмарков (bench_store), чтобы они не зависели друг от друга.
+"""
+
+import ipaddress
+import json
+import os
+import socket
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+from urllib.parse import urlparse
+
+# Описание запущенного сервера от vllm_server.py: <порт>.json
+LAUNCH_DIR = Path.home() / ".cache" / "vllm-setup" / "launches"
+
+# Spool директория клиентов (media_transport): vllm_server.py по умолчанию
+# разрешает серверу читать из нее по file:// URL
+MEDIA_SPOOL_DIR = Path.home() / ".cache" / "vllm-setup" / "media"
+
+
+def is_colocated(api_url: str) -> bool:
+    """Запущен ли сервер на этой же машине (loopback или один из локальных адресов)"""
+    host = urlparse(api_url).hostname or "localhost"
+    if host == "localhost":
+        return True
+    try:
+        address = socket.gethostbyname(host)
+    except OSError:
+        return False
+    if ipaddress.ip_address(address).is_loopback:
+        return True
+    try:
+        local = socket.gethostbyname_ex(socket.gethostname())[2]
+    except OSError:
+        local = []
+    return address in local
+
+
+def write_launch_info(port: int, info: Dict[str, Any]) -> Path:
+    """Описание запущенного сервера (вызывает vllm_server.py)"""
+    LAUNCH_DIR.mkdir(parents=True, exist_ok=True)
+    path = LAUNCH_DIR / f"{port}.json"
+    path.write_text(json.dumps({**info, "pid": os.getpid(), "started": time.time()},
+                               ensure_ascii=False, indent=2), encoding="utf-8")
+    return path
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def read_launch_info(api_url: str) -> Optional[Dict[str, Any]]:
+    """Описание сервера на этом порту, если его лаунчер еще работает"""
+    if not is_colocated(api_url):
+        return None
+    port = urlparse(api_url).port or 80
+    try:
+        info = json.loads((LAUNCH_DIR / f"{port}.json").read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+    return info if _pid_alive(info.get("pid", -1)) else None
+
+
+def server_info(api_url: str) -> Dict[str, Optional[str]]:
+    """Модель (/v1/models) и версия vLLM (/version) запущенного сервера"""
+    # requests не нужен лаунчеру, которому хватает описания запуска
+    import requests
+
+    info: Dict[str, Optional[str]] = {"model_id": None, "vllm": None}
+    try:
+        models = requests.get(f"{api_url}/v1/models", timeout=5).json().get("data") or []
+        if models:
+            info["model_id"] = models[0].get("root") or models[0].get("id")
+    except (requests.RequestException, ValueError):
+        pass
+    try:
+        info["vllm"] = requests.get(f"{api_url}/version", timeout=5).json().get("version")
+    except (requests.RequestException, ValueError, AttributeError):
+        pass
+    return info
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Чтение /metrics vLLM (Prometheus text format)
+
+Парсер без зависимостей: только строки `name{labels} value`, комментарии
+и TYPE/HELP пропускаются. Значения с одинаковым именем и разными labels
+(например, по model_name) суммируются.
+"""
+
+import math
+import re
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from streaming import APIError
+
+# Основные метрики vLLM
+RUNNING = "vllm:num_requests_running"
+WAITING = "vllm:num_requests_waiting"
+# Старые версии vLLM называли метрику gpu_cache_usage_perc
+KV_CACHE_USAGE = ("vllm:kv_cache_usage_perc", "vllm:gpu_cache_usage_perc")
+
+_SAMPLE_RE = re.compile(r"^([a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{(.*)\})?\s+(\S+)")
+_LABEL_RE = re.compile(r'([a-zA-Z_][a-zA-Z0-9_]*)="((?:[^"\\]|\\.)*)"')
+
+
+@dataclass
+class Sample:
+    name: str
+    labels: Dict[str, str]
+    value: float
+
+
+def _parse_value(text: str) -> float:
+    if text in ("+Inf", "Inf"):
+        return math.inf
+    if text == "-Inf":
+        return -math.inf
+    return float(text)
+
+
+def parse_prometheus(text: str) -> List[Sample]:
+    """Разобрать текст /metrics в список отсчетов"""
+    samples = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        match = _SAMPLE_RE.match(line)
+        if not match:
+            continue
+        name, labels, value = match.groups()
+        try:
+            parsed = _parse_value(value)
+        except ValueError:
+            continue
+        samples.append(Sample(name, dict(_LABEL_RE.findall(labels or "")), parsed))
+    return samples
+
+
+@dataclass
+class MetricsSnapshot:
+    """Отсчеты /metrics на момент timestamp"""
+    samples: List[Sample]
+    timestamp: float = field(default_factory=time.time)
+
+    def value(self, *names: str) -> Optional[float]:
+        """Сумма отсчетов первой найденной метрики из names (None если нет ни одной)"""
+        for name in names:
+            values = [s.value for s in self.samples if s.name == name]
+            if values:
+                return sum(values)
+        return None
+
+    def histogram(self, name: str) -> List[Tuple[float, float]]:
+        """Кумулятивные бакеты гистограммы [(le, count)], суммированные по labels"""
+        buckets: Dict[float, float] = {}
+        for s in self.samples:
+            if s.name == f"{name}_bucket" and "le" in s.labels:
+                le = _parse_value(s.labels["le"])
+                buckets[le] = buckets.get(le, 0.0) + s.value
+        return sorted(buckets.items())
+
+    @property
+    def running(self) -> Optional[float]:
+        return self.value(RUNNING)
+
+    @property
+    def waiting(self) -> Optional[float]:
+        return self.value(WAITING)
+
+    @property
+    def kv_cache_usage(self) -> Optional[float]:
+        """Доля занятого KV cache, 0..1"""
+        return self.value(*KV_CACHE_USAGE)
+
+
+def parse_snapshot(text: str) -> MetricsSnapshot:
+    return MetricsSnapshot(parse_prometheus(text))
+
+
+def fetch_metrics(session, api_url: str, timeout: float = 5) -> MetricsSnapshot:
+    """Снять /metrics через requests.Session (или модуль requests)"""
+    response = session.get(f"{api_url}/metrics", timeout=timeout)
+    if response.status_code != 200:
+        raise APIError(response.status_code, response.text)
+    return parse_snapshot(response.text)
+
+
+async def afetch_metrics(session, api_url: str) -> MetricsSnapshot:
+    """Асинхронный аналог fetch_metrics() для aiohttp.ClientSession"""
+    async with session.get(f"{api_url}/metrics") as response:
+        text = await response.text()
+        if response.status != 200:
+            raise APIError(response.status, text)
+    return parse_snapshot(text)
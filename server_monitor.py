@@ -0,0 +1,397 @@
+#!/usr/bin/env python3
+"""
+Мониторинг vLLM сервера по /metrics: top-подобный экран и запись в JSON/CSV
+
+Счетчики превращаются в скорости (токены/с, запросы/с, preemptions/с),
+гистограммы - в перцентили за скользящее окно (разность бакетов между
+первым и последним снимком окна, как histogram_quantile в Prometheus).
+Насыщение помечается флагами: KV cache выше 95%, растущая очередь,
+preemptions.
+
+Сырые снимки можно записать (--raw) и потом прогнать через ту же агрегацию
+(replay) - так агрегация проверяется на записанных данных.
+
+Запуск:
+    python server_monitor.py --api-url http://localhost:8000
+    python server_monitor.py record --output metrics.csv --raw raw.jsonl
+    python server_monitor.py replay raw.jsonl --output metrics.jsonl
+"""
+
+import argparse
+import csv
+import json
+import math
+import sys
+import time
+from collections import deque
+from dataclasses import asdict, dataclass, field, fields
+from typing import Deque, Iterable, Iterator, List, Optional, Tuple
+
+import requests
+
+from server_metrics import KV_CACHE_USAGE, RUNNING, WAITING, MetricsSnapshot, parse_prometheus
+
+# Счетчики (старые имена vLLM - вторыми)
+PROMPT_TOKENS = ("vllm:prompt_tokens_total",)
+GENERATION_TOKENS = ("vllm:generation_tokens_total",)
+REQUEST_SUCCESS = ("vllm:request_success_total",)
+PREEMPTIONS = ("vllm:num_preemptions_total", "vllm:num_preemptions")
+PREFIX_CACHE_QUERIES = ("vllm:prefix_cache_queries_total", "vllm:prefix_cache_queries")
+PREFIX_CACHE_HITS = ("vllm:prefix_cache_hits_total", "vllm:prefix_cache_hits")
+# Гистограммы
+TTFT = ("vllm:time_to_first_token_seconds",)
+ITL = ("vllm:inter_token_latency_seconds", "vllm:time_per_output_token_seconds")
+E2E = ("vllm:e2e_request_latency_seconds",)
+QUEUE_TIME = ("vllm:request_queue_time_seconds",)
+
+# Пороги насыщения
+KV_SATURATION = 0.95
+# Очередь считается растущей, если росла столько снимков подряд
+QUEUE_GROWTH_SAMPLES = 3
+
+
+@dataclass
+class MonitorSample:
+    """Агрегаты на момент снимка (скорости и перцентили - за окно)"""
+    timestamp: float
+    running: Optional[float] = None
+    waiting: Optional[float] = None
+    kv_cache_usage: Optional[float] = None
+    prompt_tps: Optional[float] = None
+    generation_tps: Optional[float] = None
+    requests_per_s: Optional[float] = None
+    preemptions_per_s: Optional[float] = None
+    prefix_cache_hit_rate: Optional[float] = None
+    ttft_p50: Optional[float] = None
+    ttft_p95: Optional[float] = None
+    itl_p50: Optional[float] = None
+    itl_p95: Optional[float] = None
+    e2e_p50: Optional[float] = None
+    e2e_p95: Optional[float] = None
+    queue_p95: Optional[float] = None
+    flags: List[str] = field(default_factory=list)
+
+
+CSV_FIELDS = [f.name for f in fields(MonitorSample)]
+
+
+def histogram_quantile(q: float, buckets: List[Tuple[float, float]]) -> Optional[float]:
+    """
+    Перцентиль по кумулятивным бакетам [(le, count)] с линейной
+    интерполяцией внутри бакета (None если наблюдений нет)
+    """
+    if not buckets or buckets[-1][1] <= 0:
+        return None
+    rank = q * buckets[-1][1]
+    prev_le, prev_count = 0.0, 0.0
+    for le, count in buckets:
+        if count >= rank:
+            if math.isinf(le):
+                return prev_le
+            if count == prev_count:
+                return le
+            return prev_le + (le - prev_le) * (rank - prev_count) / (count - prev_count)
+        prev_le, prev_count = le, count
+    return prev_le
+
+
+def _histogram(snapshot: MetricsSnapshot, names: Tuple[str, ...]) -> List[Tuple[float, float]]:
+    for name in names:
+        buckets = snapshot.histogram(name)
+        if buckets:
+            return buckets
+    return []
+
+
+def window_histogram(
+    old: MetricsSnapshot, new: MetricsSnapshot, names: Tuple[str, ...]
+) -> List[Tuple[float, float]]:
+    """Бакеты наблюдений, попавших между двумя снимками"""
+    current = _histogram(new, names)
+    before = dict(_histogram(old, names))
+    diff = [(le, count - before.get(le, 0.0)) for le, count in current]
+    # Сервер перезапустился - счетчики обнулились
+    if any(count < 0 for _, count in diff):
+        return current
+    return diff
+
+
+def counter_rate(old: MetricsSnapshot, new: MetricsSnapshot, names: Tuple[str, ...]) -> Optional[float]:
+    """Скорость счетчика между снимками (с учетом сброса при перезапуске)"""
+    before, after = old.value(*names), new.value(*names)
+    elapsed = new.timestamp - old.timestamp
+    if before is None or after is None or elapsed <= 0:
+        return None
+    delta = after - before if after >= before else after
+    return delta / elapsed
+
+
+class MetricsAggregator:
+    """
+    Скользящее окно снимков /metrics -> MonitorSample
+
+    Args:
+        window: Длина окна для скоростей и перцентилей, секунды
+    """
+
+    def __init__(self, window: float = 60.0):
+        self.window = window
+        self.snapshots: Deque[MetricsSnapshot] = deque()
+        self._waiting_growth = 0
+
+    def update(self, snapshot: MetricsSnapshot) -> MonitorSample:
+        previous = self.snapshots[-1] if self.snapshots else None
+        self.snapshots.append(snapshot)
+        # Первый снимок окна - самый старый не старше window (но не текущий)
+        while len(self.snapshots) > 2 and snapshot.timestamp - self.snapshots[1].timestamp >= self.window:
+            self.snapshots.popleft()
+        first = self.snapshots[0]
+
+        sample = MonitorSample(
+            timestamp=snapshot.timestamp,
+            running=snapshot.value(RUNNING),
+            waiting=snapshot.value(WAITING),
+            kv_cache_usage=snapshot.value(*KV_CACHE_USAGE),
+        )
+
+        if first is not snapshot:
+            sample.prompt_tps = counter_rate(first, snapshot, PROMPT_TOKENS)
+            sample.generation_tps = counter_rate(first, snapshot, GENERATION_TOKENS)
+            sample.requests_per_s = counter_rate(first, snapshot, REQUEST_SUCCESS)
+            sample.preemptions_per_s = counter_rate(first, snapshot, PREEMPTIONS)
+
+            queries = counter_rate(first, snapshot, PREFIX_CACHE_QUERIES)
+            hits = counter_rate(first, snapshot, PREFIX_CACHE_HITS)
+            if queries and hits is not None:
+                sample.prefix_cache_hit_rate = hits / queries
+
+            for prefix, names in (("ttft", TTFT), ("itl", ITL), ("e2e", E2E)):
+                buckets = window_histogram(first, snapshot, names)
+                setattr(sample, f"{prefix}_p50", histogram_quantile(0.5, buckets))
+                setattr(sample, f"{prefix}_p95", histogram_quantile(0.95, buckets))
+            sample.queue_p95 = histogram_quantile(0.95, window_histogram(first, snapshot, QUEUE_TIME))
+
+        # Очередь растет несколько снимков подряд
+        if previous is not None and sample.waiting is not None:
+            before = previous.value(WAITING) or 0.0
+            self._waiting_growth = self._waiting_growth + 1 if sample.waiting > before else 0
+
+        if sample.kv_cache_usage is not None and sample.kv_cache_usage > KV_SATURATION:
+            sample.flags.append("kv_cache_full")
+        if self._waiting_growth >= QUEUE_GROWTH_SAMPLES:
+            sample.flags.append("queue_growing")
+        if sample.preemptions_per_s:
+            sample.flags.append("preemptions")
+        return sample
+
+
+# --- источники снимков ---
+
+def poll_snapshots(api_url: str, interval: float, duration: Optional[float] = None) -> Iterator[Tuple[str, MetricsSnapshot]]:
+    """(сырой текст, снимок) каждые interval секунд"""
+    session = requests.Session()
+    deadline = time.monotonic() + duration if duration else None
+    while deadline is None or time.monotonic() < deadline:
+        started = time.monotonic()
+        try:
+            response = session.get(f"{api_url}/metrics", timeout=5)
+            response.raise_for_status()
+            yield response.text, MetricsSnapshot(parse_prometheus(response.text))
+        except requests.RequestException as e:
+            print(f"⚠️  /metrics: {e}", file=sys.stderr)
+        time.sleep(max(0.0, interval - (time.monotonic() - started)))
+
+
+def read_raw(path: str) -> Iterator[Tuple[str, MetricsSnapshot]]:
+    """Снимки из записи --raw: JSONL {"timestamp", "text"}"""
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                yield record["text"], MetricsSnapshot(parse_prometheus(record["text"]), record["timestamp"])
+
+
+# --- вывод ---
+
+class SampleWriter:
+    """Запись MonitorSample в CSV или JSONL (по расширению)"""
+
+    def __init__(self, path: str):
+        self.file = open(path, "w", encoding="utf-8", newline="")
+        self.csv = None
+        if path.endswith(".csv"):
+            self.csv = csv.DictWriter(self.file, fieldnames=CSV_FIELDS)
+            self.csv.writeheader()
+
+    def write(self, sample: MonitorSample) -> None:
+        data = asdict(sample)
+        if self.csv:
+            data["flags"] = ",".join(sample.flags)
+            self.csv.writerow(data)
+        else:
+            self.file.write(json.dumps(data, ensure_ascii=False) + "\n")
+        self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
+
+
+def _fmt(value: Optional[float], spec: str = ".1f", scale: float = 1.0, unit: str = "") -> str:
+    return "-" if value is None else f"{value * scale:{spec}}{unit}"
+
+
+def _bar(fraction: Optional[float], width: int = 30) -> str:
+    if fraction is None:
+        return ""
+    filled = round(min(1.0, max(0.0, fraction)) * width)
+    return "█" * filled + "·" * (width - filled)
+
+
+FLAG_TEXT = {
+    "kv_cache_full": f"KV cache > {KV_SATURATION:.0%}: новые запросы ждут или вытесняют текущие",
+    "queue_growing": "очередь растет: сервер не успевает (уменьшите нагрузку или --max-num-seqs)",
+    "preemptions": "preemptions: запросы вытесняются из KV cache и пересчитываются",
+}
+
+
+def render(sample: MonitorSample, api_url: str, window: float) -> str:
+    """Экран top-режима"""
+    lines = [
+        f"📈 vLLM monitor  {api_url}  {time.strftime('%H:%M:%S', time.localtime(sample.timestamp))}  "
+        f"(окно {window:.0f}s, Ctrl+C - выход)",
+        "",
+        f"   Запросы:   running {_fmt(sample.running, '.0f')}   waiting {_fmt(sample.waiting, '.0f')}   "
+        f"завершено {_fmt(sample.requests_per_s, '.2f')}/s",
+        f"   KV cache:  {_bar(sample.kv_cache_usage)} {_fmt(sample.kv_cache_usage, '.1f', 100, '%')}",
+        f"   Prefix cache hit: {_fmt(sample.prefix_cache_hit_rate, '.1f', 100, '%')}   "
+        f"preemptions {_fmt(sample.preemptions_per_s, '.2f')}/s",
+        f"   Токены/с:  prompt {_fmt(sample.prompt_tps, '.0f')}   generation {_fmt(sample.generation_tps, '.0f')}",
+        "",
+        f"   {'':<10} {'p50':>9} {'p95':>9}",
+        f"   {'TTFT':<10} {_fmt(sample.ttft_p50, '.0f', 1000, ' ms'):>9} {_fmt(sample.ttft_p95, '.0f', 1000, ' ms'):>9}",
+        f"   {'ITL':<10} {_fmt(sample.itl_p50, '.0f', 1000, ' ms'):>9} {_fmt(sample.itl_p95, '.0f', 1000, ' ms'):>9}",
+        f"   {'E2E':<10} {_fmt(sample.e2e_p50, '.1f', 1, ' s'):>9} {_fmt(sample.e2e_p95, '.1f', 1, ' s'):>9}",
+        f"   {'Очередь':<10} {'':>9} {_fmt(sample.queue_p95, '.0f', 1000, ' ms'):>9}",
+    ]
+    if sample.flags:
+        lines.append("")
+        for flag in sample.flags:
+            lines.append(f"   ⚠️  {FLAG_TEXT.get(flag, flag)}")
+    return "\n".join(lines)
+
+
+def run(
+    snapshots: Iterable[Tuple[str, MetricsSnapshot]],
+    aggregator: MetricsAggregator,
+    writer: Optional[SampleWriter] = None,
+    raw_path: Optional[str] = None,
+    on_sample=None,
+) -> int:
+    """Прогнать снимки через агрегатор, записать результаты; вернуть число снимков"""
+    raw = open(raw_path, "a", encoding="utf-8") if raw_path else None
+    count = 0
+    try:
+        for text, snapshot in snapshots:
+            if raw:
+                raw.write(json.dumps({"timestamp": snapshot.timestamp, "text": text}) + "\n")
+                raw.flush()
+            sample = aggregator.update(snapshot)
+            if writer:
+                writer.write(sample)
+            if on_sample:
+                on_sample(sample)
+            count += 1
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if raw:
+            raw.close()
+        if writer:
+            writer.close()
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Мониторинг vLLM сервера по /metrics")
+
+    parser.add_argument(
+        "--api-url",
+        default="http://localhost:8000",
+        help="URL сервера (по умолчанию: http://localhost:8000)"
+    )
+
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=2.0,
+        help="Интервал опроса, секунды (по умолчанию: 2)"
+    )
+
+    parser.add_argument(
+        "--window",
+        type=float,
+        default=60.0,
+        help="Окно для скоростей и перцентилей, секунды (по умолчанию: 60)"
+    )
+
+    commands = parser.add_subparsers(dest="command")
+
+    record = commands.add_parser("record", help="Записывать агрегаты в CSV/JSONL без экрана")
+
+    record.add_argument(
+        "--output",
+        required=True,
+        help="Файл .csv или .jsonl"
+    )
+
+    record.add_argument(
+        "--raw",
+        help="Также сохранять сырые снимки /metrics (JSONL) для replay"
+    )
+
+    record.add_argument(
+        "--duration",
+        type=float,
+        help="Сколько записывать, секунды (по умолчанию: до Ctrl+C)"
+    )
+
+    replay = commands.add_parser("replay", help="Агрегировать записанные сырые снимки")
+    replay.add_argument("raw", help="Файл записи --raw")
+
+    replay.add_argument(
+        "--output",
+        help="Файл .csv или .jsonl (по умолчанию: JSONL в stdout)"
+    )
+
+    args = parser.parse_args()
+    aggregator = MetricsAggregator(window=args.window)
+
+    if args.command == "replay":
+        writer = SampleWriter(args.output) if args.output else None
+        on_sample = None if writer else (lambda s: print(json.dumps(asdict(s), ensure_ascii=False)))
+        count = run(read_raw(args.raw), aggregator, writer, on_sample=on_sample)
+        if writer:
+            print(f"💾 {count} снимков -> {args.output}")
+        return
+
+    if args.command == "record":
+        print(f"💾 Запись {args.api_url}/metrics каждые {args.interval}s -> {args.output} (Ctrl+C - стоп)")
+        count = run(
+            poll_snapshots(args.api_url, args.interval, args.duration),
+            aggregator,
+            SampleWriter(args.output),
+            raw_path=args.raw,
+            on_sample=lambda s: s.flags and print(f"⚠️  {time.strftime('%H:%M:%S')} {', '.join(s.flags)}"),
+        )
+        print(f"💾 Записано снимков: {count}")
+        return
+
+    def redraw(sample: MonitorSample) -> None:
+        sys.stdout.write("\x1b[H\x1b[2J" + render(sample, args.api_url, args.window) + "\n")
+        sys.stdout.flush()
+
+    run(poll_snapshots(args.api_url, args.interval), aggregator, on_sample=redraw)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,417 @@
+#!/usr/bin/env python3
+"""
+Перенос весов модели на native Linux FS и прогрев page cache
+
+В WSL2 кэш HuggingFace часто лежит на диске Windows (/mnt/c, 9p/drvfs), и
+чтение многогигабайтных safetensors оттуда занимает большую часть холодного
+старта. Скрипт:
+
+- находит snapshot модели (имя из models.yaml, HF id или директория) в кэше HF
+- копирует файлы в директорию на native FS параллельными чанками (pread/pwrite
+  в нескольких потоках - 9p заметно быстрее при параллельном чтении)
+- проверяет копию: хэши чанков источника сравниваются с перечитанными с диска
+- пропускает неизменившиеся файлы по манифесту (размер, mtime, blob id HF)
+- по желанию прогревает page cache (readahead + чтение страниц), чтобы vLLM
+  загрузил веса из памяти
+
+Для каждой фазы выводится MB/s.
+
+Запуск:
+    python stage_weights.py qwen3-vl-2b --source-cache /mnt/c/Users/me/.cache/huggingface/hub
+    python stage_weights.py qwen3-vl-2b --prewarm-only
+    python vllm_server.py --model qwen3-vl-2b --weights-dir ~/models --prewarm
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from config_planner import find_model_dir
+
+DEFAULT_STAGE_DIR = os.path.join("~", "models")
+MANIFEST_NAME = ".staging.json"
+DEFAULT_CHUNK_MB = 64
+DEFAULT_WORKERS = 8
+
+# Файлы, которые копируются целиком без чанков
+SMALL_FILE_BYTES = 16 * 1024**2
+
+
+@dataclass
+class PhaseStats:
+    """Объем и время одной фазы"""
+    name: str
+    bytes: int = 0
+    seconds: float = 0.0
+    files: int = 0
+
+    @property
+    def mb_per_s(self) -> float:
+        return self.bytes / 1024**2 / self.seconds if self.seconds > 0 else 0.0
+
+    def format(self) -> str:
+        return (
+            f"{self.name:<8} {self.files:>3} файлов, {self.bytes / 1024**3:7.2f} GB "
+            f"за {self.seconds:6.1f}s = {self.mb_per_s:7.0f} MB/s"
+        )
+
+
+@dataclass
+class StageReport:
+    dest: str
+    phases: Dict[str, PhaseStats] = field(default_factory=dict)
+    skipped: List[str] = field(default_factory=list)
+
+    def phase(self, name: str) -> PhaseStats:
+        return self.phases.setdefault(name, PhaseStats(name))
+
+    def format_report(self) -> str:
+        lines = [f"📦 {self.dest}"]
+        if self.skipped:
+            lines.append(f"   ⏭️  без изменений: {len(self.skipped)} файлов")
+        for stats in self.phases.values():
+            lines.append(f"   {stats.format()}")
+        return "\n".join(lines)
+
+
+class VerificationError(RuntimeError):
+    """Копия не совпала с источником"""
+
+
+def staged_dir(stage_root: str, model_id: str) -> str:
+    """Директория копии модели: <stage_root>/<org>--<name>"""
+    return os.path.join(os.path.expanduser(stage_root), model_id.strip("/").replace("/", "--"))
+
+
+def model_files(source_dir: str) -> List[str]:
+    """Относительные пути всех файлов snapshot (без служебных)"""
+    files = []
+    for root, dirs, names in os.walk(source_dir, followlinks=True):
+        dirs[:] = [d for d in dirs if not d.startswith(".")]
+        for name in names:
+            if not name.startswith("."):
+                files.append(os.path.relpath(os.path.join(root, name), source_dir))
+    return sorted(files)
+
+
+def source_signature(path: str) -> Dict[str, object]:
+    """
+    Признаки версии файла источника без чтения содержимого
+
+    В кэше HF файл snapshot - симлинк на blobs/<sha256 для LFS>, так что
+    имя blob меняется вместе с содержимым.
+    """
+    real = os.path.realpath(path)
+    st = os.stat(real)
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "blob": os.path.basename(real)}
+
+
+def chunk_ranges(size: int, chunk_bytes: int) -> List[Tuple[int, int]]:
+    return [(offset, min(chunk_bytes, size - offset)) for offset in range(0, size, chunk_bytes)] or [(0, 0)]
+
+
+def _read_exact(fd: int, offset: int, length: int) -> bytes:
+    parts = []
+    while length > 0:
+        data = os.pread(fd, length, offset)
+        if not data:
+            raise OSError(f"неожиданный конец файла на смещении {offset}")
+        parts.append(data)
+        offset += len(data)
+        length -= len(data)
+    return b"".join(parts)
+
+
+def _digest(data: bytes) -> str:
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def _drop_cache(fd: int) -> None:
+    if hasattr(os, "posix_fadvise"):
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+
+
+def copy_file(
+    src: str, dst: str, pool: ThreadPoolExecutor, chunk_bytes: int, verify: bool = True
+) -> Tuple[str, float, float]:
+    """
+    Скопировать файл параллельными чанками
+
+    Returns:
+        (хэш файла - хэш от хэшей чанков, секунды копирования, секунды проверки)
+    """
+    size = os.path.getsize(src)
+    ranges = chunk_ranges(size, chunk_bytes)
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    tmp = dst + ".part"
+
+    started = time.perf_counter()
+    src_fd = os.open(src, os.O_RDONLY)
+    dst_fd = os.open(tmp, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        os.ftruncate(dst_fd, size)
+
+        def copy_chunk(item: Tuple[int, int]) -> str:
+            offset, length = item
+            data = _read_exact(src_fd, offset, length)
+            view = memoryview(data)
+            while view:
+                written = os.pwrite(dst_fd, view, offset)
+                view = view[written:]
+                offset += written
+            return _digest(data)
+
+        digests = list(pool.map(copy_chunk, ranges))
+        os.fsync(dst_fd)
+        copy_seconds = time.perf_counter() - started
+
+        verify_seconds = 0.0
+        if verify:
+            # Проверяем то, что на диске, а не в page cache
+            started = time.perf_counter()
+            _drop_cache(dst_fd)
+            check = list(pool.map(lambda item: _digest(_read_exact(dst_fd, *item)), ranges))
+            verify_seconds = time.perf_counter() - started
+            if check != digests:
+                bad = sum(a != b for a, b in zip(check, digests))
+                raise VerificationError(f"{dst}: не совпали {bad} из {len(digests)} чанков")
+    finally:
+        os.close(src_fd)
+        os.close(dst_fd)
+
+    os.replace(tmp, dst)
+    return _digest("".join(digests).encode()), copy_seconds, verify_seconds
+
+
+def _load_manifest(dest: str) -> Dict[str, Dict[str, object]]:
+    try:
+        with open(os.path.join(dest, MANIFEST_NAME), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_manifest(dest: str, manifest: Dict[str, Dict[str, object]]) -> None:
+    path = os.path.join(dest, MANIFEST_NAME)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def stage_model(
+    source_dir: str,
+    dest: str,
+    workers: int = DEFAULT_WORKERS,
+    chunk_mb: int = DEFAULT_CHUNK_MB,
+    verify: bool = True,
+    on_file=None,
+) -> StageReport:
+    """
+    Скопировать snapshot модели в dest, пропуская неизменившиеся файлы
+
+    Args:
+        on_file: Колбэк (относительный путь, статус) для вывода прогресса
+    """
+    os.makedirs(dest, exist_ok=True)
+    manifest = _load_manifest(dest)
+    report = StageReport(dest)
+    chunk_bytes = chunk_mb * 1024**2
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for rel in model_files(source_dir):
+            src = os.path.join(source_dir, rel)
+            dst = os.path.join(dest, rel)
+            signature = source_signature(src)
+            entry = manifest.get(rel)
+            if (
+                entry is not None
+                and os.path.exists(dst)
+                and os.path.getsize(dst) == signature["size"]
+                and all(entry.get(k) == v for k, v in signature.items())
+            ):
+                report.skipped.append(rel)
+                if on_file:
+                    on_file(rel, "skip")
+                continue
+
+            size = signature["size"]
+            chunk = chunk_bytes if size > SMALL_FILE_BYTES else max(1, size)
+            digest, copy_seconds, verify_seconds = copy_file(src, dst, pool, chunk, verify=verify)
+            phases = [("copy", copy_seconds)] + ([("verify", verify_seconds)] if verify else [])
+            for name, seconds in phases:
+                stats = report.phase(name)
+                stats.bytes += size
+                stats.seconds += seconds
+                stats.files += 1
+            manifest[rel] = {**signature, "digest": digest}
+            # Манифест после каждого файла: прерванный перенос продолжится с места остановки
+            _save_manifest(dest, manifest)
+            if on_file:
+                on_file(rel, f"{size / 1024**2 / max(copy_seconds, 1e-9):.0f} MB/s")
+
+    return report
+
+
+def weight_files(model_dir: str) -> List[str]:
+    return [
+        os.path.join(model_dir, rel) for rel in model_files(model_dir)
+        if rel.endswith((".safetensors", ".bin", ".pt"))
+    ]
+
+
+def available_memory_bytes() -> Optional[int]:
+    try:
+        with open("/proc/meminfo", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def prewarm(paths: List[str], workers: int = DEFAULT_WORKERS, chunk_mb: int = DEFAULT_CHUNK_MB) -> PhaseStats:
+    """
+    Прогреть page cache: readahead (fadvise WILLNEED) и чтение всех страниц
+    параллельными чанками, чтобы vLLM читал веса из памяти
+    """
+    stats = PhaseStats("prewarm")
+    chunk_bytes = chunk_mb * 1024**2
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for path in paths:
+            size = os.path.getsize(path)
+            fd = os.open(path, os.O_RDONLY)
+            try:
+                if hasattr(os, "posix_fadvise"):
+                    os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+                list(pool.map(lambda item: len(_read_exact(fd, *item)), chunk_ranges(size, chunk_bytes)))
+            finally:
+                os.close(fd)
+            stats.bytes += size
+            stats.files += 1
+    stats.seconds = time.perf_counter() - started
+    return stats
+
+
+def prewarm_warning(paths: List[str]) -> Optional[str]:
+    """Предупреждение, если веса не помещаются в свободную память"""
+    total = sum(os.path.getsize(p) for p in paths)
+    available = available_memory_bytes()
+    if available is not None and total > available:
+        return (
+            f"веса {total / 1024**3:.1f} GB больше свободной памяти "
+            f"{available / 1024**3:.1f} GB - прогрев вытеснит сам себя"
+        )
+    return None
+
+
+def resolve_model_id(model: str) -> str:
+    """Имя из models.yaml -> model_id; HF id и пути - как есть"""
+    try:
+        from model_registry import load_registry
+        return load_registry().model(model).model_id
+    except (OSError, ValueError):
+        return model
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Копирование весов модели на native FS (параллельно, с проверкой) и прогрев page cache"
+    )
+
+    parser.add_argument(
+        "model",
+        help="Модель из models.yaml, HuggingFace ID или директория"
+    )
+
+    parser.add_argument(
+        "--dest",
+        default=DEFAULT_STAGE_DIR,
+        help=f"Куда копировать: <dest>/<org>--<name> (по умолчанию: {DEFAULT_STAGE_DIR})"
+    )
+
+    parser.add_argument(
+        "--source-cache",
+        help="Кэш HuggingFace с моделью, например /mnt/c/Users/<user>/.cache/huggingface/hub "
+             "(по умолчанию: HF_HUB_CACHE/HF_HOME)"
+    )
+
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=DEFAULT_WORKERS,
+        help=f"Параллельных потоков ввода-вывода (по умолчанию: {DEFAULT_WORKERS})"
+    )
+
+    parser.add_argument(
+        "--chunk-mb",
+        type=int,
+        default=DEFAULT_CHUNK_MB,
+        help=f"Размер чанка, MB (по умолчанию: {DEFAULT_CHUNK_MB})"
+    )
+
+    parser.add_argument(
+        "--no-verify",
+        action="store_true",
+        help="Не перечитывать копию для проверки"
+    )
+
+    parser.add_argument(
+        "--prewarm",
+        action="store_true",
+        help="После копирования прогреть page cache"
+    )
+
+    parser.add_argument(
+        "--prewarm-only",
+        action="store_true",
+        help="Только прогреть уже скопированную модель"
+    )
+
+    args = parser.parse_args()
+
+    model_id = resolve_model_id(args.model)
+    dest = staged_dir(args.dest, model_id)
+
+    if not args.prewarm_only:
+        source = find_model_dir(model_id, args.source_cache)
+        if source is None:
+            print(f"❌ {model_id} не найдена в кэше HuggingFace "
+                  f"({args.source_cache or 'HF_HUB_CACHE/HF_HOME'})", file=sys.stderr)
+            sys.exit(1)
+        print(f"📂 {source}\n   -> {dest}")
+        try:
+            report = stage_model(
+                source, dest,
+                workers=args.workers,
+                chunk_mb=args.chunk_mb,
+                verify=not args.no_verify,
+                on_file=lambda rel, status: print(f"   {'⏭️ ' if status == 'skip' else '✅'} {rel} ({status})"),
+            )
+        except VerificationError as e:
+            print(f"❌ {e}", file=sys.stderr)
+            sys.exit(1)
+        print(report.format_report())
+
+    if args.prewarm or args.prewarm_only:
+        paths = weight_files(dest)
+        if not paths:
+            print(f"❌ В {dest} нет весов", file=sys.stderr)
+            sys.exit(1)
+        warning = prewarm_warning(paths)
+        if warning:
+            print(f"⚠️  {warning}")
+        print(f"🔥 {prewarm(paths, args.workers, args.chunk_mb).format()}")
+
+    print(f"\n🚀 python vllm_server.py --model {args.model} --weights-dir {args.dest}")
+
+
+if __name__ == "__main__":
+    main()
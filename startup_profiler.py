@@ -0,0 +1,462 @@
+#!/usr/bin/env python3
+"""
+Профилировщик холодного старта vLLM сервера
+
+Запускает сервер подпроцессом, читает его лог и по известным строкам vLLM
+строит хронологию фаз:
+
+    import -> engine_init -> weights -> profiling (torch.compile, профилирование
+    памяти) -> kv_cache -> cuda_graphs -> api_startup -> ready (/v1/models 200)
+
+Каждый старт сохраняется в историю (JSONL) и сравнивается с предыдущими
+стартами той же модели - регрессии от новой версии vLLM или флагов видны сразу.
+
+Лог пишется с относительными метками времени, поэтому его можно разобрать
+заново (parse) - это же используется для проверки разбора на записанных логах.
+
+Запуск:
+    python vllm_server.py --model qwen3-vl-2b --profile-startup
+    python startup_profiler.py run --exit-when-ready -- python vllm_server.py --model qwen-7b
+    python startup_profiler.py parse ~/.cache/vllm-setup/startup-logs/<...>.log
+    python startup_profiler.py history --model qwen-7b
+"""
+
+import argparse
+import json
+import os
+import re
+import signal
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import requests
+
+DEFAULT_HISTORY_PATH = Path.home() / ".cache" / "vllm-setup" / "startup_history.jsonl"
+DEFAULT_LOG_DIR = Path.home() / ".cache" / "vllm-setup" / "startup-logs"
+
+# Строка, которую профилировщик добавляет в лог при первом ответе /v1/models
+READY_MARKER = "[startup_profiler] ready"
+
+# (фаза, regex строки vLLM, которой фаза заканчивается) в порядке старта.
+# Фаза начинается на предыдущей найденной отметке; если отметки нет
+# (например, --enforce-eager без CUDA graphs), ее время уходит в следующую фазу.
+MILESTONES: Tuple[Tuple[str, str], ...] = (
+    ("import", r"vLLM API server version|Initializing an? (V1 )?LLM engine|non-default args"),
+    ("engine_init", r"Starting to load model"),
+    ("weights", r"Model loading took|Loading weights took"),
+    ("profiling", r"torch\.compile takes|Memory profiling takes|Available KV cache memory"),
+    ("kv_cache", r"GPU KV cache size|# (cuda|GPU) blocks"),
+    ("cuda_graphs", r"Graph capturing finished"),
+    ("api_startup", r"Application startup complete|Starting vLLM API server"),
+    ("ready", re.escape(READY_MARKER)),
+)
+
+PHASE_NAMES = tuple(name for name, _ in MILESTONES)
+
+# Длительности и факты, которые vLLM сообщает сам
+REPORTED: Tuple[Tuple[str, str], ...] = (
+    ("download_s", r"Time spent downloading weights.*?: ([\d.]+) seconds"),
+    ("weights_load_s", r"Model loading took [\d.]+ ?GiB and ([\d.]+) seconds"),
+    ("weights_gib", r"Model loading took ([\d.]+) ?GiB"),
+    ("dynamo_s", r"Dynamo bytecode transform time: ([\d.]+) s"),
+    ("compile_s", r"torch\.compile takes ([\d.]+) s in total"),
+    ("memory_profiling_s", r"Memory profiling takes ([\d.]+) seconds"),
+    ("kv_cache_gib", r"Available KV cache memory: ([\d.]+) GiB"),
+    ("kv_cache_tokens", r"GPU KV cache size: ([\d,]+) tokens"),
+    ("max_concurrency", r"Maximum concurrency for [\d,]+ tokens per request: ([\d.]+)x"),
+    ("cuda_graphs_s", r"Graph capturing finished in ([\d.]+) secs?"),
+    ("cuda_graphs_gib", r"Graph capturing finished in [\d.]+ secs?, took ([\d.]+) GiB"),
+    ("init_engine_s", r"init engine .*? took ([\d.]+) seconds"),
+)
+
+_MILESTONE_RES = [(name, re.compile(pattern)) for name, pattern in MILESTONES]
+_REPORTED_RES = [(name, re.compile(pattern)) for name, pattern in REPORTED]
+_ANSI_RE = re.compile(r"\x1b\[[0-9;]*m")
+# Строка записанного лога: "   12.345 | текст"
+_RECORDED_RE = re.compile(r"^\s*(\d+(?:\.\d+)?) \| (.*)$")
+# Метка времени логгера vLLM: "INFO 10-17 12:00:01 [file.py:12] текст"
+_VLLM_TIME_RE = re.compile(r"^(?:\(\w+ pid=\d+\) )?[A-Z]+ (\d\d-\d\d \d\d:\d\d:\d\d)")
+
+# Рост фазы, который считается регрессией: больше на 20% и на 1 секунду
+REGRESSION_RATIO = 1.2
+REGRESSION_MIN_SECONDS = 1.0
+
+
+@dataclass
+class PhaseTiming:
+    name: str
+    start: float
+    duration: float
+
+
+@dataclass
+class StartupTimeline:
+    """Хронология одного старта"""
+    phases: List[PhaseTiming] = field(default_factory=list)
+    reported: Dict[str, float] = field(default_factory=dict)
+    total: Optional[float] = None  # до ready; None - сервер не поднялся
+    meta: Dict[str, Any] = field(default_factory=dict)
+
+    def phase(self, name: str) -> Optional[float]:
+        return next((p.duration for p in self.phases if p.name == name), None)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "StartupTimeline":
+        return cls(
+            phases=[PhaseTiming(**p) for p in data.get("phases", [])],
+            reported=data.get("reported", {}),
+            total=data.get("total"),
+            meta=data.get("meta", {}),
+        )
+
+    def format_report(self) -> str:
+        lines = ["⏱️  Холодный старт:"]
+        for phase in self.phases:
+            share = phase.duration / self.total * 100 if self.total else 0
+            bar = "█" * max(1, round(share / 4)) if phase.duration >= 0.05 else ""
+            lines.append(f"   {phase.name:<12} {phase.duration:7.1f}s {share:5.1f}%  {bar}")
+        total = f"{self.total:.1f}s" if self.total is not None else "сервер не ответил"
+        lines.append(f"   {'итого':<12} {total:>8}")
+        if self.reported:
+            facts = ", ".join(f"{k}={v:g}" for k, v in self.reported.items())
+            lines.append(f"   📋 vLLM: {facts}")
+        return "\n".join(lines)
+
+
+# --- разбор лога ---
+
+def parse_events(lines: Iterable[str]) -> List[Tuple[float, str]]:
+    """
+    [(секунды от запуска, строка)] из записанного лога
+
+    Строки без метки профилировщика (сырой лог vLLM) получают время по
+    метке логгера vLLM относительно первой такой строки; import в этом
+    случае не измеряется.
+    """
+    events = []
+    first_clock: Optional[datetime] = None
+    last = 0.0
+    for raw in lines:
+        line = _ANSI_RE.sub("", raw.rstrip("\n"))
+        match = _RECORDED_RE.match(line)
+        if match:
+            last = float(match.group(1))
+            events.append((last, match.group(2)))
+            continue
+        clock = _VLLM_TIME_RE.match(line)
+        if clock:
+            # Год в логе не пишется; високосный - чтобы 02-29 тоже разбиралось
+            stamp = datetime.strptime(f"2000-{clock.group(1)}", "%Y-%m-%d %H:%M:%S")
+            first_clock = first_clock or stamp
+            last = (stamp - first_clock).total_seconds()
+        events.append((last, line))
+    return events
+
+
+def build_timeline(events: Sequence[Tuple[float, str]]) -> StartupTimeline:
+    """Фазы по первым вхождениям отметок MILESTONES"""
+    reached: Dict[str, float] = {}
+    reported: Dict[str, float] = {}
+    for t, text in events:
+        for name, regex in _MILESTONE_RES:
+            if name not in reached and regex.search(text):
+                reached[name] = t
+        for name, regex in _REPORTED_RES:
+            if name not in reported:
+                match = regex.search(text)
+                if match:
+                    reported[name] = float(match.group(1).replace(",", ""))
+
+    phases = []
+    start = 0.0
+    for name in PHASE_NAMES:
+        if name in reached and reached[name] >= start:
+            phases.append(PhaseTiming(name, round(start, 3), round(reached[name] - start, 3)))
+            start = reached[name]
+    return StartupTimeline(phases=phases, reported=reported, total=reached.get("ready"))
+
+
+def parse_log(path: str) -> StartupTimeline:
+    with open(path, encoding="utf-8", errors="replace") as f:
+        return build_timeline(parse_events(f))
+
+
+# --- история и сравнение ---
+
+def append_history(timeline: StartupTimeline, path: Path = DEFAULT_HISTORY_PATH) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(timeline.to_dict(), ensure_ascii=False) + "\n")
+
+
+def load_history(path: Path = DEFAULT_HISTORY_PATH, model: Optional[str] = None) -> List[StartupTimeline]:
+    if not path.exists():
+        return []
+    history = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                timeline = StartupTimeline.from_dict(json.loads(line))
+                if model is None or timeline.meta.get("model") == model:
+                    history.append(timeline)
+    return history
+
+
+def compare(current: StartupTimeline, previous: Sequence[StartupTimeline], window: int = 5) -> str:
+    """
+    Сравнение с медианой последних window успешных стартов
+
+    Фаза помечается как регрессия, если выросла в REGRESSION_RATIO раз и
+    больше чем на REGRESSION_MIN_SECONDS.
+    """
+    baseline = [t for t in previous if t.total is not None][-window:]
+    if not baseline:
+        return "📚 История пуста - это первый старт для сравнения"
+
+    lines = [f"📚 Сравнение с медианой {len(baseline)} предыдущих стартов:"]
+    rows = [(name, current.phase(name), [t.phase(name) for t in baseline]) for name in PHASE_NAMES]
+    rows.append(("итого", current.total, [t.total for t in baseline]))
+    for name, value, past in rows:
+        past = [v for v in past if v is not None]
+        if value is None or not past:
+            continue
+        median = statistics.median(past)
+        delta = value - median
+        mark = ""
+        if value > median * REGRESSION_RATIO and delta > REGRESSION_MIN_SECONDS:
+            mark = "  ⚠️  регрессия"
+        elif delta < -REGRESSION_MIN_SECONDS:
+            mark = "  ✅"
+        lines.append(f"   {name:<12} {value:7.1f}s  (было {median:6.1f}s, {delta:+6.1f}s){mark}")
+
+    # Что изменилось с прошлого старта
+    last = baseline[-1].meta
+    for key in ("vllm_version", "args"):
+        if key in current.meta and current.meta.get(key) != last.get(key):
+            lines.append(f"   🔀 {key}: {last.get(key)} -> {current.meta.get(key)}")
+    return "\n".join(lines)
+
+
+# --- запуск ---
+
+def installed_vllm_version() -> Optional[str]:
+    """Версия vLLM без импорта самого vLLM"""
+    try:
+        from importlib.metadata import PackageNotFoundError, version
+        return version("vllm")
+    except PackageNotFoundError:
+        return None
+
+
+def wait_ready(api_url: str, process: subprocess.Popen, timeout: float, interval: float = 0.5) -> bool:
+    """Ждать первого 200 от /v1/models (False - процесс завершился или таймаут)"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            return False
+        try:
+            if requests.get(f"{api_url}/v1/models", timeout=2).status_code == 200:
+                return True
+        except requests.RequestException:
+            pass
+        time.sleep(interval)
+    return False
+
+
+def run_profiled(
+    cmd: List[str],
+    api_url: str,
+    meta: Optional[Dict[str, Any]] = None,
+    history_path: Path = DEFAULT_HISTORY_PATH,
+    log_dir: Path = DEFAULT_LOG_DIR,
+    timeout: float = 1800,
+    exit_when_ready: bool = False,
+    echo: bool = True,
+) -> int:
+    """
+    Запустить сервер, построить хронологию старта, записать историю
+
+    Лог сервера дублируется в консоль и в log_dir. Без exit_when_ready
+    сервер продолжает работать, функция ждет его завершения (Ctrl+C
+    останавливает сервер).
+
+    Returns:
+        Код возврата сервера (0 при exit_when_ready и успешном старте)
+    """
+    meta = dict(meta or {})
+    meta.setdefault("started_at", datetime.now().isoformat(timespec="seconds"))
+    meta.setdefault("vllm_version", installed_vllm_version())
+    meta.setdefault("cmd", " ".join(cmd))
+    log_dir.mkdir(parents=True, exist_ok=True)
+    model = str(meta.get("model", "server")).replace("/", "_")
+    log_path = log_dir / f"{datetime.now():%Y%m%d-%H%M%S}-{model}.log"
+
+    started = time.monotonic()
+    process = subprocess.Popen(
+        cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1,
+        env={**os.environ, "PYTHONUNBUFFERED": "1"},
+    )
+    log = open(log_path, "w", encoding="utf-8")
+    lock = threading.Lock()
+
+    def write(line: str) -> None:
+        with lock:
+            log.write(f"{time.monotonic() - started:9.3f} | {line}\n")
+            log.flush()
+
+    def pump() -> None:
+        for line in process.stdout:
+            write(line.rstrip("\n"))
+            if echo:
+                sys.stdout.write(line)
+                sys.stdout.flush()
+
+    reader = threading.Thread(target=pump, daemon=True)
+    reader.start()
+
+    try:
+        ready = wait_ready(api_url, process, timeout)
+        if ready:
+            write(f"{READY_MARKER}: {api_url}/v1/models 200")
+
+        with lock:
+            log.flush()
+        timeline = parse_log(str(log_path))
+        timeline.meta = {**meta, "log": str(log_path)}
+        previous = load_history(history_path, meta.get("model"))
+        append_history(timeline, history_path)
+
+        print("\n" + "=" * 70)
+        print(timeline.format_report())
+        print(compare(timeline, previous))
+        print(f"📝 Лог: {log_path}")
+        print("=" * 70 + "\n", flush=True)
+
+        if not ready:
+            print("❌ Сервер не ответил на /v1/models", file=sys.stderr)
+            if process.poll() is None:
+                process.terminate()
+            return process.wait() or 1
+        if exit_when_ready:
+            process.send_signal(signal.SIGINT)
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+            return 0
+        return process.wait()
+    except KeyboardInterrupt:
+        process.send_signal(signal.SIGINT)
+        return process.wait()
+    finally:
+        reader.join(timeout=5)
+        log.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Профилирование холодного старта vLLM сервера")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="Запустить сервер и снять хронологию старта")
+
+    run.add_argument(
+        "--api-url",
+        default="http://localhost:8000",
+        help="URL сервера для проверки готовности (по умолчанию: http://localhost:8000)"
+    )
+
+    run.add_argument(
+        "--model",
+        help="Имя модели для истории (по умолчанию: значение --model в команде)"
+    )
+
+    run.add_argument(
+        "--exit-when-ready",
+        action="store_true",
+        help="Остановить сервер сразу после готовности (замер старта)"
+    )
+
+    run.add_argument(
+        "--timeout",
+        type=float,
+        default=1800,
+        help="Сколько ждать готовности, секунды (по умолчанию: 1800)"
+    )
+
+    run.add_argument("cmd", nargs=argparse.REMAINDER, help="Команда запуска сервера (после --)")
+
+    parse = commands.add_parser("parse", help="Разобрать записанный лог")
+    parse.add_argument("log", help="Лог профилировщика или сырой лог vLLM")
+
+    history = commands.add_parser("history", help="История стартов")
+
+    history.add_argument(
+        "--model",
+        help="Только старты этой модели"
+    )
+
+    history.add_argument(
+        "--last",
+        type=int,
+        default=10,
+        help="Сколько последних стартов показать (по умолчанию: 10)"
+    )
+
+    for sub in (run, history):
+        sub.add_argument(
+            "--history",
+            default=str(DEFAULT_HISTORY_PATH),
+            help=f"Файл истории (по умолчанию: {DEFAULT_HISTORY_PATH})"
+        )
+
+    args = parser.parse_args()
+
+    if args.command == "parse":
+        print(parse_log(args.log).format_report())
+        return
+
+    if args.command == "history":
+        timelines = load_history(Path(args.history), args.model)[-args.last:]
+        if not timelines:
+            print("📚 История пуста")
+            return
+        header = "   ".join(f"{name[:11]:>11}" for name in PHASE_NAMES)
+        print(f"{'старт':<19} {'модель':<20} {header}   {'итого':>7}")
+        for t in timelines:
+            cells = "   ".join(
+                f"{t.phase(name):>10.1f}s" if t.phase(name) is not None else f"{'-':>11}"
+                for name in PHASE_NAMES
+            )
+            total = f"{t.total:6.1f}s" if t.total is not None else "   fail"
+            print(f"{t.meta.get('started_at', '?'):<19} {str(t.meta.get('model', '?'))[:20]:<20} {cells}   {total}")
+        return
+
+    cmd = args.cmd[1:] if args.cmd[:1] == ["--"] else args.cmd
+    if not cmd:
+        parser.error("укажите команду запуска сервера после --")
+    model = args.model
+    if model is None and "--model" in cmd[:-1]:
+        model = cmd[cmd.index("--model") + 1]
+    code = run_profiled(
+        cmd,
+        args.api_url,
+        meta={"model": model, "args": " ".join(cmd[1:])},
+        history_path=Path(args.history),
+        timeout=args.timeout,
+        exit_when_ready=args.exit_when_ready,
+    )
+    sys.exit(code)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+Чтение SSE потока /v1/chat/completions и учет задержек (TTFT, ITL, tokens/s)
+"""
+
+import json
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Union
+
+from client_tracing import add_span, span
+
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+
+class APIError(Exception):
+    """Ответ сервера с кодом, отличным от 200 (код - в status)"""
+
+    def __init__(self, status: int, text: str):
+        super().__init__(f"API Error: {status} - {text}")
+        self.status = status
+
+
+def percentile(values: List[float], p: float) -> float:
+    """Перцентиль с линейной интерполяцией (p в диапазоне 0-100)"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * p / 100
+    lo = int(k)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+@dataclass
+class StreamStats:
+    """Временные метки одного потокового ответа (time.perf_counter)"""
+    start: float = field(default_factory=time.perf_counter)
+    first_token: Optional[float] = None
+    end: Optional[float] = None
+    chunk_times: List[float] = field(default_factory=list)
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
+
+    def on_chunk(self) -> None:
+        now = time.perf_counter()
+        if self.first_token is None:
+            self.first_token = now
+        self.chunk_times.append(now)
+
+    def finish(self) -> None:
+        self.end = time.perf_counter()
+
+    @property
+    def ttft(self) -> Optional[float]:
+        """Time to first token, секунды"""
+        if self.first_token is None:
+            return None
+        return self.first_token - self.start
+
+    @property
+    def e2e(self) -> float:
+        return (self.end or time.perf_counter()) - self.start
+
+    @property
+    def output_tokens(self) -> int:
+        # usage от сервера точнее: один SSE чанк не всегда равен одному токену
+        if self.completion_tokens is not None:
+            return self.completion_tokens
+        return len(self.chunk_times)
+
+    @property
+    def itl(self) -> List[float]:
+        """Интервалы между соседними чанками, секунды"""
+        return [b - a for a, b in zip(self.chunk_times, self.chunk_times[1:])]
+
+    @property
+    def decode_tokens_per_second(self) -> float:
+        """Скорость генерации после первого токена"""
+        if self.first_token is None or self.end is None:
+            return 0.0
+        decode_time = self.end - self.first_token
+        if decode_time <= 0 or self.output_tokens < 2:
+            return 0.0
+        return (self.output_tokens - 1) / decode_time
+
+    def to_dict(self) -> Dict[str, Any]:
+        itl = self.itl
+        return {
+            "ttft": self.ttft,
+            "e2e": self.e2e,
+            "itl_mean": sum(itl) / len(itl) if itl else None,
+            "itl_p50": percentile(itl, 50) if itl else None,
+            "itl_p90": percentile(itl, 90) if itl else None,
+            "prompt_tokens": self.prompt_tokens,
+            "output_tokens": self.output_tokens,
+            "tokens_per_second": self.output_tokens / self.e2e if self.e2e > 0 else 0.0,
+            "decode_tokens_per_second": self.decode_tokens_per_second,
+        }
+
+    def format_report(self) -> str:
+        """Человекочитаемый отчет для CLI"""
+        d = self.to_dict()
+        ms = lambda v: f"{v * 1000:.1f} ms" if v is not None else "n/a"
+        lines = [
+            "⏱️  Статистика потока:",
+            f"   TTFT:            {ms(d['ttft'])}",
+            f"   ITL (mean):      {ms(d['itl_mean'])}",
+            f"   ITL (p50/p90):   {ms(d['itl_p50'])} / {ms(d['itl_p90'])}",
+            f"   Всего:           {d['e2e']:.2f} s",
+            f"   Токенов:         {d['output_tokens']}"
+            + (f" (prompt: {d['prompt_tokens']})" if d["prompt_tokens"] is not None else ""),
+            f"   Tokens/s:        {d['tokens_per_second']:.1f} "
+            f"(decode: {d['decode_tokens_per_second']:.1f})",
+        ]
+        return "\n".join(lines)
+
+
+def _add_stream_spans(stats: StreamStats, headers: float) -> None:
+    """prefill (заголовки -> первый токен) и decode (первый токен -> конец)"""
+    add_span("prefill", headers, stats.first_token)
+    add_span("decode", stats.first_token, stats.end, tokens=stats.output_tokens)
+
+
+def parse_sse_line(line: Union[str, bytes]) -> Optional[Union[Dict[str, Any], str]]:
+    """
+    Разобрать одну строку SSE
+
+    Возвращает dict для чанка, "[DONE]" для конца потока, None для
+    пустых строк, комментариев и прочих полей события.
+    """
+    if isinstance(line, bytes):
+        line = line.decode("utf-8")
+    line = line.strip()
+    if not line.startswith("data:"):
+        return None
+    data = line[len("data:"):].strip()
+    if data == "[DONE]":
+        return data
+    return json.loads(data)
+
+
+def iter_sse_chunks(lines: Iterable[Union[str, bytes]]) -> Iterator[Dict[str, Any]]:
+    """Итерировать JSON чанки SSE потока до [DONE]"""
+    for line in lines:
+        event = parse_sse_line(line)
+        if event is None:
+            continue
+        if event == "[DONE]":
+            return
+        yield event
+
+
+def _apply_chunk(
+    chunk: Dict[str, Any],
+    stats: StreamStats,
+    parts: List[str],
+    on_token: Optional[Callable[[str], None]],
+) -> None:
+    if chunk.get("usage"):
+        stats.prompt_tokens = chunk["usage"].get("prompt_tokens")
+        stats.completion_tokens = chunk["usage"].get("completion_tokens")
+    for choice in chunk.get("choices") or []:
+        text = (choice.get("delta") or {}).get("content")
+        if text:
+            stats.on_chunk()
+            parts.append(text)
+            if on_token:
+                on_token(text)
+
+
+def stream_payload(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Добавить к телу запроса флаги потоковой отдачи с usage в конце"""
+    return {
+        **payload,
+        "stream": True,
+        "stream_options": {"include_usage": True},
+    }
+
+
+def encode_body(payload: Dict[str, Any]) -> bytes:
+    """
+    Тело запроса в JSON (вместо json= в requests/aiohttp), чтобы
+    сериализация была видна в trace отдельной фазой
+    """
+    with span("serialize"):
+        return json.dumps(payload, ensure_ascii=False).encode("utf-8")
+
+
+def stream_chat_completion(
+    session,
+    url: str,
+    payload: Dict[str, Any],
+    on_token: Optional[Callable[[str], None]] = None,
+    timeout: float = 120,
+) -> tuple[str, StreamStats]:
+    """
+    Отправить потоковый запрос через requests.Session
+
+    Args:
+        session: requests.Session (или модуль requests)
+        url: Полный URL /v1/chat/completions
+        payload: Тело запроса (stream добавляется автоматически)
+        on_token: Callback для каждого фрагмента текста
+    """
+    body = encode_body(stream_payload(payload))
+    stats = StreamStats()
+    parts: List[str] = []
+
+    with session.post(url, data=body, headers=JSON_HEADERS, stream=True, timeout=timeout) as response:
+        headers = time.perf_counter()
+        add_span("send", stats.start, headers, bytes=len(body))
+        if response.status_code != 200:
+            raise APIError(response.status_code, response.text)
+        for chunk in iter_sse_chunks(response.iter_lines()):
+            _apply_chunk(chunk, stats, parts, on_token)
+
+    stats.finish()
+    _add_stream_spans(stats, headers)
+    return "".join(parts), stats
+
+
+async def astream_chat_completion(
+    session,
+    url: str,
+    payload: Dict[str, Any],
+    on_token: Optional[Callable[[str], None]] = None,
+) -> tuple[str, StreamStats]:
+    """Асинхронный аналог stream_chat_completion() для aiohttp.ClientSession"""
+    body = encode_body(stream_payload(payload))
+    stats = StreamStats()
+    parts: List[str] = []
+
+    async with session.post(url, data=body, headers=JSON_HEADERS) as response:
+        headers = time.perf_counter()
+        add_span("send", stats.start, headers, bytes=len(body))
+        if response.status != 200:
+            text = await response.text()
+            raise APIError(response.status, text)
+        async for line in response.content:
+            event = parse_sse_line(line)
+            if event is None:
+                continue
+            if event == "[DONE]":
+                break
+            _apply_chunk(event, stats, parts, on_token)
+
+    stats.finish()
+    _add_stream_spans(stats, headers)
+    return "".join(parts), stats
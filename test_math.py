@@ -1,6 +1,22 @@
+import os
 import requests
 
-BASE_URL = "http://localhost:8000/v1"
+from prefix_scheduler import estimate_reuse, job_segments
+from response_cache import ResponseCache
+
+# VLLM_API_URL позволяет прогнать тест против mock_server.py или другого порта
+BASE_URL = os.environ.get("VLLM_API_URL", "http://localhost:8000") + "/v1"
+
+# VLLM_RESPONSE_CACHE=1 - повторные прогоны берут ответы из кэша; temperature
+# 0.1 не строго детерминирована, поэтому кэш для нее разрешен явно
+response_cache = (
+    ResponseCache(allow_nondeterministic=True, api_url=BASE_URL.removesuffix("/v1"))
+    if os.environ.get("VLLM_RESPONSE_CACHE") else None
+)
+
+# Один и тот же system prompt (байт в байт) во всех запросах - сервер
+# считает его один раз, остальные запросы берут его из prefix cache
+SYSTEM_PROMPT = "Ты математический ассистент. Решай задачи пошагово."
 
 math_problems = [
     "Реши уравнение: 3x + 7 = 22",
@@ -11,21 +27,27 @@ math_problems = [
 ]
 
 def test_math(problem):
-    response = requests.post(
-        f"{BASE_URL}/chat/completions",
-        json={
-            "model": "vllm-model",
-            "messages": [
-                {"role": "system", "content": "Ты математический ассистент. Решай задачи пошагово."},
-                {"role": "user", "content": problem}
-            ],
-            "temperature": 0.1,  # низкая для точности
-            "max_tokens": 500
-        }
-    )
-    return response.json()['choices'][0]['message']['content']
+    payload = {
+        "model": "vllm-model",
+        "messages": [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": problem}
+        ],
+        "temperature": 0.1,  # низкая для точности
+        "max_tokens": 500
+    }
+
+    def post():
+        response = requests.post(f"{BASE_URL}/chat/completions", json=payload)
+        return response.json()['choices'][0]['message']['content']
+
+    if response_cache is not None:
+        return response_cache.get_or_fetch(payload, post)
+    return post()
 
 print("🧮 Тестирование математических способностей модели\n")
+reuse = estimate_reuse([job_segments(p, system=SYSTEM_PROMPT) for p in math_problems])
+print(f"🧩 Prefix cache: {reuse.format_report()}")
 print("=" * 70)
 
 for i, problem in enumerate(math_problems, 1):
@@ -34,3 +56,6 @@ for i, problem in enumerate(math_problems, 1):
     answer = test_math(problem)
     print(f"💡 Ответ:\n{answer}")
     print("=" * 70)
+
+if response_cache is not None:
+    print(response_cache.stats.format_report())
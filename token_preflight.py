@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""
+Проверка бюджета токенов до отправки запроса
+
+Запрос длиннее --max-model-len сервер отклоняет с 400 только после полного
+round trip и загрузки изображений. Preflight считает prompt токены локально:
+текст - токенизатором и chat template модели, изображения - по сетке патчей
+Qwen-VL (как сервер), и до отправки:
+
+- отбрасывает самые старые сообщения history,
+- уменьшает изображения (max_pixels),
+- ограничивает max_tokens остатком контекста,
+- или отклоняет запрос (PreflightError), если уложиться нельзя.
+
+Токенизатор загружается один раз, подсчеты кэшируются - повторная проверка
+того же system prompt/history/изображения стоит микросекунды.
+"""
+
+import os
+from dataclasses import dataclass, field, replace
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import requests
+
+from image_preprocess import FACTOR, PreprocessOptions
+from prefix_scheduler import canonical_json, image_tokens, text_tokens
+
+OVERFLOW_POLICIES = ("fit", "reject")
+
+# <|vision_start|> и <|vision_end|> вокруг токенов изображения
+VISION_WRAPPER_TOKENS = 2
+# Служебные токены chat template на сообщение, если токенизатора нет
+MESSAGE_OVERHEAD_TOKENS = 4
+# Меньше этого изображения не уменьшаются (256 патчей 32x32)
+MIN_DOWNSCALE_PIXELS = 256 * FACTOR * FACTOR
+
+
+class PreflightError(ValueError):
+    """Запрос не помещается в контекст модели"""
+
+
+@dataclass
+class PreflightResult:
+    """Итог проверки"""
+    prompt_tokens: int
+    text_tokens: int
+    image_tokens: int
+    max_model_len: int
+    max_tokens: Optional[int] = None
+    exact: bool = True  # False - оценка без токенизатора модели
+    actions: List[str] = field(default_factory=list)
+
+    def format_report(self) -> str:
+        approx = "" if self.exact else "~"
+        line = (
+            f"🧮 Prompt: {approx}{self.prompt_tokens} токенов "
+            f"(текст {self.text_tokens}, изображения {self.image_tokens}) "
+            f"из {self.max_model_len}"
+        )
+        if self.max_tokens is not None:
+            line += f", max_tokens {self.max_tokens}"
+        for action in self.actions:
+            line += f"\n   ✂️  {action}"
+        return line
+
+
+@lru_cache(maxsize=8)
+def load_tokenizer(name: str):
+    """
+    Токенизатор модели (HF id или локальный путь), один раз на процесс
+
+    None, если transformers не установлен или модель недоступна - тогда
+    текст оценивается по размеру в байтах.
+    """
+    try:
+        from transformers import AutoTokenizer
+    except ImportError:
+        return None
+    try:
+        return AutoTokenizer.from_pretrained(name, trust_remote_code=True)
+    except (OSError, ValueError):
+        return None
+
+
+@lru_cache(maxsize=8)
+def server_model_info(api_url: str) -> Tuple[str, int]:
+    """(исходная модель, max_model_len) из /v1/models"""
+    response = requests.get(f"{api_url}/v1/models", timeout=10)
+    response.raise_for_status()
+    model = response.json()["data"][0]
+    return model.get("root") or model["id"], model["max_model_len"]
+
+
+@lru_cache(maxsize=4096)
+def _cached_image_tokens(
+    image_path: str, mtime_ns: int, size: int, options: Optional[PreprocessOptions]
+) -> int:
+    return image_tokens(image_path, options)
+
+
+def count_image_tokens(image_path: str, options: Optional[PreprocessOptions] = None) -> int:
+    """Токены изображения на сервере, включая vision_start/vision_end"""
+    st = os.stat(image_path)
+    return _cached_image_tokens(image_path, st.st_mtime_ns, st.st_size, options) + VISION_WRAPPER_TOKENS
+
+
+class TokenPreflight:
+    """
+    Локальный подсчет prompt токенов и подгонка запроса под max_model_len
+
+    Args:
+        max_model_len: Контекст сервера
+        tokenizer: HF id/путь токенизатора, готовый токенизатор или None
+                   (оценка по байтам)
+        on_overflow: fit - урезать history и изображения, reject - сразу ошибка
+        min_output_tokens: Сколько токенов ответа должно остаться минимум
+    """
+
+    def __init__(
+        self,
+        max_model_len: int,
+        tokenizer: Any = None,
+        on_overflow: str = "fit",
+        min_output_tokens: int = 16,
+    ):
+        if on_overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"on_overflow: {on_overflow} (доступны: {', '.join(OVERFLOW_POLICIES)})")
+        self.max_model_len = max_model_len
+        self.tokenizer = load_tokenizer(tokenizer) if isinstance(tokenizer, str) else tokenizer
+        self.on_overflow = on_overflow
+        self.min_output_tokens = min_output_tokens
+        self._text_cache: Dict[str, int] = {}
+
+    @classmethod
+    def from_server(cls, api_url: str, tokenizer: Optional[str] = None, **kwargs) -> "TokenPreflight":
+        """max_model_len и модель для токенизатора - из /v1/models сервера"""
+        root, max_model_len = server_model_info(api_url)
+        return cls(max_model_len, tokenizer or root, **kwargs)
+
+    @property
+    def exact(self) -> bool:
+        return self.tokenizer is not None
+
+    # --- подсчет ---
+
+    def count_text(self, messages: List[Dict[str, Any]]) -> int:
+        """Токены сообщений по chat template (изображения уже убраны)"""
+        key = canonical_json(messages)
+        cached = self._text_cache.get(key)
+        if cached is not None:
+            return cached
+
+        if self.tokenizer is not None and getattr(self.tokenizer, "chat_template", None):
+            count = len(self.tokenizer.apply_chat_template(
+                messages, tokenize=True, add_generation_prompt=True
+            ))
+        elif self.tokenizer is not None:
+            count = sum(
+                len(self.tokenizer.encode(m["content"], add_special_tokens=False))
+                + MESSAGE_OVERHEAD_TOKENS
+                for m in messages
+            )
+        else:
+            count = sum(text_tokens(m["content"]) + MESSAGE_OVERHEAD_TOKENS for m in messages)
+
+        if len(self._text_cache) > 65536:
+            self._text_cache.clear()
+        self._text_cache[key] = count
+        return count
+
+    def _text_messages(
+        self,
+        question: str,
+        system: Optional[str],
+        history: Sequence[Dict[str, Any]],
+    ) -> List[Dict[str, Any]]:
+        messages = []
+        if system:
+            messages.append({"role": "system", "content": system})
+        for message in history:
+            content = message.get("content")
+            if isinstance(content, list):
+                # history - текстовые few-shot сообщения, изображения в ней не считаются
+                content = "\n".join(p.get("text", "") for p in content if p.get("type") == "text")
+            messages.append({"role": message["role"], "content": content or ""})
+        messages.append({"role": "user", "content": question})
+        return messages
+
+    def count(
+        self,
+        question: str,
+        image_paths: Optional[Sequence[str]] = None,
+        system: Optional[str] = None,
+        history: Optional[Sequence[Dict[str, Any]]] = None,
+        preprocess: Optional[PreprocessOptions] = None,
+    ) -> Tuple[int, int]:
+        """(текстовые токены, токены изображений)"""
+        text = self.count_text(self._text_messages(question, system, history or []))
+        images = sum(count_image_tokens(path, preprocess) for path in image_paths or [])
+        return text, images
+
+    # --- подгонка ---
+
+    def _downscaled(
+        self, preprocess: Optional[PreprocessOptions], image_paths: Sequence[str], excess: int
+    ) -> Optional[PreprocessOptions]:
+        """Уменьшенные max_pixels, чтобы сэкономить excess токенов (None - нельзя)"""
+        options = preprocess or PreprocessOptions(max_pixels=16384 * FACTOR * FACTOR)
+        current = sum(count_image_tokens(path, options) for path in image_paths)
+        max_pixels = options.max_pixels
+        while max_pixels > MIN_DOWNSCALE_PIXELS:
+            max_pixels = max(MIN_DOWNSCALE_PIXELS, max_pixels // 2)
+            candidate = replace(options, max_pixels=max_pixels, min_pixels=min(options.min_pixels, max_pixels))
+            if current - sum(count_image_tokens(p, candidate) for p in image_paths) >= excess:
+                return candidate
+        return None
+
+    def check(
+        self,
+        question: str,
+        image_paths: Optional[Sequence[str]] = None,
+        system: Optional[str] = None,
+        history: Optional[List[Dict[str, Any]]] = None,
+        preprocess: Optional[PreprocessOptions] = None,
+        max_tokens: Optional[int] = None,
+    ) -> Tuple[List[Dict[str, Any]], Optional[PreprocessOptions], PreflightResult]:
+        """
+        Проверить и при необходимости подогнать запрос
+
+        Returns:
+            (history, preprocess, результат с max_tokens, ограниченным остатком контекста)
+
+        Raises:
+            PreflightError: запрос не помещается даже после подгонки
+        """
+        history = list(history or [])
+        image_paths = list(image_paths or [])
+        budget = self.max_model_len - self.min_output_tokens
+        # Подгонка оставляет место под ответ: запрошенный max_tokens,
+        # но не больше четверти контекста
+        reserve = self.min_output_tokens
+        if max_tokens:
+            reserve = max(reserve, min(max_tokens, self.max_model_len // 4))
+        fit_budget = self.max_model_len - reserve
+        actions = []
+
+        text, images = self.count(question, image_paths, system, history, preprocess)
+
+        if text + images > fit_budget and self.on_overflow == "fit":
+            # 1. Старые сообщения history - по одному с начала
+            dropped = 0
+            while history and text + images > fit_budget:
+                history.pop(0)
+                dropped += 1
+                text = self.count_text(self._text_messages(question, system, history))
+            if dropped:
+                actions.append(f"из history убрано сообщений: {dropped}")
+
+            # 2. Изображения - уменьшить max_pixels
+            if image_paths and text + images > fit_budget:
+                smaller = self._downscaled(preprocess, image_paths, text + images - fit_budget)
+                if smaller is not None:
+                    before = images
+                    preprocess = smaller
+                    images = sum(count_image_tokens(p, preprocess) for p in image_paths)
+                    actions.append(
+                        f"изображения уменьшены до {preprocess.max_pixels} пикселей: "
+                        f"{before} -> {images} токенов"
+                    )
+
+        prompt = text + images
+        if prompt > budget:
+            raise PreflightError(
+                f"Запрос не помещается в контекст: {prompt} prompt токенов + "
+                f"минимум {self.min_output_tokens} на ответ > max_model_len {self.max_model_len}"
+            )
+
+        available = self.max_model_len - prompt
+        if max_tokens is None or max_tokens > available:
+            if max_tokens is not None:
+                actions.append(f"max_tokens {max_tokens} -> {available}")
+            max_tokens = available
+
+        result = PreflightResult(
+            prompt_tokens=prompt,
+            text_tokens=text,
+            image_tokens=images,
+            max_model_len=self.max_model_len,
+            max_tokens=max_tokens,
+            exact=self.exact,
+            actions=actions,
+        )
+        return history, preprocess, result
+
+
+def add_preflight_arguments(parser) -> None:
+    """Общие флаги preflight для CLI"""
+    parser.add_argument(
+        "--preflight",
+        action="store_true",
+        help="Считать prompt токены до отправки (max_model_len из /v1/models): "
+             "урезать history/изображения и max_tokens под контекст"
+    )
+
+    parser.add_argument(
+        "--tokenizer",
+        help="Токенизатор для --preflight (по умолчанию: модель сервера из /v1/models)"
+    )
+
+
+def preflight_from_args(args) -> Optional[TokenPreflight]:
+    """TokenPreflight из флагов add_preflight_arguments() (None если выключен)"""
+    if not args.preflight:
+        return None
+    return TokenPreflight.from_server(args.api_url, args.tokenizer)
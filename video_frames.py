@@ -0,0 +1,396 @@
+#!/usr/bin/env python3
+"""
+Выбор ключевых кадров видео для VLM
+
+Профиль VLM разрешает ограниченное число изображений в промпте
+(limit_mm_per_prompt: {image: 10}), и равномерно взятые кадры почти
+одинаковых сцен тратят этот бюджет и время prefill впустую. Здесь:
+
+- кадры декодируются потоком (cv2.VideoCapture), в памяти только текущий
+  кадр и не больше max_frames кандидатов, уже уменьшенных до бюджета пикселей
+- каждый кадр с шагом --video-fps получает оценку смены сцены: расстояние
+  между HSV гистограммами соседних отобранных кадров (0 - та же сцена, 1 - другая)
+- почти одинаковые кадры отбрасываются по perceptual hash (dHash, 64 бита)
+  и расстоянию Хэмминга
+- отправляются max_frames кадров с наибольшей оценкой, в порядке времени
+
+Запуск:
+    python vllm_image_cli.py --video clip.mp4 -q "Что происходит?" --max-frames 8
+    python video_frames.py --video clip.mp4 --frames-dir frames/   # только выбор кадров
+"""
+
+import argparse
+import contextlib
+import heapq
+import os
+import tempfile
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Iterator, List, Optional
+
+from image_preprocess import PreprocessOptions, server_vision_tokens, target_size
+
+# Шаг выборки по умолчанию: кадров в секунду видео
+DEFAULT_SAMPLE_FPS = 1.0
+
+# Совпадает с limit_mm_per_prompt: {image: 10} в models.yaml
+DEFAULT_MAX_FRAMES = 10
+
+# Кадры с dHash ближе этого числа бит (из 64) считаются одинаковыми
+DEFAULT_HASH_THRESHOLD = 6
+
+# Сетка HSV гистограммы (H, S) для оценки смены сцены
+HIST_BINS = (16, 16)
+
+
+def _cv2():
+    try:
+        import cv2
+    except ImportError:
+        raise RuntimeError(
+            "Для видео нужен OpenCV: pip install opencv-python-headless "
+            "(ставится вместе с vllm)"
+        ) from None
+    return cv2
+
+
+def dhash(gray) -> int:
+    """
+    Difference hash по grayscale кадру 8x9 (строки x столбцы): бит на
+    каждую пару соседних пикселей строки, 1 если правый ярче
+    """
+    bits = (gray[:, 1:] > gray[:, :-1]).flatten()
+    value = 0
+    for bit in bits:
+        value = (value << 1) | int(bit)
+    return value
+
+
+def hamming(a: int, b: int) -> int:
+    """Число различающихся бит двух хэшей"""
+    return (a ^ b).bit_count()
+
+
+@dataclass
+class Candidate:
+    """Кадр-кандидат: метаданные, хэш, оценка и уменьшенное изображение"""
+    index: int
+    timestamp: float
+    score: float
+    hash: int
+    image: Any = field(default=None, repr=False)
+
+    def __lt__(self, other: "Candidate") -> bool:
+        # Для heapq: при равной оценке вытесняется более поздний кадр
+        return (self.score, -self.index) < (other.score, -other.index)
+
+
+class FrameSelector:
+    """
+    Потоковый выбор до max_frames самых информативных кадров
+
+    Кандидаты хранятся в min-heap по оценке, поэтому память ограничена
+    max_frames изображениями при любой длине видео. Кадр отбрасывается как
+    дубликат, если его хэш близок к предыдущему кадру или к одному из
+    кандидатов.
+    """
+
+    def __init__(
+        self,
+        max_frames: int = DEFAULT_MAX_FRAMES,
+        hash_threshold: int = DEFAULT_HASH_THRESHOLD,
+    ):
+        if max_frames < 1:
+            raise ValueError("max_frames должен быть >= 1")
+        self.max_frames = max_frames
+        self.hash_threshold = hash_threshold
+        self.considered = 0
+        self.duplicates = 0
+        self._heap: List[Candidate] = []
+        self._previous: Optional[int] = None
+
+    def is_duplicate(self, frame_hash: int) -> bool:
+        hashes = [c.hash for c in self._heap]
+        if self._previous is not None:
+            hashes.append(self._previous)
+        return any(hamming(frame_hash, h) <= self.hash_threshold for h in hashes)
+
+    def offer(self, candidate: Candidate, load: Optional[Callable[[], Any]] = None) -> bool:
+        """
+        Учесть кадр; True если он стал кандидатом. load() вызывается только
+        для принятого кадра и возвращает его изображение
+        """
+        self.considered += 1
+        duplicate = self.is_duplicate(candidate.hash)
+        self._previous = candidate.hash
+        if duplicate:
+            self.duplicates += 1
+            return False
+        full = len(self._heap) >= self.max_frames
+        if full and candidate.score <= self._heap[0].score:
+            return False
+        if load is not None:
+            candidate.image = load()
+        if full:
+            heapq.heapreplace(self._heap, candidate)
+        else:
+            heapq.heappush(self._heap, candidate)
+        return True
+
+    def selected(self) -> List[Candidate]:
+        """Кандидаты в порядке времени"""
+        return sorted(self._heap, key=lambda c: c.index)
+
+
+@dataclass(frozen=True)
+class VideoOptions:
+    """Параметры выбора кадров"""
+    sample_fps: float = DEFAULT_SAMPLE_FPS
+    max_frames: int = DEFAULT_MAX_FRAMES
+    hash_threshold: int = DEFAULT_HASH_THRESHOLD
+
+
+@dataclass
+class VideoFrame:
+    """Отобранный кадр, записанный в файл"""
+    index: int
+    timestamp: float
+    score: float
+    path: str
+    size: tuple[int, int]  # (width, height)
+
+    @property
+    def tokens(self) -> int:
+        # Сервер сам выровняет кадр по сетке патчей
+        return server_vision_tokens(self.size[1], self.size[0])
+
+
+@dataclass
+class VideoSelection:
+    """Результат выбора кадров и оценка экономии vision токенов"""
+    path: str
+    fps: float
+    total_frames: int
+    considered: int
+    duplicates: int
+    frames: List[VideoFrame]
+    max_frames: int
+
+    @property
+    def tokens_per_frame(self) -> int:
+        return self.frames[0].tokens if self.frames else 0
+
+    @property
+    def tokens(self) -> int:
+        return sum(f.tokens for f in self.frames)
+
+    @property
+    def tokens_all(self) -> int:
+        """Все рассмотренные кадры в том же бюджете пикселей"""
+        return self.considered * self.tokens_per_frame
+
+    @property
+    def tokens_uniform(self) -> int:
+        """max_frames равномерно взятых кадров (прежний способ)"""
+        return min(self.max_frames, self.considered) * self.tokens_per_frame
+
+    def format_report(self) -> str:
+        duration = self.total_frames / self.fps if self.fps else 0.0
+        lines = [
+            f"🎞️  {Path(self.path).name}: {duration:.1f} s, {self.fps:.1f} fps, "
+            f"{self.total_frames} кадров",
+            f"   Рассмотрено: {self.considered}, дубликатов: {self.duplicates}, "
+            f"отправляется: {len(self.frames)}",
+            f"   Vision токенов: ~{self.tokens} "
+            f"(все рассмотренные: ~{self.tokens_all}, -{self.tokens_all - self.tokens}; "
+            f"{min(self.max_frames, self.considered)} равномерных: ~{self.tokens_uniform}, "
+            f"-{self.tokens_uniform - self.tokens})",
+        ]
+        for f in self.frames:
+            lines.append(f"   • {f.timestamp:7.2f} s  кадр {f.index:<6} сцена {f.score:.2f}")
+        return "\n".join(lines)
+
+
+class SceneScorer:
+    """Оценка смены сцены относительно предыдущего отобранного кадра"""
+
+    def __init__(self):
+        self._previous = None
+
+    def score(self, frame) -> float:
+        cv2 = _cv2()
+        hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+        hist = cv2.calcHist([hsv], [0, 1], None, list(HIST_BINS), [0, 180, 0, 256])
+        cv2.normalize(hist, hist)
+        previous, self._previous = self._previous, hist
+        if previous is None:
+            return 1.0
+        return float(cv2.compareHist(previous, hist, cv2.HISTCMP_BHATTACHARYYA))
+
+
+def frame_hash(frame) -> int:
+    """dHash кадра BGR"""
+    cv2 = _cv2()
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    return dhash(cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA))
+
+
+def iter_frames(capture, step: int) -> Iterator[tuple[int, Any]]:
+    """
+    (номер, кадр BGR) каждого step-го кадра; остальные только
+    grab() без преобразования в изображение
+    """
+    index = 0
+    while capture.grab():
+        if index % step == 0:
+            ok, frame = capture.retrieve()
+            if ok:
+                yield index, frame
+        index += 1
+
+
+def resize_to_budget(frame, preprocess: PreprocessOptions):
+    """Уменьшить кадр до бюджета пикселей (небольшие кадры не трогаем)"""
+    cv2 = _cv2()
+    height, width = frame.shape[:2]
+    h, w = target_size(height, width, preprocess)
+    if (h, w) == (height, width):
+        return frame
+    return cv2.resize(frame, (w, h), interpolation=cv2.INTER_AREA)
+
+
+def select_frames(
+    video_path: str,
+    output_dir: str,
+    options: VideoOptions = VideoOptions(),
+    preprocess: PreprocessOptions = PreprocessOptions(),
+) -> VideoSelection:
+    """
+    Выбрать кадры видео и записать их в output_dir как JPEG
+
+    Кадры уже уменьшены до бюджета пикселей preprocess, так что при
+    отправке повторное уменьшение не требуется.
+    """
+    cv2 = _cv2()
+    capture = cv2.VideoCapture(video_path)
+    if not capture.isOpened():
+        raise ValueError(f"Не удалось открыть видео: {video_path}")
+
+    try:
+        fps = capture.get(cv2.CAP_PROP_FPS) or 25.0
+        step = max(1, round(fps / options.sample_fps))
+        selector = FrameSelector(options.max_frames, options.hash_threshold)
+        scorer = SceneScorer()
+        last = -1
+        for last, frame in iter_frames(capture, step):
+            candidate = Candidate(last, last / fps, scorer.score(frame), frame_hash(frame))
+            # Уменьшенная копия хранится только для принятых кадров
+            selector.offer(candidate, lambda: resize_to_budget(frame, preprocess))
+        total = int(capture.get(cv2.CAP_PROP_FRAME_COUNT)) or last + 1
+    finally:
+        capture.release()
+
+    os.makedirs(output_dir, exist_ok=True)
+    stem = Path(video_path).stem
+    frames = []
+    for c in selector.selected():
+        path = os.path.join(output_dir, f"{stem}_{c.index:06d}.jpg")
+        cv2.imwrite(path, c.image, [cv2.IMWRITE_JPEG_QUALITY, preprocess.quality])
+        height, width = c.image.shape[:2]
+        frames.append(VideoFrame(c.index, c.timestamp, c.score, path, (width, height)))
+
+    return VideoSelection(
+        path=video_path,
+        fps=fps,
+        total_frames=total,
+        considered=selector.considered,
+        duplicates=selector.duplicates,
+        frames=frames,
+        max_frames=options.max_frames,
+    )
+
+
+def frames_dir(directory: Optional[str]):
+    """Контекст с директорией для кадров: заданная или временная (удаляется)"""
+    if directory:
+        return contextlib.nullcontext(directory)
+    return tempfile.TemporaryDirectory(prefix="vllm-video-")
+
+
+# --- CLI флаги для клиентов ---
+
+def add_video_arguments(parser) -> None:
+    """Общие флаги видео для CLI"""
+    parser.add_argument(
+        "--video",
+        metavar="FILE",
+        help="Видео: отправить ключевые кадры (смена сцены, без почти одинаковых кадров)"
+    )
+
+    parser.add_argument(
+        "--max-frames",
+        type=int,
+        default=DEFAULT_MAX_FRAMES,
+        help=f"Максимум кадров в запросе, не больше limit_mm_per_prompt сервера "
+             f"(по умолчанию: {DEFAULT_MAX_FRAMES})"
+    )
+
+    parser.add_argument(
+        "--video-fps",
+        type=float,
+        default=DEFAULT_SAMPLE_FPS,
+        help=f"Сколько кадров в секунду видео рассматривать (по умолчанию: {DEFAULT_SAMPLE_FPS})"
+    )
+
+    parser.add_argument(
+        "--dedup-threshold",
+        type=int,
+        default=DEFAULT_HASH_THRESHOLD,
+        help=f"Кадры с dHash ближе стольких бит из 64 считаются одинаковыми "
+             f"(по умолчанию: {DEFAULT_HASH_THRESHOLD}, 0 - только точные совпадения)"
+    )
+
+    parser.add_argument(
+        "--frames-dir",
+        help="Сохранить выбранные кадры в директорию (по умолчанию: временная)"
+    )
+
+
+def video_options_from_args(args) -> VideoOptions:
+    """VideoOptions из флагов add_video_arguments()"""
+    if args.max_frames < 1 or args.video_fps <= 0:
+        raise ValueError("--max-frames должен быть >= 1, --video-fps > 0")
+    return VideoOptions(
+        sample_fps=args.video_fps,
+        max_frames=args.max_frames,
+        hash_threshold=args.dedup_threshold,
+    )
+
+
+def main():
+    from image_preprocess import add_preprocess_arguments
+
+    parser = argparse.ArgumentParser(description="Выбор ключевых кадров видео для VLM")
+    add_video_arguments(parser)
+    add_preprocess_arguments(parser)
+    args = parser.parse_args()
+
+    if not args.video or not args.frames_dir:
+        parser.error("нужны --video и --frames-dir")
+    try:
+        selection = select_frames(
+            args.video,
+            args.frames_dir,
+            video_options_from_args(args),
+            PreprocessOptions(max_pixels=args.max_pixels, quality=args.image_quality),
+        )
+    except (RuntimeError, ValueError) as e:
+        print(f"❌ {e}")
+        return 1
+    print(selection.format_report())
+    print(f"💾 Кадры: {args.frames_dir}")
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -4,28 +4,23 @@ CLI для работы с изображениями в vLLM
 """
 
 import argparse
-import base64
 import requests
 from pathlib import Path
-from typing import List
+from typing import List, Optional
 
-def encode_image(image_path: str) -> tuple[str, str]:
-    """Кодировать изображение и определить MIME type"""
-    ext = Path(image_path).suffix.lower()
-    mime_types = {
-        '.jpg': 'image/jpeg',
-        '.jpeg': 'image/jpeg',
-        '.png': 'image/png',
-        '.gif': 'image/gif',
-        '.webp': 'image/webp',
-        '.bmp': 'image/bmp',
-    }
-    mime_type = mime_types.get(ext, 'image/jpeg')
-    
-    with open(image_path, "rb") as f:
-        base64_data = base64.b64encode(f.read()).decode("utf-8")
-    
-    return base64_data, mime_type
+from adaptive_concurrency import AdaptiveConcurrency, print_decision
+from client_tracing import add_tracing_arguments, trace_request, tracer_from_args
+from image_cache import ImageCache, add_cache_arguments, cache_from_args
+from image_preprocess import (
+    PreprocessOptions,
+    add_preprocess_arguments,
+    options_from_args,
+    print_report,
+)
+from media_transport import MediaTransport, add_transport_arguments
+from streaming import stream_chat_completion
+from token_preflight import TokenPreflight, add_preflight_arguments, preflight_from_args
+from video_frames import add_video_arguments, frames_dir, select_frames, video_options_from_args
 
 def ask_vllm(
     question: str,
@@ -33,35 +28,83 @@ def ask_vllm(
     api_url: str = "http://localhost:8000",
     max_tokens: int = 500,
     temperature: float = 0.7,
+    stream: bool = False,
+    preprocess: Optional[PreprocessOptions] = None,
+    image_cache: Optional[ImageCache] = None,
+    transport: Optional[MediaTransport] = None,
+    preflight: Optional[TokenPreflight] = None,
 ):
-    """Отправить запрос с изображениями в vLLM"""
+    """
+    Отправить запрос с изображениями в vLLM
+    
+    При stream=True ответ печатается по мере генерации, а в конце
+    выводится статистика TTFT / inter-token latency / tokens/s.
+    С preprocess изображения уменьшаются до бюджета пикселей перед base64,
+    image_cache избавляет от повторного чтения/подготовки тех же файлов.
+    transport задает способ передачи (по умолчанию base64 data URI).
+    preflight до отправки подгоняет изображения и max_tokens под контекст.
+    """
     
-    # Формируем content
-    content = [{"type": "text", "text": question}]
+    if transport is None:
+        transport = MediaTransport("data", api_url, image_cache)
+    
+    if preflight is not None:
+        _, preprocess, budget = preflight.check(
+            question, image_paths, preprocess=preprocess, max_tokens=max_tokens
+        )
+        max_tokens = budget.max_tokens
+        print(budget.format_report())
+    
+    # Формируем content: изображения до вопроса, чтобы повторные вопросы
+    # к тем же изображениям попадали в prefix cache сервера
+    content = []
     
     # Добавляем изображения
     for image_path in image_paths:
         print(f"📸 Загрузка: {image_path}")
-        base64_image, mime_type = encode_image(image_path)
+        url = transport.image_url(image_path, preprocess, print_report)
         
         content.append({
             "type": "image_url",
             "image_url": {
-                "url": f"data:{mime_type};base64,{base64_image}"
+                "url": url
             }
         })
     
+    content.append({"type": "text", "text": question})
+    
     print(f"🚀 Отправка запроса...")
     
+    payload = {
+        "model": "vllm-model",
+        "messages": [{"role": "user", "content": content}],
+        "max_tokens": max_tokens,
+        "temperature": temperature,
+    }
+    
+    if stream:
+        print()
+        print("=" * 80)
+        print("💬 ОТВЕТ")
+        print("=" * 80)
+        print()
+        answer, stats = stream_chat_completion(
+            requests,
+            f"{api_url}/v1/chat/completions",
+            payload,
+            on_token=lambda text: print(text, end="", flush=True),
+            timeout=120,
+        )
+        print()
+        print()
+        print(stats.format_report())
+        print()
+        return answer
+    
     # Запрос
     response = requests.post(
         f"{api_url}/v1/chat/completions",
-        json={
-            "model": "vllm-model",
-            "messages": [{"role": "user", "content": content}],
-            "max_tokens": max_tokens,
-            "temperature": temperature,
-        },
+        json=payload,
         timeout=120
     )
     
@@ -71,6 +114,156 @@ def ask_vllm(
     else:
         raise Exception(f"API Error: {response.status_code} - {response.text}")
 
+def run_batch_mode(args) -> int:
+    """vllm_image_cli.py --batch: много задач параллельно в JSONL"""
+    from batch_runner import load_jobs, run_batch_sync
+    from prefix_scheduler import schedule_batch_jobs
+    from query_qwen3vl import AsyncQwen3VLClient
+    
+    image_cache = cache_from_args(args)
+    concurrency = None
+    if args.adaptive_concurrency:
+        concurrency = AdaptiveConcurrency(
+            initial=min(8, args.concurrency),
+            max_limit=args.concurrency,
+            ttft_target=args.ttft_target,
+            log_path=args.concurrency_log,
+            on_decision=print_decision,
+        )
+    client = AsyncQwen3VLClient(
+        api_url=args.api_url,
+        max_concurrency=args.concurrency,
+        preprocess=options_from_args(args),
+        image_cache=image_cache or False,
+        transport=MediaTransport(
+            args.transport, args.api_url, image_cache, http_port=args.media_port
+        ),
+        concurrency=concurrency,
+    )
+    client.preflight = preflight_from_args(args)
+    client.tracer = tracer_from_args(args)
+    # Те же параметры генерации, что и в одиночном режиме этого CLI
+    client.default_params = {
+        "max_tokens": args.max_tokens,
+        "temperature": args.temperature,
+    }
+    
+    print("=" * 80)
+    print("🖼️  vLLM Vision CLI - batch")
+    print("=" * 80)
+    print()
+    print(f"Источник: {args.batch}")
+    print(f"Вывод: {args.output}")
+    if concurrency is not None:
+        print(f"Параллельно: адаптивно, до {args.concurrency} (цель TTFT {args.ttft_target} s)")
+    else:
+        print(f"Параллельно: {args.concurrency}")
+    print(f"API: {args.api_url}")
+    print()
+    
+    try:
+        jobs = load_jobs(args.batch, args.question)
+        if args.prefix_order:
+            jobs, before, after = schedule_batch_jobs(
+                list(jobs), client.preprocess, image_cache
+            )
+            print(f"🧩 Prefix cache, исходный порядок:     {before.format_report()}")
+            print(f"🧩 Prefix cache, после группировки:    {after.format_report()}")
+            print()
+        # Поток нужен, чтобы измерять TTFT для адаптивного окна
+        summary = run_batch_sync(
+            client, jobs, args.output, stream=concurrency is not None
+        )
+    except (OSError, ValueError) as e:
+        print(f"\n❌ Ошибка: {e}\n")
+        return 1
+    finally:
+        client.transport.close()
+    
+    print()
+    print(summary.format_report())
+    if image_cache is not None and image_cache.stats.requests:
+        print(image_cache.stats.format_report())
+    print()
+    return 1 if summary.failed else 0
+
+def run_single_mode(args, image_paths: List[str]) -> int:
+    """Один запрос с изображениями image_paths"""
+    image_cache = cache_from_args(args)
+    transport = MediaTransport(
+        args.transport, args.api_url, image_cache, http_port=args.media_port
+    )
+    
+    print("=" * 80)
+    print("🖼️  vLLM Vision CLI")
+    print("=" * 80)
+    print()
+    print(f"Изображений: {len(image_paths)}")
+    print(f"Вопрос: {args.question}")
+    print(f"API: {args.api_url}")
+    if transport.mode != "data":
+        print(f"Передача изображений: {transport.mode}")
+    print()
+    
+    try:
+        with trace_request(tracer_from_args(args), "ask", images=len(image_paths)):
+            result = ask_vllm(
+                question=args.question,
+                image_paths=image_paths,
+                api_url=args.api_url,
+                max_tokens=args.max_tokens,
+                temperature=args.temperature,
+                stream=args.stream,
+                preprocess=options_from_args(args),
+                image_cache=image_cache,
+                transport=transport,
+                preflight=preflight_from_args(args),
+            )
+        
+        if not args.stream:
+            print()
+            print("=" * 80)
+            print("💬 ОТВЕТ")
+            print("=" * 80)
+            print()
+            print(result)
+            print()
+        
+        if image_cache is not None and image_cache.stats.requests:
+            print(image_cache.stats.format_report())
+            print()
+        
+    except Exception as e:
+        print(f"\n❌ Ошибка: {e}\n")
+        return 1
+    
+    finally:
+        transport.close()
+    
+    return 0
+
+def run_video_mode(args) -> int:
+    """vllm_image_cli.py --video: ключевые кадры видео вместе с изображениями"""
+    preprocess = options_from_args(args) or PreprocessOptions(
+        max_pixels=args.max_pixels, quality=args.image_quality
+    )
+    
+    with frames_dir(args.frames_dir) as directory:
+        try:
+            selection = select_frames(
+                args.video, directory, video_options_from_args(args), preprocess
+            )
+        except (RuntimeError, ValueError) as e:
+            print(f"❌ Ошибка: {e}")
+            return 1
+        print(selection.format_report())
+        print()
+        if not selection.frames:
+            print(f"❌ В видео нет кадров: {args.video}")
+            return 1
+        # Кадры уже уменьшены до бюджета пикселей
+        return run_single_mode(args, args.images + [f.path for f in selection.frames])
+
 def main():
     parser = argparse.ArgumentParser(
         description="Отправка изображений в vLLM Vision модель"
@@ -78,14 +271,13 @@ def main():
     
     parser.add_argument(
         "images",
-        nargs="+",
+        nargs="*",
         help="Путь к изображению(ям)"
     )
     
     parser.add_argument(
         "-q", "--question",
-        required=True,
-        help="Вопрос об изображении"
+        help="Вопрос об изображении (в batch режиме - общий для задач без своего)"
     )
     
     parser.add_argument(
@@ -108,45 +300,85 @@ def main():
         help="Temperature для генерации"
     )
     
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Печатать ответ по мере генерации и показать TTFT/ITL/tokens/s"
+    )
+    
+    add_preprocess_arguments(parser)
+    add_cache_arguments(parser)
+    add_transport_arguments(parser)
+    add_preflight_arguments(parser)
+    add_tracing_arguments(parser)
+    add_video_arguments(parser)
+    
+    parser.add_argument(
+        "--batch",
+        metavar="SOURCE",
+        help="Batch режим: директория, glob ('imgs/**/*.jpg') или JSONL манифест "
+             "{\"id\", \"images\", \"question\", \"system\", \"history\", \"params\"}"
+    )
+    
+    parser.add_argument(
+        "--output",
+        default="batch_results.jsonl",
+        help="JSONL с результатами batch режима, при повторном запуске "
+             "завершенные задачи пропускаются (по умолчанию: batch_results.jsonl)"
+    )
+    
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=32,
+        help="Максимум запросов в полете в batch режиме (по умолчанию: 32)"
+    )
+    
+    parser.add_argument(
+        "--prefix-order",
+        action="store_true",
+        help="Batch режим: сгруппировать задачи с общим system prompt/изображениями "
+             "для prefix cache сервера и показать оценку переиспользования"
+    )
+    
+    parser.add_argument(
+        "--adaptive-concurrency",
+        action="store_true",
+        help="Batch режим: подбирать число запросов в полете (AIMD) по TTFT, "
+             "429/503 и /metrics сервера; --concurrency - верхняя граница"
+    )
+    
+    parser.add_argument(
+        "--ttft-target",
+        type=float,
+        default=2.0,
+        help="Цель TTFT в секундах для --adaptive-concurrency (по умолчанию: 2.0)"
+    )
+    
+    parser.add_argument(
+        "--concurrency-log",
+        help="JSONL файл с решениями --adaptive-concurrency (для подбора параметров)"
+    )
+    
     args = parser.parse_args()
     
+    if args.batch:
+        return run_batch_mode(args)
+    
+    if not args.images and not args.video:
+        parser.error("нужен хотя бы один путь к изображению, --video или --batch")
+    if not args.question:
+        parser.error("нужен --question")
+    
     # Проверка существования файлов
-    for image_path in args.images:
+    for image_path in args.images + ([args.video] if args.video else []):
         if not Path(image_path).exists():
             print(f"❌ Файл не найден: {image_path}")
             return 1
     
-    print("=" * 80)
-    print("🖼️  vLLM Vision CLI")
-    print("=" * 80)
-    print()
-    print(f"Изображений: {len(args.images)}")
-    print(f"Вопрос: {args.question}")
-    print(f"API: {args.api_url}")
-    print()
-    
-    try:
-        result = ask_vllm(
-            question=args.question,
-            image_paths=args.images,
-            api_url=args.api_url,
-            max_tokens=args.max_tokens,
-            temperature=args.temperature,
-        )
-        
-        print()
-        print("=" * 80)
-        print("💬 ОТВЕТ")
-        print("=" * 80)
-        print()
-        print(result)
-        print()
-        
-    except Exception as e:
-        print(f"\n❌ Ошибка: {e}\n")
-        return 1
-    
-    return 0
+    if args.video:
+        return run_video_mode(args)
+    return run_single_mode(args, args.images)
 
 if __name__ == "__main__":
     exit(main())
\ No newline at end of file
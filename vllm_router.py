@@ -0,0 +1,386 @@
+#!/usr/bin/env python3
+"""
+Локальный роутер перед несколькими vLLM серверами с тем же OpenAI API
+
+- health check реплик (/health), исключение и возврат по результату
+- маршрутизация: least-outstanding или prefix affinity (одинаковый
+  system prompt -> одна и та же реплика, где он уже в prefix cache)
+- drain: реплика перестает получать новые запросы, текущие дорабатывают
+- потоковые ответы проксируются по мере поступления, без буферизации
+
+Запуск:
+    python vllm_router.py --backend http://localhost:8001 --backend http://localhost:8002
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+import aiohttp
+from aiohttp import web
+
+POLICIES = ("least-outstanding", "prefix")
+
+# Заголовки, которые нельзя копировать между соединениями. Content-Encoding
+# end-to-end: сессия не распаковывает ответ (auto_decompress=False), и
+# сжатое тело уходит клиенту вместе со своим заголовком
+HOP_BY_HOP = {
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization",
+    "te", "trailers", "transfer-encoding", "upgrade", "content-length",
+}
+
+
+@dataclass
+class Backend:
+    """Состояние одной реплики"""
+    url: str
+    healthy: bool = True
+    draining: bool = False
+    outstanding: int = 0
+    failures: int = 0
+    total: int = 0
+    errors: int = 0
+    last_check: float = 0.0
+    last_error: Optional[str] = None
+
+    @property
+    def available(self) -> bool:
+        return self.healthy and not self.draining
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "draining": self.draining,
+            "outstanding": self.outstanding,
+            "requests": self.total,
+            "errors": self.errors,
+            "last_error": self.last_error,
+        }
+
+
+def prefix_key(body: Dict[str, Any], max_chars: int = 2048) -> Optional[str]:
+    """
+    Ключ affinity: system prompt, а без него - начало первого сообщения
+
+    Запросы с одинаковым началом промпта попадают на одну реплику и
+    переиспользуют ее prefix cache.
+    """
+    messages = body.get("messages")
+    if messages is None:
+        prompt = body.get("prompt")
+        return prompt[:max_chars] if isinstance(prompt, str) else None
+
+    def text_of(message) -> str:
+        content = message.get("content")
+        if isinstance(content, str):
+            return content
+        parts = []
+        for part in content or []:
+            if part.get("type") == "text":
+                parts.append(part.get("text", ""))
+            elif part.get("type") == "image_url":
+                # data URI может быть мегабайтным - берем хэш
+                url = part["image_url"]["url"]
+                parts.append(hashlib.sha1(url.encode()).hexdigest())
+        return "\n".join(parts)
+
+    system = [text_of(m) for m in messages if m.get("role") == "system"]
+    if system:
+        return "\n".join(system)[:max_chars]
+    if messages:
+        return text_of(messages[0])[:max_chars]
+    return None
+
+
+def rendezvous_pick(key: str, backends: List[Backend]) -> Backend:
+    """Highest random weight hashing: при выпадении реплики переезжают только ее ключи"""
+    return max(
+        backends,
+        key=lambda b: hashlib.sha1(f"{key}|{b.url}".encode()).digest(),
+    )
+
+
+class Router:
+    def __init__(
+        self,
+        backends: List[str],
+        policy: str = "least-outstanding",
+        affinity_slack: int = 8,
+        health_interval: float = 5.0,
+        eject_after: int = 3,
+        timeout: float = 600,
+    ):
+        self.backends = [Backend(url.rstrip("/")) for url in backends]
+        self.policy = policy
+        self.affinity_slack = affinity_slack
+        self.health_interval = health_interval
+        self.eject_after = eject_after
+        self.timeout = timeout
+        self.session: Optional[aiohttp.ClientSession] = None
+        self._health_task: Optional[asyncio.Task] = None
+
+    # --- выбор реплики ---
+
+    def choose(self, body: Dict[str, Any], exclude: Optional[set] = None) -> Optional[Backend]:
+        candidates = [b for b in self.backends if b.available and b.url not in (exclude or set())]
+        if not candidates:
+            return None
+        least = min(b.outstanding for b in candidates)
+
+        if self.policy == "prefix":
+            key = prefix_key(body)
+            if key:
+                preferred = rendezvous_pick(key, candidates)
+                # Bounded load: не перегружать "горячую" реплику ради cache hit
+                if preferred.outstanding - least <= self.affinity_slack:
+                    return preferred
+
+        return random.choice([b for b in candidates if b.outstanding == least])
+
+    # --- health check ---
+
+    def _mark_failure(self, backend: Backend, error: str) -> None:
+        backend.failures += 1
+        backend.errors += 1
+        backend.last_error = error
+        if backend.healthy and backend.failures >= self.eject_after:
+            backend.healthy = False
+            print(f"⚠️  Реплика исключена: {backend.url} ({error})")
+
+    def _mark_success(self, backend: Backend) -> None:
+        backend.failures = 0
+        if not backend.healthy:
+            backend.healthy = True
+            print(f"✅ Реплика вернулась: {backend.url}")
+
+    async def check_backend(self, backend: Backend) -> None:
+        backend.last_check = time.time()
+        try:
+            async with self.session.get(
+                f"{backend.url}/health", timeout=aiohttp.ClientTimeout(total=2)
+            ) as response:
+                if response.status == 200:
+                    self._mark_success(backend)
+                else:
+                    self._mark_failure(backend, f"/health {response.status}")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self._mark_failure(backend, f"/health: {e.__class__.__name__}")
+
+    async def _health_loop(self) -> None:
+        while True:
+            await asyncio.gather(*(self.check_backend(b) for b in self.backends))
+            await asyncio.sleep(self.health_interval)
+
+    async def on_startup(self, app: web.Application) -> None:
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=0, keepalive_timeout=60),
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+            auto_decompress=False,
+        )
+        self._health_task = asyncio.create_task(self._health_loop())
+
+    async def on_cleanup(self, app: web.Application) -> None:
+        if self._health_task:
+            self._health_task.cancel()
+        await self.session.close()
+
+    # --- проксирование ---
+
+    async def proxy(self, request: web.Request) -> web.StreamResponse:
+        raw = await request.read()
+        try:
+            body = json.loads(raw) if raw else {}
+        except ValueError:
+            body = {}
+
+        tried: set = set()
+        while True:
+            backend = self.choose(body, exclude=tried)
+            if backend is None:
+                return web.json_response(
+                    {"object": "error", "message": "Нет доступных реплик", "code": 503},
+                    status=503,
+                )
+            tried.add(backend.url)
+
+            backend.outstanding += 1
+            backend.total += 1
+            try:
+                return await self._forward(request, backend, raw)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                # Повтор на другой реплике возможен, только если клиенту еще ничего
+                # не ушло; обрыв посреди ответа (в т.ч. отключение клиента) - как есть
+                if request.get("response_started"):
+                    raise
+                self._mark_failure(backend, e.__class__.__name__)
+            finally:
+                backend.outstanding -= 1
+
+    async def _forward(self, request: web.Request, backend: Backend, raw: bytes) -> web.StreamResponse:
+        headers = {k: v for k, v in request.headers.items()
+                   if k.lower() not in HOP_BY_HOP and k.lower() != "host"}
+        async with self.session.request(
+            request.method,
+            f"{backend.url}{request.rel_url}",
+            data=raw or None,
+            headers=headers,
+        ) as upstream:
+            if upstream.status >= 500:
+                self._mark_failure(backend, f"HTTP {upstream.status}")
+            else:
+                self._mark_success(backend)
+
+            response = web.StreamResponse(
+                status=upstream.status,
+                headers={k: v for k, v in upstream.headers.items()
+                         if k.lower() not in HOP_BY_HOP},
+            )
+            response.headers["X-Router-Backend"] = backend.url
+            await response.prepare(request)
+            request["response_started"] = True
+            # Чанки уходят клиенту сразу; при отключении клиента handler
+            # отменяется, upstream соединение закрывается и vLLM прерывает запрос
+            async for chunk in upstream.content.iter_any():
+                await response.write(chunk)
+            await response.write_eof()
+            return response
+
+    # --- служебные endpoints ---
+
+    async def health(self, request: web.Request) -> web.Response:
+        ok = any(b.available for b in self.backends)
+        return web.Response(status=200 if ok else 503)
+
+    async def status(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            "policy": self.policy,
+            "backends": [b.to_dict() for b in self.backends],
+        })
+
+    def _find(self, request: web.Request) -> Optional[Backend]:
+        url = request.query.get("backend", "").rstrip("/")
+        return next((b for b in self.backends if b.url == url), None)
+
+    async def drain(self, request: web.Request) -> web.Response:
+        backend = self._find(request)
+        if backend is None:
+            return web.json_response({"error": "unknown backend"}, status=404)
+        backend.draining = True
+        print(f"🚰 Drain: {backend.url} (в работе: {backend.outstanding})")
+        # wait=1: ответить, когда текущие запросы реплики завершатся
+        if request.query.get("wait"):
+            while backend.outstanding:
+                await asyncio.sleep(0.1)
+        return web.json_response(backend.to_dict())
+
+    async def undrain(self, request: web.Request) -> web.Response:
+        backend = self._find(request)
+        if backend is None:
+            return web.json_response({"error": "unknown backend"}, status=404)
+        backend.draining = False
+        return web.json_response(backend.to_dict())
+
+
+def create_app(router: Router) -> web.Application:
+    app = web.Application(client_max_size=256 * 1024**2)
+    app.on_startup.append(router.on_startup)
+    app.on_cleanup.append(router.on_cleanup)
+    app.router.add_post("/v1/chat/completions", router.proxy)
+    app.router.add_post("/v1/completions", router.proxy)
+    app.router.add_get("/v1/models", router.proxy)
+    app.router.add_get("/health", router.health)
+    app.router.add_get("/router/status", router.status)
+    app.router.add_post("/router/drain", router.drain)
+    app.router.add_post("/router/undrain", router.undrain)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Роутер/балансировщик перед несколькими vLLM серверами"
+    )
+
+    parser.add_argument(
+        "--backend",
+        action="append",
+        required=True,
+        help="URL реплики (можно указать несколько раз)"
+    )
+
+    parser.add_argument(
+        "--host",
+        default="0.0.0.0",
+        help="Host роутера (по умолчанию: 0.0.0.0)"
+    )
+
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=8000,
+        help="Порт роутера (по умолчанию: 8000)"
+    )
+
+    parser.add_argument(
+        "--policy",
+        choices=POLICIES,
+        default="least-outstanding",
+        help="Маршрутизация: least-outstanding или prefix (affinity по system prompt)"
+    )
+
+    parser.add_argument(
+        "--affinity-slack",
+        type=int,
+        default=8,
+        help="Насколько реплика по affinity может быть загружена больше самой "
+             "свободной, прежде чем запрос уйдет на свободную (по умолчанию: 8)"
+    )
+
+    parser.add_argument(
+        "--health-interval",
+        type=float,
+        default=5.0,
+        help="Интервал health check, секунды (по умолчанию: 5)"
+    )
+
+    parser.add_argument(
+        "--eject-after",
+        type=int,
+        default=3,
+        help="Ошибок подряд до исключения реплики (по умолчанию: 3)"
+    )
+
+    args = parser.parse_args()
+
+    router = Router(
+        args.backend,
+        policy=args.policy,
+        affinity_slack=args.affinity_slack,
+        health_interval=args.health_interval,
+        eject_after=args.eject_after,
+    )
+
+    print("=" * 70)
+    print("🔀 vLLM Router")
+    print("=" * 70)
+    print(f"🌐 http://{args.host}:{args.port}/v1")
+    print(f"📐 Политика: {args.policy}")
+    for backend in router.backends:
+        print(f"   - {backend.url}")
+    print(f"📋 Статус: http://localhost:{args.port}/router/status")
+    print("=" * 70)
+
+    # Отключение клиента отменяет handler, а с ним и запрос к реплике
+    web.run_app(
+        create_app(router), host=args.host, port=args.port, print=None,
+        handler_cancellation=True,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,57 @@
 #!/usr/bin/env python3
 """
 vLLM OpenAI-совместимый API сервер
-Запуск: python vllm_server.py
+Модели, их настройки и профили - в models.yaml (model_registry.py)
+
+Запуск:
+    python vllm_server.py --model qwen3-vl-2b
+    python vllm_server.py --model qwen-7b --profile throughput
+    python vllm_server.py --list-models
 """
 
 import argparse
+import importlib.util
+import json
 import os
-from vllm.entrypoints.openai.api_server import run_server
-from vllm.engine.arg_utils import AsyncEngineArgs
-from vllm.entrypoints.openai.cli_args import make_arg_parser
+import shlex
+import socket
+import subprocess
+import sys
+from typing import Any, Dict, List
+
+# vllm/torch импортируются только перед самим запуском сервера: --help,
+# --dry-run и ошибки конфигурации не ждут их загрузки (проверка:
+# check_import_time.py)
+from model_registry import (
+    DEFAULT_REGISTRY, SERVED_MODEL_NAME, engine_args, format_models, load_registry, to_cli_args,
+)
+
+
+def port_in_use(host: str, port: int) -> bool:
+    """Занят ли порт (сервер упал бы с ним только после загрузки модели)"""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            sock.bind((host, port))
+        except OSError:
+            return True
+    return False
+
+
+def preflight_errors(engine: Dict[str, Any]) -> List[str]:
+    """Проверки, которые дешевле сделать до импорта vLLM и загрузки модели"""
+    errors = []
+    if importlib.util.find_spec("vllm") is None:
+        errors.append("vLLM не установлен в текущем окружении (см. Установка в README)")
+    media = engine.get("allowed_local_media_path")
+    if media and not os.path.isdir(media):
+        errors.append(f"--allowed-local-media-path: директория не найдена: {media}")
+    model = os.path.expanduser(str(engine["model"]))
+    if model.startswith((".", "/", "~")) and not os.path.isdir(model):
+        errors.append(f"Локальная модель не найдена: {model}")
+    if port_in_use(engine.get("host", "0.0.0.0"), int(engine.get("port", 8000))):
+        errors.append(f"Порт {engine.get('port', 8000)} уже занят (другой сервер?)")
+    return errors
 
 
 def main():
@@ -16,8 +59,19 @@ def main():
     
     # Основные параметры
     parser.add_argument("--model", type=str, 
-                       default="Qwen/Qwen2.5-7B-Instruct",
-                       help="Название модели из HuggingFace")
+                       default="qwen-7b",
+                       help="Модель из models.yaml (qwen3-vl-2b, qwen-7b, ...) или HuggingFace ID")
+    
+    parser.add_argument("--profile", type=str,
+                       default=None,
+                       help="Профиль из models.yaml: latency, throughput, long-context")
+    
+    parser.add_argument("--registry", type=str,
+                       default=DEFAULT_REGISTRY,
+                       help="Файл реестра моделей (по умолчанию: models.yaml рядом со скриптом)")
+    
+    parser.add_argument("--list-models", action="store_true",
+                       help="Показать модели и профили реестра и выйти")
     
     parser.add_argument("--host", type=str, 
                        default="0.0.0.0",
@@ -27,8 +81,13 @@ def main():
                        default=8000,
                        help="Порт сервера")
     
+    parser.add_argument("--served-model-name", type=str,
+                       default=SERVED_MODEL_NAME,
+                       help=f"Имя модели в API (по умолчанию: {SERVED_MODEL_NAME}, его ждут клиенты)")
+    
+    # Переопределения реестра (по умолчанию - значения модели/профиля)
     parser.add_argument("--gpu-memory-utilization", type=float, 
-                       default=0.9,
+                       default=None,
                        help="Доля GPU памяти для использования (0.0-1.0)")
     
     parser.add_argument("--max-model-len", type=int, 
@@ -36,23 +95,156 @@ def main():
                        help="Максимальная длина контекста")
     
     parser.add_argument("--tensor-parallel-size", type=int, 
-                       default=1,
+                       default=None,
                        help="Количество GPU для параллелизма")
     
+    parser.add_argument("--cpu-offload-gb", type=float,
+                       default=None,
+                       help="Количество GB RAM для CPU оффлоада весов")
+    
     parser.add_argument("--trust-remote-code", action="store_true",
+                       default=None,
                        help="Доверять удаленному коду (для некоторых моделей)")
     
-    args = parser.parse_args()
+    parser.add_argument("--allowed-local-media-path", type=str,
+                       default=None,
+                       help="Директория, из которой сервер может читать изображения по file:// URL "
+                            "(по умолчанию для VLM: spool директория клиентов ~/.cache/vllm-setup/media)")
+    
+    parser.add_argument("--weights-dir", type=str,
+                       default=None,
+                       help="Брать веса из копии stage_weights.py: <dir>/<org>--<name> (native FS)")
+    
+    parser.add_argument("--prewarm", action="store_true",
+                       help="Перед запуском прогреть page cache весами (с --weights-dir)")
+    
+    parser.add_argument("--dry-run", action="store_true",
+                       help="Только показать итоговую команду vLLM")
+    
+    parser.add_argument("--no-probe", action="store_true",
+                       help="Не проверять возможности окружения (WSL2, unified memory, P2P)")
+    
+    parser.add_argument("--reprobe", action="store_true",
+                       help="Проверить возможности окружения заново, игнорируя кэш")
+    
+    parser.add_argument("--profile-startup", action="store_true",
+                       help="Запустить vLLM подпроцессом и показать хронологию холодного старта "
+                            "(история: startup_profiler.py history)")
+    
+    # Остальные аргументы передаются vLLM как есть
+    args, extra = parser.parse_known_args()
+    
+    try:
+        registry = load_registry(args.registry)
+        if args.list_models:
+            print(format_models(registry))
+            return
+        entry = registry.model(args.model)
+        profile = registry.profile(args.profile)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+    
+    overrides = {
+        "host": args.host,
+        "port": args.port,
+        "served_model_name": args.served_model_name,
+        "gpu_memory_utilization": args.gpu_memory_utilization,
+        "max_model_len": args.max_model_len,
+        "tensor_parallel_size": args.tensor_parallel_size,
+        "cpu_offload_gb": args.cpu_offload_gb,
+        "trust_remote_code": args.trust_remote_code,
+    }
+    if args.allowed_local_media_path:
+        overrides["allowed_local_media_path"] = os.path.realpath(
+            os.path.expanduser(args.allowed_local_media_path)
+        )
+    elif entry.vlm:
+        # Spool директория клиентов: --transport file/auto работает без флагов
+        from server_info import MEDIA_SPOOL_DIR
+        overrides["allowed_local_media_path"] = os.path.realpath(MEDIA_SPOOL_DIR)
+    engine = engine_args(registry, entry, profile, overrides)
+    
+    staged = None
+    if args.weights_dir:
+        from stage_weights import staged_dir
+        staged = staged_dir(args.weights_dir, entry.model_id)
+        if os.path.isfile(os.path.join(staged, "config.json")):
+            engine["model"] = staged
+        else:
+            print(f"⚠️  Копия весов не найдена: {staged} "
+                  f"(python stage_weights.py {args.model} --dest {args.weights_dir})")
+            staged = None
+    served, unsupported = entry.served_sampling()
     
     print("=" * 70)
     print("🚀 Запуск vLLM API сервера")
     print("=" * 70)
-    print(f"📦 Модель: {args.model}")
+    print(f"📦 Модель: {entry.name}" + (f" ({entry.model_id})" if entry.model_id != entry.name else ""))
+    if profile:
+        print(f"🎛️  Профиль: {profile.name} - {profile.description}")
     print(f"🌐 Host: {args.host}")
     print(f"🔌 Port: {args.port}")
-    print(f"💾 GPU Memory: {args.gpu_memory_utilization * 100}%")
-    print(f"📏 Max context: {args.max_model_len or 'auto'}")
+    print(f"🏷️  Served name: {engine['served_model_name']}")
+    if "gpu_memory_utilization" in engine:
+        print(f"💾 GPU Memory: {engine['gpu_memory_utilization'] * 100:.0f}%")
+    print(f"📏 Max context: {engine.get('max_model_len') or 'auto'}")
+    if staged:
+        print(f"💽 Веса: {staged}")
+    if engine.get("quantization"):
+        print(f"🔢 Quantization: {engine['quantization']}")
+    if engine.get("cpu_offload_gb"):
+        print(f"💿 CPU Offload: {engine['cpu_offload_gb']} GB")
+    if entry.vlm:
+        print(f"🖼️  Vision-Language Model: до {engine.get('limit_mm_per_prompt', {}).get('image', 1)} изображений в промпте")
+    if engine.get("allowed_local_media_path"):
+        print(f"📂 Local media: {engine['allowed_local_media_path']} (file:// URL)")
+    if served:
+        print(f"⚙️  Сэмплирование по умолчанию (сервер): {json.dumps(served)}")
+    if unsupported:
+        print(f"⚠️  Не поддерживается --override-generation-config, передавайте в запросе: "
+              f"{json.dumps(unsupported)}")
+    print(f"📈 Мониторинг: python server_monitor.py --api-url http://localhost:{args.port}")
     print("=" * 70)
+    
+    vllm_args = to_cli_args(engine) + extra
+    if args.dry_run:
+        print("python -m vllm.entrypoints.openai.api_server " + " ".join(shlex.quote(a) for a in vllm_args))
+        return
+    
+    if entry.vlm and not args.allowed_local_media_path:
+        os.makedirs(engine["allowed_local_media_path"], exist_ok=True)
+    
+    errors = preflight_errors(engine)
+    if errors:
+        for error in errors:
+            print(f"❌ {error}", file=sys.stderr)
+        sys.exit(1)
+    
+    if args.prewarm and staged:
+        from stage_weights import prewarm, prewarm_warning, weight_files
+        paths = weight_files(staged)
+        warning = prewarm_warning(paths)
+        if warning:
+            print(f"⚠️  {warning}")
+        print(f"🔥 {prewarm(paths).format()}")
+    
+    # Проверка окружения кэшируется по версиям драйвера/torch/vllm/ядра:
+    # полная проверка только при первом запуске или после обновлений
+    if not args.no_probe:
+        from capability_probe import adjust_engine_args, load_or_probe
+        try:
+            caps = load_or_probe(refresh=args.reprobe)
+        except (OSError, ValueError, subprocess.SubprocessError) as e:
+            print(f"⚠️  Проверка окружения не удалась: {e}")
+        else:
+            source = "кэш" if caps.cached else f"проверено за {caps.probe_seconds:.1f}s"
+            print(f"🔍 Окружение ({source}): "
+                  f"{'WSL2, ' if caps.is_wsl else ''}{len(caps.devices)} GPU, "
+                  f"unified memory {'да' if caps.unified_memory else 'нет'}")
+            for note in adjust_engine_args(engine, caps):
+                print(f"   🔧 {note}")
+            vllm_args = to_cli_args(engine) + extra
+    
     print(f"\n✅ Сервер будет доступен по адресу:")
     print(f"   WSL: http://localhost:{args.port}")
     print(f"   Windows: http://localhost:{args.port}")
@@ -62,29 +254,47 @@ def main():
     print(f"   - http://localhost:{args.port}/v1/completions")
     print(f"   - http://localhost:{args.port}/v1/chat/completions")
     print(f"   - http://localhost:{args.port}/docs (Swagger UI)")
+    if entry.vlm:
+        print("\n💡 Пример запроса с изображением:")
+        print(f"   curl http://localhost:{args.port}/v1/chat/completions \\")
+        print("     -H 'Content-Type: application/json' \\")
+        print(f"     -d '{{\"model\": \"{engine['served_model_name']}\", \"messages\": [{{\"role\": \"user\", "
+              "\"content\": [{\"type\": \"image_url\", \"image_url\": {\"url\": \"https://...\"}}, "
+              "{\"type\": \"text\", \"text\": \"Что на картинке?\"}]}], \"max_tokens\": 500}'")
     print("=" * 70)
     print("\n⏳ Загрузка модели (это может занять 30-60 секунд)...\n")
     
+    # Модель, профиль и версии для тегов benchmark_serving.py --store
+    from server_info import write_launch_info
+    from capability_probe import fingerprint_key
+    try:
+        write_launch_info(args.port, {
+            "model": entry.name,
+            "model_id": entry.model_id,
+            "weights": str(staged) if staged else None,
+            "profile": args.profile,
+            "args": " ".join(shlex.quote(a) for a in vllm_args),
+            # media_transport --transport auto выбирает file:// только при этом пути
+            "allowed_local_media_path": engine.get("allowed_local_media_path"),
+            "environment": fingerprint_key(),
+        })
+    except OSError as e:
+        print(f"⚠️  Описание запуска не сохранено: {e}")
+    
     # Запуск через CLI (самый надежный способ)
-    import sys
-    sys.argv = [
-        "vllm.entrypoints.openai.api_server",
-        "--model", args.model,
-        "--host", args.host,
-        "--port", str(args.port),
-        "--gpu-memory-utilization", str(args.gpu_memory_utilization),
-        "--tensor-parallel-size", str(args.tensor_parallel_size),
-    ]
-    
-    if args.max_model_len:
-        sys.argv.extend(["--max-model-len", str(args.max_model_len)])
-    
-    if args.trust_remote_code:
-        sys.argv.append("--trust-remote-code")
-    
-    # Импортируем и запускаем сервер
-    from vllm.entrypoints.openai.api_server import main as vllm_main
-    vllm_main()
+    if args.profile_startup:
+        from startup_profiler import run_profiled
+        sys.exit(run_profiled(
+            [sys.executable, "-m", "vllm.entrypoints.openai.api_server"] + vllm_args,
+            f"http://localhost:{args.port}",
+            meta={"model": entry.name, "profile": args.profile, "args": " ".join(vllm_args)},
+        ))
+    
+    sys.argv = ["vllm.entrypoints.openai.api_server"] + vllm_args
+    
+    # Импортируем и запускаем сервер (как python -m, здесь впервые грузятся vllm/torch)
+    import runpy
+    runpy.run_module("vllm.entrypoints.openai.api_server", run_name="__main__", alter_sys=True)
 
 
 if __name__ == "__main__":